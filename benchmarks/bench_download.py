@@ -0,0 +1,140 @@
+"""Benchmark de downloads: vazão e CPU do servidor por modo de execução
+
+Uso:
+    python benchmarks/bench_download.py [--size-mb 256] [--clients 1 8 32]
+                                        [--servers dev waitress gunicorn]
+
+Para cada modo de servidor, inicia `servidor.py` em um subprocesso sobre uma
+pasta com um arquivo de teste e mede, com clientes keep-alive simultâneos:
+- downloads completos de /download/<hash>;
+- pedidos Range de 4 MiB em posições aleatórias de /preview/<hash>.
+
+Mostra a vazão agregada e os segundos de CPU gastos pelo servidor por GB
+enviado (lidos de /proc, portanto apenas no Linux). No gunicorn, o corpo é
+enviado com sendfile() e o custo de CPU por GB deve ser bem menor.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from load_test import HTTPConnection
+
+SERVER_SCRIPT = os.path.join(BENCH_DIR, '..', 'servidor.py')
+RANGE_SIZE = 4 * 1024 * 1024
+
+
+def cpu_seconds(pid):
+    """CPU (usuário + sistema) do processo e de seus filhos, via /proc"""
+    ticks = os.sysconf('SC_CLK_TCK')
+    total = 0.0
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        total += (int(fields[11]) + int(fields[12])) / ticks
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return total
+    return total + sum(cpu_seconds(child) for child in children)
+
+
+def wait_ready(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f'{base_url}/status', timeout=1).json().get('index_ready'):
+                return
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('servidor não ficou pronto a tempo')
+
+
+async def run_clients(port, path, clients, duration, size):
+    transferred = 0
+    
+    async def client():
+        nonlocal transferred
+        connection = HTTPConnection('127.0.0.1', port)
+        deadline = time.perf_counter() + duration
+        try:
+            while time.perf_counter() < deadline:
+                headers = None
+                if size:
+                    start = random.randrange(0, max(1, size - RANGE_SIZE))
+                    headers = {'Range': f'bytes={start}-{start + RANGE_SIZE - 1}'}
+                status, received = await connection.request(path, headers)
+                transferred += received
+        finally:
+            connection.close()
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return transferred, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=256, help='tamanho do arquivo de teste (MB)')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8, 32],
+                        help='números de clientes simultâneos')
+    parser.add_argument('--servers', nargs='+', default=['dev', 'waitress', 'gunicorn'],
+                        help='modos de servidor a comparar')
+    parser.add_argument('--duration', type=float, default=10, help='segundos por cenário')
+    parser.add_argument('--port', type=int, default=5200)
+    args = parser.parse_args()
+    
+    folder = tempfile.mkdtemp(prefix='bench-download-')
+    size = args.size_mb * 1024 * 1024
+    block = os.urandom(1024 * 1024)
+    with open(os.path.join(folder, 'bench.bin'), 'wb') as f:
+        for _ in range(args.size_mb):
+            f.write(block)
+    
+    print(f"{'servidor':<10}{'cenário':<10}{'clientes':>9}{'MB/s':>10}{'CPU s/GB':>10}")
+    try:
+        for mode in args.servers:
+            process = subprocess.Popen(
+                [sys.executable, SERVER_SCRIPT, str(args.port), '--folder', folder, '--server', mode],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            base_url = f'http://127.0.0.1:{args.port}'
+            try:
+                wait_ready(base_url)
+                file_hash = requests.get(f'{base_url}/files', timeout=10).json()[0]['hash']
+                scenarios = [
+                    ('completo', f'/download/{file_hash}?direct=1', 0),
+                    ('range', f'/preview/{file_hash}', size),
+                ]
+                for label, path, range_size in scenarios:
+                    for clients in args.clients:
+                        cpu_before = cpu_seconds(process.pid)
+                        transferred, elapsed = asyncio.run(
+                            run_clients(args.port, path, clients, args.duration, range_size))
+                        cpu = cpu_seconds(process.pid) - cpu_before
+                        gigabytes = transferred / (1024 ** 3)
+                        rate = transferred / (1024 * 1024) / elapsed
+                        cpu_per_gb = cpu / gigabytes if gigabytes else float('nan')
+                        print(f'{mode:<10}{label:<10}{clients:>9}{rate:>10.1f}{cpu_per_gb:>10.2f}')
+                        sys.stdout.flush()
+            except Exception as e:
+                print(f'{mode:<10}falhou: {e}')
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
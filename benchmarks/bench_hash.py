@@ -0,0 +1,99 @@
+"""Benchmark do cálculo de SHA-256: implementação antiga x FileHasher
+
+Uso:
+    python benchmarks/bench_hash.py [--huge-mb 1024] [--dir PASTA]
+
+Gera arquivos pequenos, médios e um enorme em uma pasta temporária e mede
+MB/s de cada estratégia. Os arquivos acabaram de ser gravados, portanto
+estão no cache de páginas: o resultado mede CPU e cópias em memória, não o
+disco. Para medir o disco, limpe o cache entre as execuções.
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from servidor import FileHasher
+
+
+def legacy_hash(filepath):
+    """Implementação original: blocos de 4 KiB, uma thread"""
+    hash_sha256 = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            hash_sha256.update(chunk)
+    return hash_sha256.hexdigest()
+
+
+def make_files(folder, label, count, size):
+    paths = []
+    block = os.urandom(min(size, 1024 * 1024))
+    for i in range(count):
+        path = os.path.join(folder, f'{label}-{i}.bin')
+        with open(path, 'wb') as f:
+            remaining = size
+            while remaining > 0:
+                f.write(block[:remaining])
+                remaining -= len(block)
+        paths.append(path)
+    return paths
+
+
+def measure(func, paths, total_bytes):
+    started = time.perf_counter()
+    digests = func(paths)
+    elapsed = time.perf_counter() - started
+    return total_bytes / (1024 * 1024) / elapsed, digests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--huge-mb', type=int, default=1024, help='tamanho do arquivo enorme (MB)')
+    parser.add_argument('--dir', help='pasta onde gerar os arquivos (padrão: temporária)')
+    args = parser.parse_args()
+    
+    folder = tempfile.mkdtemp(prefix='bench-hash-', dir=args.dir)
+    engine = FileHasher()
+    engine_mmap = FileHasher(use_mmap=True, mmap_threshold=0)
+    
+    strategies = [
+        ('antigo (4 KiB)', lambda paths: [legacy_hash(p) for p in paths]),
+        ('readinto 1 MiB', lambda paths: [engine.hash_file(p) for p in paths]),
+        ('mmap', lambda paths: [engine_mmap.hash_file(p) for p in paths]),
+        (f'paralelo ({engine.workers} threads)',
+         lambda paths: sorted(d for _, d, _ in engine.hash_many(paths))),
+    ]
+    scenarios = [
+        ('pequenos', 2000, 4 * 1024),
+        ('médios', 32, 8 * 1024 * 1024),
+        ('enorme', 1, args.huge_mb * 1024 * 1024),
+    ]
+    
+    try:
+        print(f"{'cenário':<12}{'estratégia':<24}{'MB/s':>10}")
+        for label, count, size in scenarios:
+            paths = make_files(folder, label, count, size)
+            total = count * size
+            reference = None
+            for name, func in strategies:
+                rate, digests = measure(func, paths, total)
+                digests = sorted(digests)
+                if reference is None:
+                    reference = digests
+                elif digests != reference:
+                    print(f'  hashes divergentes em {name}!')
+                print(f'{label:<12}{name:<24}{rate:>10.1f}')
+            for path in paths:
+                os.remove(path)
+    finally:
+        engine.shutdown()
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Benchmark do download em enxame: vazão total x número de peers
+
+Uso:
+    python benchmarks/bench_swarm.py [--size-mb 64] [--peer-mbps 20] [--peers 1 2 4 8] [--bad-peers 1]
+
+Sobe peers substitutos locais (servidores HTTP mínimos que respondem
+/manifest e /piece a partir da memória), cada um limitado a `--peer-mbps`
+MB/s para simular o enlace de uma máquina da rede, e baixa o mesmo arquivo
+com SwarmDownload usando 1, 2, 4... peers. Com `--bad-peers`, peers extras
+enviam pedaços corrompidos e devem ser banidos sem afetar o resultado.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from servidor import FileHasher, PieceHasher, SwarmDownload, PIECE_SIZE
+
+
+class StandInPeer:
+    """Peer substituto com banda limitada, servindo um arquivo da memória"""
+
+    def __init__(self, data, manifest, mbps, corrupt=False):
+        self.data = data
+        self.manifest = json.dumps(manifest).encode()
+        self.file_hash = manifest['hash']
+        self.bytes_per_s = mbps * 1024 * 1024
+        self.corrupt = corrupt
+        self._link_lock = threading.Lock()
+        self._link_free_at = time.monotonic()
+        peer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                parts = self.path.strip('/').split('/')
+                if parts[:2] == ['manifest', peer.file_hash]:
+                    body = peer.manifest
+                elif parts[:2] == ['piece', peer.file_hash] and len(parts) == 3:
+                    offset = int(parts[2]) * PIECE_SIZE
+                    body = peer.data[offset:offset + PIECE_SIZE]
+                    if peer.corrupt:
+                        body = bytes(len(body))
+                    peer.transmit(len(body))
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def transmit(self, size):
+        """Ocupar o enlace do peer pelo tempo de envio de `size` bytes"""
+        with self._link_lock:
+            start = max(time.monotonic(), self._link_free_at)
+            self._link_free_at = start + size / self.bytes_per_s
+            done_at = self._link_free_at
+        time.sleep(max(0.0, done_at - time.monotonic()))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def build_manifest(data):
+    pieces = PieceHasher()
+    pieces.update(data)
+    fields = pieces.index_fields()
+    digests = fields['piece_digests']
+    return {
+        'hash': hashlib.sha256(data).hexdigest(),
+        'filename': 'bench-swarm.bin',
+        'size': len(data),
+        'piece_size': fields['piece_size'],
+        'piece_count': len(digests) // 32,
+        'merkle_root': fields['merkle_root'],
+        'pieces': [digests[i:i + 32].hex() for i in range(0, len(digests), 32)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=64, help='tamanho do arquivo (MB)')
+    parser.add_argument('--peer-mbps', type=float, default=20, help='banda de cada peer (MB/s)')
+    parser.add_argument('--peers', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='números de peers a testar')
+    parser.add_argument('--bad-peers', type=int, default=0,
+                        help='peers extras que enviam pedaços corrompidos')
+    args = parser.parse_args()
+
+    data = os.urandom(args.size_mb * 1024 * 1024)
+    manifest = build_manifest(data)
+    folder = tempfile.mkdtemp(prefix='bench-swarm-')
+    hasher = FileHasher()
+    print(f"Arquivo de {args.size_mb} MB, peers de {args.peer_mbps:g} MB/s cada"
+          f"{f', +{args.bad_peers} peer(s) corrompido(s)' if args.bad_peers else ''}")
+    print(f"{'peers':>6}{'MB/s':>10}{'tempo s':>10}{'ideal MB/s':>12}{'banidos':>9}{'repetidos':>11}")
+    try:
+        for count in args.peers:
+            peers = [StandInPeer(data, manifest, args.peer_mbps) for _ in range(count)]
+            peers += [StandInPeer(data, manifest, args.peer_mbps, corrupt=True)
+                      for _ in range(args.bad_peers)]
+            part_path = os.path.join(folder, f'{count}.part')
+            download = SwarmDownload(manifest['hash'], [peer.url for peer in peers],
+                                     part_path, hasher)
+            download.run()
+            progress = download.progress()
+            banned = sum(1 for peer in progress['peers'] if peer['banned'])
+            rate = args.size_mb / download.elapsed
+            print(f"{count:>6}{rate:>10.1f}{download.elapsed:>10.2f}"
+                  f"{count * args.peer_mbps:>12.1f}{banned:>9}{progress['duplicate_pieces']:>11}")
+            sys.stdout.flush()
+            os.remove(part_path)
+            for peer in peers:
+                peer.close()
+    finally:
+        hasher.shutdown()
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
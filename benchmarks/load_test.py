@@ -0,0 +1,168 @@
+"""Teste de carga: requisições/s e latência de cauda de /files e /download/<hash>
+
+Uso:
+    python servidor.py 5000 --server waitress --threads 32 &
+    python benchmarks/load_test.py --url http://localhost:5000 --concurrency 100 500 1000
+
+Cada cliente simulado mantém uma conexão HTTP/1.1 keep-alive e faz
+requisições em sequência durante `--duration` segundos. Se o servidor não
+tiver arquivos, um arquivo de teste de `--file-kb` KB é enviado antes.
+Para 1000 clientes, aumente o limite de descritores (ulimit -n 4096).
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+
+class HTTPConnection:
+    """Conexão HTTP/1.1 keep-alive mínima sobre asyncio"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, path, headers=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        extra = ''.join(f'{name}: {value}\r\n' for name, value in (headers or {}).items())
+        self.writer.write(
+            f'GET {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n'
+            f'User-Agent: p2pshare-load-test\r\nConnection: keep-alive\r\n{extra}\r\n'.encode())
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('conexão fechada pelo servidor')
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        received = 0
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                received += size
+                if size == 0:
+                    break
+        else:
+            remaining = int(headers.get('content-length', 0))
+            while remaining:
+                data = await self.reader.read(min(remaining, 1024 * 1024))
+                if not data:
+                    raise ConnectionError('resposta incompleta')
+                remaining -= len(data)
+                received += len(data)
+
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, received
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+async def client(host, port, path, deadline, results):
+    connection = HTTPConnection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status, received = await connection.request(path)
+            except (OSError, ConnectionError, ValueError, asyncio.IncompleteReadError):
+                results['errors'] += 1
+                connection.close()
+                await asyncio.sleep(0.05)
+                continue
+            results['latencies'].append(time.perf_counter() - started)
+            results['bytes'] += received
+            if status >= 400:
+                results['errors'] += 1
+    finally:
+        connection.close()
+
+
+async def run_level(host, port, path, concurrency, duration):
+    results = {'latencies': [], 'errors': 0, 'bytes': 0}
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(client(host, port, path, deadline, results)
+                           for _ in range(concurrency)))
+    results['elapsed'] = time.perf_counter() - started
+    return results
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def pick_file_hash(base_url, file_kb):
+    """Hash de um arquivo do servidor, enviando um arquivo de teste se necessário"""
+    files = requests.get(f'{base_url}/files', timeout=10).json()
+    if isinstance(files, dict):
+        files = files.get('files', [])
+    if files:
+        return files[0]['hash']
+
+    payload = io.BytesIO(os.urandom(file_kb * 1024))
+    response = requests.post(f'{base_url}/upload',
+                             files={'file': ('load-test.bin', payload)}, timeout=60)
+    response.raise_for_status()
+    return response.json()['file_hash']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5000', help='URL base do servidor')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[100, 500, 1000],
+                        help='números de clientes simultâneos a testar')
+    parser.add_argument('--duration', type=float, default=10, help='segundos por cenário')
+    parser.add_argument('--file-kb', type=int, default=64,
+                        help='tamanho do arquivo de teste enviado se o servidor estiver vazio')
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip('/')
+    parts = urlsplit(base_url)
+    host, port = parts.hostname, parts.port or 80
+
+    file_hash = pick_file_hash(base_url, args.file_kb)
+    paths = ['/files', f'/download/{file_hash}?direct=1']
+
+    print(f"{'rota':<30}{'clientes':>9}{'req/s':>10}{'MB/s':>9}"
+          f"{'p50 ms':>9}{'p99 ms':>9}{'p99.9 ms':>10}{'erros':>7}")
+    for path in paths:
+        for concurrency in args.concurrency:
+            results = asyncio.run(run_level(host, port, path, concurrency, args.duration))
+            latencies = sorted(results['latencies'])
+            rate = len(latencies) / results['elapsed']
+            throughput = results['bytes'] / results['elapsed'] / (1024 * 1024)
+            label = path if len(path) <= 28 else path[:25] + '...'
+            print(f"{label:<30}{concurrency:>9}{rate:>10.0f}{throughput:>9.1f}"
+                  f"{percentile(latencies, 0.50) * 1000:>9.1f}"
+                  f"{percentile(latencies, 0.99) * 1000:>9.1f}"
+                  f"{percentile(latencies, 0.999) * 1000:>10.1f}"
+                  f"{results['errors']:>7}")
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
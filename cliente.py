@@ -0,0 +1,170 @@
+"""Cliente de linha de comando: baixa arquivos em enxame e envia arquivos sem retransmitir duplicados
+
+Uso:
+    python cliente.py download <hash> --peer http://192.168.0.20:5000 --peer http://192.168.0.21:5000
+    python cliente.py download <hash> --peer localhost:5000 -o video.mp4
+    python cliente.py upload video.mp4 --server localhost:5000
+
+No download, os servidores informados também são consultados em
+/locate/<hash>, então basta indicar um servidor da rede para encontrar os
+outros que têm o arquivo. Cada pedaço é conferido com o manifesto e o
+arquivo completo com o hash antes de ser gravado com o nome final.
+
+No upload, o SHA-256 é calculado antes e enviado a /uploads/check: se o
+servidor já tem o conteúdo, só o nome é registrado e nenhum byte é
+transferido. Senão o arquivo segue pelo upload retomável (/uploads).
+"""
+import argparse
+import os
+import sys
+import threading
+
+import requests
+from werkzeug.utils import secure_filename
+
+from servidor import (FileHasher, PeerRegistry, SwarmDownload, SwarmError,
+                      PEER_TIMEOUT, SWARM_CONNECTIONS_PER_PEER)
+
+
+def locate_sources(file_hash, peers):
+    """Peers informados mais os que eles conhecem com o arquivo"""
+    sources = [PeerRegistry.normalize(url) for url in peers]
+    for url in list(sources):
+        try:
+            response = requests.get(f'{url}/locate/{file_hash}', timeout=PEER_TIMEOUT)
+            response.raise_for_status()
+            sources.extend(response.json()['peers'])
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f'⚠️  {url}: não foi possível consultar outros peers ({e})')
+    return list(dict.fromkeys(sources))
+
+
+def show_progress(download, finished):
+    """Mostrar o andamento na mesma linha até o download terminar"""
+    while not finished.wait(0.5):
+        progress = download.progress()
+        if progress['piece_count']:
+            active = sum(1 for peer in progress['peers'] if not peer['banned'])
+            print(f"\r{progress['pieces_done']}/{progress['piece_count']} pedaços "
+                  f"de {active} peer(s)", end='', flush=True)
+    print()
+
+
+def download(args):
+    """Baixar um arquivo de vários peers ao mesmo tempo"""
+    file_hash = args.hash.lower()
+    sources = ([PeerRegistry.normalize(url) for url in args.peer] if args.no_locate
+               else locate_sources(file_hash, args.peer))
+    print(f'🔗 Baixando de {len(sources)} peer(s)')
+
+    output_dir = os.path.dirname(os.path.abspath(args.output)) if args.output else os.getcwd()
+    part_path = os.path.join(output_dir, f'.{file_hash[:16]}.part')
+    hasher = FileHasher()
+    download = SwarmDownload(file_hash, sources, part_path, hasher,
+                             connections_per_peer=args.connections)
+
+    finished = threading.Event()
+    reporter = threading.Thread(target=show_progress, args=(download, finished), daemon=True)
+    reporter.start()
+    try:
+        download.run()
+    except (SwarmError, OSError) as e:
+        error = e
+    else:
+        error = None
+    finally:
+        finished.set()
+        reporter.join()
+        hasher.shutdown()
+    if error is not None:
+        print(f'❌ {error}')
+        sys.exit(1)
+
+    output = args.output or secure_filename(download.manifest['filename']) or file_hash
+    os.replace(part_path, output)
+
+    size_mb = download.manifest['size'] / (1024 * 1024)
+    print(f'✅ {output}: {size_mb:.1f} MB em {download.elapsed:.1f}s '
+          f'({size_mb / max(download.elapsed, 1e-9):.1f} MB/s)')
+    for peer in download.progress()['peers']:
+        status = f"banido: {peer['banned']}" if peer['banned'] else f"{peer['mb_per_s'] or 0} MB/s"
+        print(f"   {peer['url']:<35} {peer['pieces']:>6} pedaços  {status}")
+
+
+def upload(args):
+    """Enviar um arquivo, pulando a transferência se o servidor já tiver o conteúdo"""
+    server = PeerRegistry.normalize(args.server)
+    filename = os.path.basename(args.file)
+    size = os.path.getsize(args.file)
+
+    hasher = FileHasher()
+    try:
+        sha256 = hasher.hash_file(args.file)
+    finally:
+        hasher.shutdown()
+    metadata = {'filename': filename, 'size': size, 'sha256': sha256}
+
+    try:
+        response = requests.post(f'{server}/uploads/check', json=metadata, timeout=PEER_TIMEOUT)
+        response.raise_for_status()
+        result = response.json()
+        if not result['exists']:
+            result = resumable_upload(server, args.file, metadata)
+    except (requests.RequestException, ValueError, KeyError) as e:
+        print(f'❌ {e}')
+        sys.exit(1)
+
+    if result['exists']:
+        print('♻️  O servidor já tinha o conteúdo: nenhum byte enviado')
+    print(f"✅ {result['filename']}: {result['share_link']}")
+
+
+def resumable_upload(server, path, metadata):
+    """Enviar o arquivo em pedaços pela sessão de upload retomável"""
+    response = requests.post(f'{server}/uploads', json=metadata, timeout=PEER_TIMEOUT)
+    response.raise_for_status()
+    session = response.json()
+    upload_url = f"{server}/uploads/{session['upload_id']}"
+
+    with open(path, 'rb') as f:
+        for offset in range(0, metadata['size'], session['chunk_size']):
+            f.seek(offset)
+            response = requests.put(upload_url, params={'offset': offset},
+                                    data=f.read(session['chunk_size']))
+            response.raise_for_status()
+            sent = min(offset + session['chunk_size'], metadata['size'])
+            print(f"\r{sent * 100 // metadata['size']}% enviado", end='', flush=True)
+    if metadata['size']:
+        print()
+
+    response = requests.post(f'{upload_url}/finalize')
+    response.raise_for_status()
+    return dict(response.json(), exists=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    download_parser = commands.add_parser('download', help='baixar um arquivo em enxame')
+    download_parser.add_argument('hash', help='hash SHA-256 do arquivo')
+    download_parser.add_argument('--peer', action='append', required=True, metavar='URL',
+                                 help='URL de um servidor com o arquivo (pode ser repetido)')
+    download_parser.add_argument('-o', '--output', help='arquivo de saída (padrão: nome original)')
+    download_parser.add_argument('--connections', type=int, default=SWARM_CONNECTIONS_PER_PEER,
+                                 help=f'pedidos simultâneos por peer (padrão: {SWARM_CONNECTIONS_PER_PEER})')
+    download_parser.add_argument('--no-locate', action='store_true',
+                                 help='usar apenas os peers informados')
+    download_parser.set_defaults(handler=download)
+
+    upload_parser = commands.add_parser('upload', help='enviar um arquivo a um servidor')
+    upload_parser.add_argument('file', help='arquivo a enviar')
+    upload_parser.add_argument('--server', required=True, metavar='URL', help='URL do servidor')
+    upload_parser.set_defaults(handler=upload)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,2966 @@
 import os
+import bisect
+import heapq
+import itertools
+import codecs
 import hashlib
+import io
+import select
+import shutil
+import signal
+import subprocess
+import json
+import logging
+import mimetypes
+import mmap
+import base64
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+import sqlite3
+import tempfile
 import threading
 import time
-from flask import Flask, request, jsonify, send_file, render_template_string, redirect
+import queue
+import unicodedata
+import uuid
+import random
+import re
+from urllib.parse import quote
+from flask import Flask, Request, Response, request, jsonify, render_template, redirect, current_app
+from jinja2 import DictLoader
+from werkzeug.datastructures import Headers
+from werkzeug.formparser import FormDataParser, MultiPartParser
+from werkzeug.http import http_date
 from werkzeug.utils import secure_filename
 import requests
 import socket
+import struct
+import sys
+import zlib
+
+try:
+    import zstandard  # Opcional: compressão zstd no armazenamento (pip install zstandard)
+except ImportError:
+    zstandard = None
+
+try:
+    from charset_normalizer import from_bytes as detect_charset  # Instalado com o requests
+except ImportError:
+    detect_charset = None
+
+try:
+    from PIL import Image, ImageOps  # Opcional: miniaturas de imagens (pip install pillow)
+except ImportError:
+    Image = None
+
+# Intervalos do monitor do Ngrok (segundos)
+NGROK_CHECK_INTERVAL = 5      # Verificação normal
+NGROK_MAX_BACKOFF = 60        # Espera máxima quando a API do Ngrok está fora do ar
+NGROK_MIN_INTERVAL = 1        # Intervalo mínimo entre verificações
+NGROK_REFRESH_TIMEOUT = 4     # Espera máxima por uma verificação pedida
+
+# Motor de hash
+HASH_BUFFER_SIZE = 1024 * 1024               # Buffer reutilizado por thread em readinto()
+HASH_WORKERS = min(8, os.cpu_count() or 1)   # Threads para calcular vários arquivos de uma vez
+HASH_MMAP_THRESHOLD = 64 * 1024 * 1024       # Tamanho a partir do qual se usa mmap (se ativado)
+
+# Endereçamento por pedaços: cada arquivo é dividido em pedaços de tamanho fixo
+# com SHA-256 próprio, combinados em uma árvore de Merkle
+PIECE_SIZE = 1024 * 1024
+
+# Varredura da pasta compartilhada na inicialização
+SCAN_BATCH_SIZE = 500                        # Arquivos gravados no índice por transação
+
+# Tamanho dos blocos lidos do corpo da requisição e gravados em disco no upload
+UPLOAD_BUFFER_SIZE = 1024 * 1024
+
+# Uploads retomáveis em pedaços
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024   # Tamanho sugerido aos clientes para cada PUT
+UPLOAD_SESSION_TTL = 24 * 3600        # Sessões paradas por mais tempo são descartadas (segundos)
+UPLOAD_GC_INTERVAL = 600              # Intervalo entre limpezas de sessões antigas (segundos)
+UPLOAD_MAX_SIZE = 1024 ** 4           # Maior arquivo aceito (1 TiB), além do espaço livre em disco
+UPLOAD_MAX_SESSIONS = 256             # Sessões abertas ao mesmo tempo
+
+# Modo de produção (waitress): um processo, pool de threads
+SERVER_THREADS = 16                # Threads que atendem requisições
+SERVER_CONNECTION_LIMIT = 1000     # Conexões simultâneas aceitas antes de recusar novas
+SERVER_CHANNEL_TIMEOUT = 120       # Conexões keep-alive ociosas são fechadas após (segundos)
+SERVER_BACKLOG = 2048              # Fila de conexões pendentes no socket
+
+# Envio de arquivos
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024  # Bloco de leitura quando o servidor não tem wsgi.file_wrapper
+MAX_RANGES = 64                    # Pedidos com mais intervalos recebem o arquivo inteiro
+
+# Pré-visualização de texto: só a janela pedida é lida do disco
+TEXT_PREVIEW_WINDOW = 64 * 1024              # Bytes por janela (padrão)
+TEXT_PREVIEW_MAX_WINDOW = 1024 * 1024        # Maior janela aceita
+TEXT_PREVIEW_CACHE_BYTES = 32 * 1024 * 1024  # Memória para janelas já decodificadas
+
+# Cache em memória de objetos pequenos (conteúdo e miniaturas), pelo hash
+HOT_CACHE_BYTES = 64 * 1024 * 1024  # Memória total do cache (0 desliga)
+HOT_CACHE_MAX_OBJECT = 256 * 1024   # Objetos maiores são sempre lidos do disco
+
+# Contadores de downloads
+DOWNLOAD_FLUSH_INTERVAL = 5   # Intervalo entre gravações dos contadores no índice (segundos)
+DOWNLOAD_RATE_WINDOW = 60     # Janela usada para calcular downloads por minuto (segundos)
+COUNTER_STRIPES = 32          # Dicionários de contadores, escolhidos pelo id da thread
+
+# Rede de servidores (peers)
+PEER_SYNC_INTERVAL = 10         # Intervalo entre sincronizações de catálogo (segundos)
+PEER_TIMEOUT = 3                # Tempo máximo de cada requisição a um peer (segundos)
+PEER_MAX_FAILURES = 3           # Falhas seguidas até o peer ser considerado offline
+PEER_EXPIRY = 300               # Peers descobertos são esquecidos após esse tempo sem contato
+CATALOG_PAGE_LIMIT = 1000       # Alterações de catálogo por resposta de /catalog/changes
+DISCOVERY_GROUP = '239.255.77.77'  # Grupo multicast da descoberta na rede local
+DISCOVERY_PORT = 5077
+DISCOVERY_INTERVAL = 15         # Intervalo entre anúncios na rede local (segundos)
+
+# Download em enxame: pedaços de um arquivo baixados de vários peers ao mesmo tempo
+SWARM_CONNECTIONS_PER_PEER = 2  # Pedidos simultâneos a cada peer
+SWARM_TIMEOUT = 30              # Tempo máximo de cada pedido de pedaço (segundos)
+SWARM_MAX_ERRORS = 3            # Falhas seguidas de rede até o peer ser banido
+SWARM_SLOW_FACTOR = 0.25        # Peers abaixo dessa fração da vazão do melhor não pegam os últimos pedaços
+
+# Replicação automática entre peers
+REPLICATION_FACTOR = 1                      # Cópias desejadas de cada arquivo, contando a local (1 = desligada)
+REPLICATION_INTERVAL = 30                   # Intervalo entre verificações das réplicas (segundos)
+REPLICATION_VNODES = 64                     # Pontos de cada peer no anel de hash consistente
+REPLICATION_RETRY = 300                     # Pedido de réplica sem resultado é refeito após (segundos)
+REPLICATION_MAX_REQUESTS = 8                # Réplicas em andamento nos peers ao mesmo tempo
+REPLICATION_BANDWIDTH = 10 * 1024 * 1024    # Banda máxima para enviar pedaços a réplicas (bytes/s)
+REPLICATION_BLOCK_SIZE = 64 * 1024          # Bloco de envio dos pedaços limitados
+
+# Páginas e arquivos estáticos
+FILES_PAGE_LIMIT = 500           # Máximo de arquivos por página em /files
+ASSET_MAX_AGE = 365 * 24 * 3600  # Cache de respostas imutáveis: /assets/ versionados e conteúdo pelo hash
+
+# Nome do banco de dados do índice, guardado dentro da pasta compartilhada
+INDEX_FILENAME = '.index.sqlite3'
+
+# Armazenamento por conteúdo: objects/<2 primeiros dígitos do hash>/<restante>
+OBJECTS_DIRNAME = 'objects'
+OBJECT_GC_GRACE = 3600  # Objetos sem entrada no índice só são apagados após (segundos)
+
+# Compressão no armazenamento: o conteúdo compressível é guardado comprimido em
+# quadros independentes (um por pedaço), para ler qualquer trecho sem descomprimir tudo
+STORAGE_COMPRESSION = 'gzip'             # Codificação: 'gzip', 'zstd' ou None (desligada)
+COMPRESSION_LEVELS = {'gzip': 6, 'zstd': 3}
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+COMPRESSION_SAMPLE_SIZE = 256 * 1024     # Amostra do início do arquivo usada na decisão
+COMPRESSION_MIN_RATIO = 0.8              # Comprimir só se encolher para menos desta fração
+COMPRESSION_MIN_SIZE = 4 * 1024          # Arquivos menores são guardados como estão
+COMPRESSION_INTERVAL = 60                # Intervalo entre passadas de compressão (segundos)
+
+# Miniaturas de imagens (Pillow) e quadros de capa de vídeos (ffmpeg), ambos opcionais
+THUMBNAIL_SIZES = {'small': 320, 'large': 1280}  # Maior lado de cada tamanho, em pixels
+THUMBNAIL_DIRNAME = '.thumbnails'                # Cache em disco, dentro da pasta compartilhada
+THUMBNAIL_CACHE_BYTES = 512 * 1024 * 1024        # Espaço máximo do cache (os menos usados saem)
+THUMBNAIL_WORKERS = 2                            # Threads que geram miniaturas
+THUMBNAIL_TIMEOUT = 30                           # Espera máxima por uma miniatura (segundos)
+THUMBNAIL_POSTER_SECOND = 1                      # Instante do vídeo usado como capa
+THUMBNAIL_QUALITY = 80                           # Qualidade JPEG
+
+# Atualizações ao vivo da interface (Server-Sent Events em /events)
+EVENTS_MAX_STREAMS = 100   # Conexões simultâneas (waitress/gunicorn: threads / EVENTS_THREAD_DIVISOR)
+EVENTS_THREAD_DIVISOR = 4  # Em produção, no máximo 1/4 das threads presas em /events
+EVENTS_POLL_INTERVAL = 15  # Intervalo de /events/poll nas páginas sem conexão ao vivo (segundos)
+EVENTS_QUEUE_SIZE = 256    # Eventos pendentes por conexão antes de desligar um cliente lento
+EVENTS_KEEPALIVE = 15      # Intervalo entre comentários que mantêm a conexão aberta (segundos)
+EVENTS_RETRY = 3000        # Espera sugerida ao navegador antes de reconectar (milissegundos)
+
+# Escalonador de banda (0 = sem limite; ajustável em /admin/bandwidth)
+BANDWIDTH_DOWNLOAD_RATE = 0        # Limite global de envio (bytes/s)
+BANDWIDTH_UPLOAD_RATE = 0          # Limite global de recebimento (bytes/s)
+BANDWIDTH_PER_IP_RATE = 0          # Limite por cliente, em cada sentido (bytes/s)
+BANDWIDTH_BLOCK_SIZE = 64 * 1024   # Bytes liberados de cada vez pelo escalonador
+BANDWIDTH_BURST = 0.25             # Rajada máxima, em segundos da taxa
+BANDWIDTH_WEIGHTS = {              # Parcela de cada classe quando disputam o limite global
+    'interactive': 8,              # Pré-visualizações (/preview)
+    'bulk': 2,                     # Downloads, uploads e pedaços pedidos por outros peers
+    'background': 1,               # Replicação
+}
+
+# Métricas em /metrics (formato texto do Prometheus)
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)  # Segundos
+METRICS_NGROK_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 3)                                  # Segundos
+TRANSFER_ENDPOINTS = {  # Rotas contadas (e limitadas) como transferências, por sentido
+    'upload_file': 'upload',
+    'put_upload_chunk': 'upload',
+    'download_file': 'download',
+    'preview_file': 'download',
+    'get_file_piece': 'download',
+}
+
+
+class FileIndex:
+    """Índice persistente dos arquivos compartilhados (SQLite em modo WAL)
+    
+    As rotas leem de uma cópia em memória, carregada no primeiro acesso;
+    toda alteração é gravada em transação antes de ser publicada na memória.
+    """
+    
+    # Colunas da tabela `files`; colunas novas são acrescentadas
+    # automaticamente a índices criados por versões anteriores
+    SCHEMA = {
+        'hash': 'TEXT PRIMARY KEY',
+        'filename': 'TEXT NOT NULL',
+        'filepath': 'TEXT NOT NULL',
+        'size': 'INTEGER NOT NULL',
+        'mtime': 'REAL',
+        'upload_time': 'REAL NOT NULL',
+        'download_count': 'INTEGER NOT NULL DEFAULT 0',
+        'inode': 'INTEGER',
+        'mtime_ns': 'INTEGER',
+        'piece_size': 'INTEGER',
+        'merkle_root': 'TEXT',
+        'encoding': 'TEXT',  # None: ainda não avaliado; 'identity', 'gzip' ou 'zstd'
+    }
+    COLUMNS = tuple(SCHEMA)
+    
+    # Ordenações aceitas por `page`/`iter_files`, cada uma com seu índice SQL
+    SORT_COLUMNS = {
+        'name': 'filename',
+        'size': 'size',
+        'upload_time': 'upload_time',
+        'download_count': 'download_count',
+    }
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            columns = ', '.join(f'{name} {kind}' for name, kind in self.SCHEMA.items())
+            self._conn.execute(f'CREATE TABLE IF NOT EXISTS files ({columns})')
+            existing = {row[1] for row in self._conn.execute('PRAGMA table_info(files)')}
+            for name, kind in self.SCHEMA.items():
+                if name not in existing:
+                    self._conn.execute(f'ALTER TABLE files ADD COLUMN {name} {kind}')
+            # Hashes dos pedaços ficam fora da cópia em memória
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS pieces (
+                    hash TEXT PRIMARY KEY,
+                    digests BLOB NOT NULL
+                )
+            ''')
+            # Onde começa cada quadro dos objetos guardados comprimidos
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS frames (
+                    hash TEXT PRIMARY KEY,
+                    frame_size INTEGER NOT NULL,
+                    offsets BLOB NOT NULL
+                )
+            ''')
+            # Índices secundários para paginação ordenada; o hash desempata
+            for sort, column in self.SORT_COLUMNS.items():
+                collate = ' COLLATE NOCASE' if sort == 'name' else ''
+                self._conn.execute(f'CREATE INDEX IF NOT EXISTS files_by_{sort} '
+                                   f'ON files ({column}{collate}, hash)')
+            self._fts = self._create_name_search()
+            self.catalog_id = self._create_change_log()
+            self._create_names()
+        self._files = None  # Cópia em memória, carregada sob demanda
+        self._listeners = []  # Callbacks chamados após adições e remoções
+    
+    def _create_names(self):
+        """Criar a tabela de nomes: cada conteúdo (hash) pode ter vários nomes
+        
+        O número de nomes é a contagem de referências do objeto; quando o
+        último nome sai, o arquivo sai do índice e o objeto pode ser apagado.
+        """
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'names'").fetchone()
+        if exists:
+            return
+        self._conn.execute('''
+            CREATE TABLE names (
+                hash TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                upload_time REAL NOT NULL,
+                PRIMARY KEY (hash, filename)
+            )
+        ''')
+        self._conn.execute('INSERT INTO names (hash, filename, upload_time) '
+                           'SELECT hash, filename, upload_time FROM files')
+    
+    def _create_change_log(self):
+        """Criar o registro de alterações lido pelos peers; retorna o ID do catálogo
+        
+        Cada arquivo tem no máximo uma linha (a última alteração, 'add' ou
+        'remove'), então o registro cresce com o número de arquivos e não
+        com o número de alterações. O ID muda se o banco for recriado, e os
+        peers então releem o catálogo do início.
+        """
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        ''')
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'catalog_id'").fetchone()
+        if row:
+            return row[0]
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                hash TEXT NOT NULL UNIQUE,
+                op TEXT NOT NULL,
+                filename TEXT,
+                size INTEGER
+            )
+        ''')
+        self._conn.execute("INSERT INTO changes (hash, op, filename, size) "
+                           "SELECT hash, 'add', filename, size FROM files")
+        catalog_id = uuid.uuid4().hex
+        self._conn.execute("INSERT INTO meta (key, value) VALUES ('catalog_id', ?)", (catalog_id,))
+        return catalog_id
+    
+    def _create_name_search(self):
+        """Criar o índice de trigramas para busca por trecho do nome (FTS5)
+        
+        Retorna False se o SQLite não tiver FTS5 com trigramas; a busca
+        por trecho passa então a percorrer a tabela com LIKE.
+        """
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'files_fts'").fetchone()
+        if exists:
+            return True
+        try:
+            self._conn.execute('''
+                CREATE VIRTUAL TABLE files_fts
+                USING fts5(hash UNINDEXED, filename, tokenize = 'trigram')
+            ''')
+        except sqlite3.OperationalError:
+            return False
+        rows = self._conn.execute('SELECT hash, filename FROM files')
+        self._conn.executemany('INSERT INTO files_fts (rowid, hash, filename) VALUES (?, ?, ?)',
+                               [(self._fts_rowid(file_hash), file_hash, filename)
+                                for file_hash, filename in rows])
+        return True
+    
+    @staticmethod
+    def _fts_rowid(file_hash):
+        """Chave inteira estável do arquivo no índice de busca"""
+        return int(file_hash[:15], 16)
+    
+    def _loaded(self):
+        """Carregar o índice do disco na primeira leitura"""
+        if self._files is None:
+            with self._lock:
+                if self._files is None:
+                    cursor = self._conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM files")
+                    self._files = {row[0]: dict(zip(self.COLUMNS, row)) for row in cursor}
+        return self._files
+    
+    def add(self, info):
+        """Inserir ou substituir um arquivo no índice"""
+        self.add_many([info])
+    
+    def add_many(self, infos):
+        """Inserir ou substituir vários arquivos em uma única transação
+        
+        Se `info` tiver 'piece_digests', os hashes dos pedaços são gravados junto.
+        """
+        rows = [tuple(info.get(column) for column in self.COLUMNS) for info in infos]
+        pieces = [(info['hash'], info['piece_digests']) for info in infos
+                  if info.get('piece_digests') is not None]
+        with self._lock:
+            files = self._loaded()
+            with self._conn:
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO files ({', '.join(self.COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(self.COLUMNS))})", rows)
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO pieces (hash, digests) VALUES (?, ?)', pieces)
+                if self._fts:
+                    self._conn.executemany(
+                        'INSERT OR REPLACE INTO files_fts (rowid, hash, filename) VALUES (?, ?, ?)',
+                        [(self._fts_rowid(row[0]), row[0], row[1]) for row in rows])
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO changes (hash, op, filename, size) VALUES (?, 'add', ?, ?)",
+                    [(info['hash'], info['filename'], info['size']) for info in infos])
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO names (hash, filename, upload_time) VALUES (?, ?, ?)',
+                    [(info['hash'], info['filename'], info['upload_time']) for info in infos])
+            for row in rows:
+                files[row[0]] = dict(zip(self.COLUMNS, row))
+        self._notify()
+    
+    def remove(self, file_hash):
+        """Remover um arquivo do índice"""
+        self.remove_many([file_hash])
+    
+    def remove_many(self, hashes):
+        """Remover vários arquivos em uma única transação"""
+        with self._lock:
+            files = self._loaded()
+            with self._conn:
+                self._conn.executemany('DELETE FROM files WHERE hash = ?',
+                                       [(file_hash,) for file_hash in hashes])
+                self._conn.executemany('DELETE FROM pieces WHERE hash = ?',
+                                       [(file_hash,) for file_hash in hashes])
+                self._conn.executemany('DELETE FROM frames WHERE hash = ?',
+                                       [(file_hash,) for file_hash in hashes])
+                if self._fts:
+                    self._conn.executemany('DELETE FROM files_fts WHERE rowid = ?',
+                                           [(self._fts_rowid(file_hash),) for file_hash in hashes])
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO changes (hash, op) VALUES (?, 'remove')",
+                    [(file_hash,) for file_hash in hashes])
+                self._conn.executemany('DELETE FROM names WHERE hash = ?',
+                                       [(file_hash,) for file_hash in hashes])
+            for file_hash in hashes:
+                files.pop(file_hash, None)
+        self._notify()
+    
+    def add_listener(self, callback):
+        """Registrar callback() chamado após cada lote de arquivos adicionados ou removidos"""
+        self._listeners.append(callback)
+    
+    def _notify(self):
+        for callback in list(self._listeners):
+            try:
+                callback()
+            except Exception as e:
+                print(f"Erro em listener do índice: {e}")
+    
+    def add_name(self, file_hash, filename):
+        """Acrescentar um nome a um conteúdo já indexado; retorna False se já existia"""
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute(
+                    'INSERT OR IGNORE INTO names (hash, filename, upload_time) VALUES (?, ?, ?)',
+                    (file_hash, filename, time.time()))
+        return cursor.rowcount > 0
+    
+    def names(self, file_hash):
+        """Nomes do conteúdo, do mais antigo para o mais recente"""
+        with self._lock:
+            rows = self._conn.execute('SELECT filename FROM names WHERE hash = ? ORDER BY upload_time',
+                                      (file_hash,)).fetchall()
+        return [row[0] for row in rows]
+    
+    def remove_name(self, file_hash, filename):
+        """Retirar um nome; sem nenhum nome restante, o arquivo sai do índice
+        
+        Retorna True quando o conteúdo ficou sem referências.
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute('DELETE FROM names WHERE hash = ? AND filename = ?',
+                                   (file_hash, filename))
+                remaining = self._conn.execute('SELECT COUNT(*) FROM names WHERE hash = ?',
+                                               (file_hash,)).fetchone()[0]
+            if remaining:
+                return False
+            self.remove(file_hash)
+            return True
+    
+    def set_pieces(self, file_hash, piece_size, piece_digests):
+        """Gravar os hashes dos pedaços de um arquivo já indexado"""
+        root = merkle_root(piece_digests)
+        with self._lock:
+            files = self._loaded()
+            with self._conn:
+                self._conn.execute('UPDATE files SET piece_size = ?, merkle_root = ? WHERE hash = ?',
+                                   (piece_size, root, file_hash))
+                self._conn.execute('INSERT OR REPLACE INTO pieces (hash, digests) VALUES (?, ?)',
+                                   (file_hash, piece_digests))
+            if file_hash in files:
+                files[file_hash].update(piece_size=piece_size, merkle_root=root)
+    
+    def get_pieces(self, file_hash):
+        """Hashes concatenados (32 bytes cada) dos pedaços do arquivo, ou None"""
+        with self._lock:
+            row = self._conn.execute('SELECT digests FROM pieces WHERE hash = ?',
+                                     (file_hash,)).fetchone()
+        return row[0] if row else None
+    
+    def set_encoding(self, file_hash, filepath, encoding, frame_size=None, offsets=None):
+        """Registrar como o objeto está guardado (e os offsets dos quadros, se comprimido)"""
+        with self._lock:
+            files = self._loaded()
+            with self._conn:
+                self._conn.execute('UPDATE files SET filepath = ?, encoding = ? WHERE hash = ?',
+                                   (filepath, encoding, file_hash))
+                if offsets is None:
+                    self._conn.execute('DELETE FROM frames WHERE hash = ?', (file_hash,))
+                else:
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO frames (hash, frame_size, offsets) VALUES (?, ?, ?)',
+                        (file_hash, frame_size, struct.pack(f'>{len(offsets)}Q', *offsets)))
+            if file_hash in files:
+                files[file_hash].update(filepath=filepath, encoding=encoding)
+    
+    def get_frames(self, file_hash):
+        """(tamanho do quadro, offsets) de um objeto comprimido, ou None"""
+        with self._lock:
+            row = self._conn.execute('SELECT frame_size, offsets FROM frames WHERE hash = ?',
+                                     (file_hash,)).fetchone()
+        if row is None:
+            return None
+        return row[0], struct.unpack(f'>{len(row[1]) // 8}Q', row[1])
+    
+    def add_downloads(self, counts):
+        """Somar downloads ({hash: quantidade}) em uma única transação"""
+        with self._lock:
+            files = self._loaded()
+            with self._conn:
+                self._conn.executemany(
+                    'UPDATE files SET download_count = download_count + ? WHERE hash = ?',
+                    [(count, file_hash) for file_hash, count in counts.items()])
+            for file_hash, count in counts.items():
+                if file_hash in files:
+                    files[file_hash]['download_count'] += count
+    
+    def _query(self, sort, descending, after, prefix, search, limit):
+        """Montar o SELECT ordenado de `page`/`iter_files`
+        
+        A paginação é por cursor: `after` é o par (valor da ordenação, hash)
+        do último arquivo já entregue, e a busca continua dali pelo índice.
+        """
+        column = self.SORT_COLUMNS[sort]
+        collate = ' COLLATE NOCASE' if sort == 'name' else ''
+        direction = 'DESC' if descending else 'ASC'
+        where, params = [], []
+        if after is not None:
+            where.append(f"({column}, hash) {'<' if descending else '>'} (?{collate}, ?)")
+            params.extend(after)
+        if prefix:
+            where.append("filename LIKE ? ESCAPE '\\'")
+            params.append(escape_like(prefix) + '%')
+        if search:
+            if self._fts and len(search) >= 3:
+                where.append('hash IN (SELECT hash FROM files_fts WHERE files_fts MATCH ?)')
+                params.append('filename : "' + search.replace('"', '""') + '"')
+            else:
+                where.append("filename LIKE ? ESCAPE '\\'")
+                params.append('%' + escape_like(search) + '%')
+        sql = f"SELECT {', '.join(self.COLUMNS)} FROM files"
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY {column}{collate} {direction}, hash {direction}'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return sql, params
+    
+    def page(self, limit, sort='upload_time', descending=True, after=None, prefix=None, search=None):
+        """Até `limit` arquivos na ordem pedida, a partir do cursor `after`"""
+        sql, params = self._query(sort, descending, after, prefix, search, limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+    
+    def iter_files(self, sort='upload_time', descending=True, prefix=None, search=None,
+                   batch_size=SCAN_BATCH_SIZE):
+        """Percorrer todos os arquivos na ordem pedida, em lotes
+        
+        Usa uma conexão própria de leitura (o WAL permite leituras em
+        paralelo), para não segurar a trava do índice durante o envio.
+        """
+        sql, params = self._query(sort, descending, None, prefix, search, None)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(self.COLUMNS, row))
+        finally:
+            conn.close()
+    
+    def changes_since(self, since, limit=CATALOG_PAGE_LIMIT):
+        """Alterações do catálogo posteriores a `since`, em ordem
+        
+        Retorna (alterações, há_mais); cada alteração tem seq, op, hash,
+        filename e size (os dois últimos vazios em remoções).
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT seq, op, hash, filename, size FROM changes WHERE seq > ? ORDER BY seq LIMIT ?',
+                (since, limit + 1)).fetchall()
+        changes = [dict(zip(('seq', 'op', 'hash', 'filename', 'size'), row)) for row in rows[:limit]]
+        return changes, len(rows) > limit
+    
+    def last_seq(self):
+        """Número da alteração mais recente do catálogo (0 se vazio)"""
+        with self._lock:
+            return self._conn.execute('SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+    
+    # Interface de dicionário usada pelas rotas
+    def __contains__(self, file_hash):
+        return file_hash in self._loaded()
+    
+    def __getitem__(self, file_hash):
+        return self._loaded()[file_hash]
+    
+    def get(self, file_hash, default=None):
+        return self._loaded().get(file_hash, default)
+    
+    def __len__(self):
+        return len(self._loaded())
+    
+    def __bool__(self):
+        return len(self) > 0
+    
+    def items(self):
+        return list(self._loaded().items())
+    
+    def values(self):
+        return list(self._loaded().values())
+
+
+def escape_like(text):
+    """Escapar os curingas do LIKE do SQLite (usado com ESCAPE '\\')"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def is_sha256(value):
+    """Se `value` é um hash SHA-256 em hexadecimal minúsculo"""
+    return isinstance(value, str) and len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+
+def encode_cursor(info, sort):
+    """Cursor opaco de paginação: posição do arquivo na ordenação"""
+    key = [info[FileIndex.SORT_COLUMNS[sort]], info['hash']]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Par (valor da ordenação, hash) de um cursor de `encode_cursor`"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, file_hash = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError('Cursor inválido')
+    # Só valores que o SQLite aceita comparar: bool é subclasse de int, e
+    # inteiros fora de 64 bits não podem ser passados como parâmetro
+    if (not isinstance(file_hash, str) or isinstance(value, bool)
+            or not isinstance(value, (str, int, float))
+            or (isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63)):
+        raise ValueError('Cursor inválido')
+    return value, file_hash
+
+
+def merkle_root(piece_digests):
+    """Raiz da árvore de Merkle sobre os hashes concatenados dos pedaços
+    
+    Cada nó interno é SHA-256(esquerda + direita); um nó sem par sobe de
+    nível inalterado. Um arquivo vazio tem como raiz o SHA-256 de b''.
+    """
+    level = [piece_digests[i:i + 32] for i in range(0, len(piece_digests), 32)]
+    if not level:
+        return hashlib.sha256(b'').hexdigest()
+    while len(level) > 1:
+        parents = [hashlib.sha256(level[i] + level[i + 1]).digest()
+                   for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        level = parents
+    return bytes(level[0]).hex()
+
+
+class PieceHasher:
+    """Calcula o SHA-256 de cada pedaço de tamanho fixo de um fluxo de dados"""
+    
+    def __init__(self, piece_size=PIECE_SIZE):
+        self.piece_size = piece_size
+        self._digests = []
+        self._current = hashlib.sha256()
+        self._filled = 0
+    
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            take = min(len(view), self.piece_size - self._filled)
+            self._current.update(view[:take])
+            self._filled += take
+            view = view[take:]
+            if self._filled == self.piece_size:
+                self._digests.append(self._current.digest())
+                self._current = hashlib.sha256()
+                self._filled = 0
+    
+    def digests(self):
+        """Hashes concatenados de todos os pedaços, incluindo o último incompleto"""
+        digests = list(self._digests)
+        if self._filled:
+            digests.append(self._current.digest())
+        return b''.join(digests)
+    
+    def index_fields(self):
+        """Campos do índice que descrevem os pedaços"""
+        digests = self.digests()
+        return {
+            'piece_size': self.piece_size,
+            'merkle_root': merkle_root(digests),
+            'piece_digests': digests,
+        }
+
+
+# Resultado de FileHasher.digest_file(): hash do conteúdo e, opcionalmente, dos pedaços
+FileDigest = namedtuple('FileDigest', ['sha256', 'pieces'])
+
+
+class FileHasher:
+    """Motor de cálculo de SHA-256 de arquivos
+    
+    Lê com readinto() para um buffer pré-alocado por thread, calcula vários
+    arquivos em paralelo (o hashlib libera o GIL em blocos grandes) e pode
+    usar mmap para arquivos grandes.
+    """
+    
+    def __init__(self, buffer_size=HASH_BUFFER_SIZE, workers=HASH_WORKERS,
+                 use_mmap=False, mmap_threshold=HASH_MMAP_THRESHOLD):
+        self.buffer_size = buffer_size
+        self.workers = workers
+        self.use_mmap = use_mmap
+        self.mmap_threshold = mmap_threshold
+        self._local = threading.local()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self.hashed_bytes = 0    # Totais para medir a vazão do cálculo (/metrics)
+        self.hash_seconds = 0.0
+        self._stats_lock = threading.Lock()
+    
+    def _buffer(self):
+        """Buffer reutilizável da thread atual"""
+        view = getattr(self._local, 'view', None)
+        if view is None:
+            view = self._local.view = memoryview(bytearray(self.buffer_size))
+        return view
+    
+    def _executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix='hasher')
+            return self._pool
+    
+    def hash_file(self, filepath):
+        """Calcular o SHA-256 de um arquivo"""
+        return self.digest_file(filepath, pieces=False).sha256
+    
+    def digest_file(self, filepath, pieces=True):
+        """Calcular o SHA-256 do arquivo e, se pedido, os hashes dos pedaços (PieceHasher)"""
+        started = time.perf_counter()
+        hash_sha256 = hashlib.sha256()
+        piece_hasher = PieceHasher() if pieces else None
+        with open(filepath, 'rb', buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+            if self.use_mmap and size and size >= self.mmap_threshold:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    hash_sha256.update(mapped)
+                    if piece_hasher:
+                        piece_hasher.update(mapped)
+            else:
+                view = self._buffer()
+                while True:
+                    n = f.readinto(view)
+                    if not n:
+                        break
+                    hash_sha256.update(view[:n])
+                    if piece_hasher:
+                        piece_hasher.update(view[:n])
+        self.record(size, time.perf_counter() - started)
+        return FileDigest(hash_sha256.hexdigest(), piece_hasher)
+    
+    def record(self, size, seconds):
+        """Somar aos totais de vazão um cálculo feito fora do motor (ex.: durante o upload)"""
+        with self._stats_lock:
+            self.hashed_bytes += size
+            self.hash_seconds += seconds
+    
+    def submit(self, filepath, pieces=False):
+        """Agendar o cálculo no pool de threads; retorna um Future"""
+        if pieces:
+            return self._executor().submit(self.digest_file, filepath)
+        return self._executor().submit(self.hash_file, filepath)
+    
+    def hash_many(self, filepaths, pieces=False):
+        """Calcular vários arquivos em paralelo
+        
+        Gera (caminho, resultado, erro) na ordem em que os cálculos terminam;
+        o resultado é o hash, ou um FileDigest se `pieces` for verdadeiro.
+        """
+        futures = {self.submit(path, pieces): path for path in filepaths}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except OSError as e:
+                yield futures[future], None, e
+    
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+
+# Cabeçalho gzip fixo: sem nome nem data, para o mesmo conteúdo gerar os mesmos bytes
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+def write_compressed(source, destination, encoding, frame_size=PIECE_SIZE):
+    """Gravar `source` comprimido em quadros de `frame_size` bytes originais
+    
+    Retorna os offsets de início de cada quadro mais o fim do último. Com
+    gzip o resultado é um único fluxo gzip válido, com Z_FULL_FLUSH entre
+    os quadros: cada um pode ser descomprimido sozinho a partir do seu
+    offset. Com zstd são quadros zstd concatenados, também um fluxo válido.
+    """
+    level = COMPRESSION_LEVELS[encoding]
+    offsets = []
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        if encoding == 'gzip':
+            dst.write(GZIP_HEADER)
+            deflate = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            crc = size = 0
+        else:
+            zstd = zstandard.ZstdCompressor(level=level)
+        while True:
+            data = src.read(frame_size)
+            if not data:
+                break
+            offsets.append(dst.tell())
+            if encoding == 'gzip':
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+                dst.write(deflate.compress(data) + deflate.flush(zlib.Z_FULL_FLUSH))
+            else:
+                dst.write(zstd.compress(data))
+        offsets.append(dst.tell())
+        if encoding == 'gzip':
+            dst.write(deflate.flush() + struct.pack('<II', crc, size & 0xffffffff))
+    return offsets
+
+
+def read_frame(data, encoding):
+    """Descomprimir um quadro gravado por write_compressed"""
+    if encoding == 'gzip':
+        return zlib.decompressobj(-zlib.MAX_WBITS).decompress(data)
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def worth_compressing(path, filename):
+    """Decidir pela amostra do início do arquivo se a compressão compensa"""
+    if (mimetypes.guess_type(filename)[0] or '').startswith(('image/', 'video/', 'audio/')):
+        return False
+    with open(path, 'rb') as f:
+        sample = f.read(COMPRESSION_SAMPLE_SIZE)
+    return len(zlib.compress(sample, 1)) < len(sample) * COMPRESSION_MIN_RATIO
+
+
+class CompressedReader:
+    """Conteúdo original de um objeto comprimido, lido como um arquivo 'rb'
+    
+    Só os quadros que cobrem o trecho pedido são lidos e descomprimidos, e
+    o último fica em cache: Range e /piece não descomprimem o arquivo todo.
+    """
+    
+    def __init__(self, path, encoding, frame_size, offsets, size):
+        self._file = open(path, 'rb')
+        self.encoding = encoding
+        self.frame_size = frame_size
+        self.offsets = offsets
+        self.size = size
+        self._position = 0
+        self._cached = (None, b'')
+    
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self._position = max(0, offset)
+        return self._position
+    
+    def tell(self):
+        return self._position
+    
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.size, self._position + size)
+        parts = []
+        while self._position < end:
+            index = self._position // self.frame_size
+            start = self._position - index * self.frame_size
+            part = self._frame(index)[start:start + end - self._position]
+            if not part:
+                raise IOError('Objeto comprimido menor que o tamanho indexado')
+            parts.append(part)
+            self._position += len(part)
+        return b''.join(parts)
+    
+    def _frame(self, index):
+        if self._cached[0] != index:
+            start, end = self.offsets[index], self.offsets[index + 1]
+            self._file.seek(start)
+            self._cached = (index, read_frame(self._file.read(end - start), self.encoding))
+        return self._cached[1]
+    
+    def close(self):
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ObjectStore:
+    """Arquivos guardados pelo hash do conteúdo em `objects/ab/cdef...`
+    
+    As 256 subpastas (dois primeiros dígitos do hash) mantêm cada pasta
+    pequena mesmo com milhões de arquivos. Um conteúdo já guardado não é
+    gravado de novo: `put` apenas descarta a cópia temporária. Objetos
+    comprimidos levam a extensão da codificação (`cdef....gz`).
+    """
+    
+    def __init__(self, folder):
+        self.root = os.path.join(folder, OBJECTS_DIRNAME)
+        os.makedirs(self.root, exist_ok=True)
+    
+    def path(self, file_hash, encoding=None):
+        return os.path.join(self.root, file_hash[:2], file_hash[2:] + COMPRESSION_SUFFIXES.get(encoding, ''))
+    
+    def stored_path(self, file_hash):
+        """Caminho do objeto como está guardado (original ou comprimido), ou None"""
+        for encoding in (None, *COMPRESSION_SUFFIXES):
+            path = self.path(file_hash, encoding)
+            if os.path.exists(path):
+                return path
+        return None
+    
+    def exists(self, file_hash):
+        return self.stored_path(file_hash) is not None
+    
+    def put(self, source, file_hash):
+        """Mover `source` (na mesma partição) para o objeto do hash; retorna o caminho"""
+        existing = self.stored_path(file_hash)
+        if existing is not None:
+            os.remove(source)  # Conteúdo duplicado: nada a gravar
+            return existing
+        destination = self.path(file_hash)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(source, destination)
+        return destination
+    
+    def compress(self, source, file_hash, encoding, frame_size=PIECE_SIZE):
+        """Gravar a variante comprimida do objeto; retorna (caminho, offsets dos quadros)"""
+        destination = self.path(file_hash, encoding)
+        temporary = destination + '.part'
+        try:
+            offsets = write_compressed(source, temporary, encoding, frame_size)
+            os.replace(temporary, destination)
+        except BaseException:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            raise
+        return destination, offsets
+    
+    def remove(self, file_hash):
+        for encoding in (None, *COMPRESSION_SUFFIXES):
+            try:
+                os.remove(self.path(file_hash, encoding))
+            except FileNotFoundError:
+                pass
+    
+    def collect_garbage(self, index, grace=OBJECT_GC_GRACE):
+        """Apagar objetos sem entrada no índice; retorna quantos removeu
+        
+        Também saem as variantes que o índice não usa (o original que não
+        pôde ser apagado logo após a compressão). Objetos recentes são
+        poupados: um upload pode ter guardado o objeto e ainda não ter
+        registrado a entrada.
+        """
+        cutoff = time.time() - grace
+        removed = 0
+        with os.scandir(self.root) as shards:
+            for shard in shards:
+                if not shard.is_dir() or len(shard.name) != 2:
+                    continue
+                with os.scandir(shard.path) as entries:
+                    for entry in entries:
+                        info = index.get(shard.name + entry.name.split('.')[0])
+                        if info is not None and os.path.basename(info['filepath']) == entry.name:
+                            continue
+                        try:
+                            if entry.stat().st_mtime < cutoff:
+                                os.remove(entry.path)
+                                removed += 1
+                        except OSError:
+                            pass
+        return removed
+
+
+class StorageCompressor:
+    """Guarda comprimidos os arquivos que compensam (texto, JSON, logs...)
+    
+    Cada arquivo é avaliado uma vez, por uma amostra do início; a decisão
+    fica na coluna `encoding` do índice ('identity' quando não compensa).
+    O original só é apagado depois que a variante comprimida e os offsets
+    dos quadros estão no índice.
+    """
+    
+    def __init__(self, index, objects, encoding=STORAGE_COMPRESSION):
+        self.index = index
+        self.objects = objects
+        self.encoding = encoding
+        self.status = {'encoding': encoding, 'files_compressed': 0, 'bytes_saved': 0,
+                       'last_pass': None}
+    
+    def run_pass(self):
+        """Avaliar os arquivos ainda não avaliados"""
+        for info in self.index.values():
+            # Entradas antigas sem pedaços ficam para depois de ganhar o manifesto
+            if info['encoding'] is None and info['piece_size']:
+                try:
+                    self.compress(info)
+                except OSError as e:
+                    print(f"Erro ao comprimir {info['filename']}: {e}")
+        self.status['last_pass'] = time.time()
+    
+    def compress(self, info):
+        file_hash, source = info['hash'], info['filepath']
+        if info['size'] < COMPRESSION_MIN_SIZE or not worth_compressing(source, info['filename']):
+            self.index.set_encoding(file_hash, source, 'identity')
+            return
+        
+        path, offsets = self.objects.compress(source, file_hash, self.encoding, info['piece_size'])
+        stored_size = os.path.getsize(path)
+        if stored_size >= info['size'] * COMPRESSION_MIN_RATIO:
+            # A amostra enganou: o resto do arquivo não comprime
+            os.remove(path)
+            self.index.set_encoding(file_hash, source, 'identity')
+            return
+        
+        self.index.set_encoding(file_hash, path, self.encoding, info['piece_size'], offsets)
+        try:
+            os.remove(source)
+        except OSError:
+            pass  # Ainda aberto por um download (Windows): a coleta de lixo apaga depois
+        self.status['files_compressed'] += 1
+        self.status['bytes_saved'] += info['size'] - stored_size
+
+
+class Thumbnails:
+    """Miniaturas JPEG geradas em segundo plano e guardadas em disco por hash
+    
+    Imagens são reduzidas com o Pillow; vídeos ganham um quadro de capa
+    extraído pelo ffmpeg, se estiver instalado. Os arquivos ficam em
+    `.thumbnails/ab/<hash>-<lado>.jpg`, até `max_bytes` no total: os menos
+    acessados saem primeiro. A ordem de uso sobrevive a reinícios pela
+    data de modificação, atualizada a cada acesso.
+    """
+    
+    def __init__(self, folder, open_content, max_bytes=THUMBNAIL_CACHE_BYTES, workers=THUMBNAIL_WORKERS):
+        self.root = os.path.join(folder, THUMBNAIL_DIRNAME)
+        self.max_bytes = max_bytes
+        self.ffmpeg = shutil.which('ffmpeg')
+        self._open_content = open_content
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnail')
+        self._lock = threading.Lock()
+        self._pending = {}  # hash -> Future da geração em andamento
+        self._failed = set()  # Hashes que não puderam ser lidos; não se tenta de novo
+        self._entries = OrderedDict()  # caminho -> bytes, do menos para o mais recente
+        self._bytes = 0
+        self._load()
+    
+    def _load(self):
+        """Retomar o cache do disco, do acesso mais antigo para o mais recente"""
+        found = []
+        os.makedirs(self.root, exist_ok=True)
+        with os.scandir(self.root) as shards:
+            for shard in shards:
+                if not shard.is_dir():
+                    continue
+                with os.scandir(shard.path) as entries:
+                    for entry in entries:
+                        st = entry.stat()
+                        if entry.name.endswith('.jpg'):
+                            found.append((st.st_mtime, entry.path, st.st_size))
+                        else:
+                            os.remove(entry.path)  # Geração interrompida
+        with self._lock:
+            for _, path, size in sorted(found):
+                self._entries[path] = size
+                self._bytes += size
+            self._evict()
+    
+    def kind(self, filename):
+        """'image' ou 'video' se é possível gerar a miniatura aqui, senão None"""
+        kind = (mimetypes.guess_type(filename)[0] or '').split('/')[0]
+        if kind == 'image' and Image is not None:
+            return kind
+        if kind == 'video' and self.ffmpeg is not None:
+            return kind
+        return None
+    
+    def path(self, file_hash, size):
+        return os.path.join(self.root, file_hash[:2], f'{file_hash}-{THUMBNAIL_SIZES[size]}.jpg')
+    
+    def get(self, file_info, size, timeout=THUMBNAIL_TIMEOUT):
+        """Bytes da miniatura, gerando-a se preciso; None se não for possível
+        
+        Levanta FutureTimeoutError se a geração não terminar a tempo.
+        """
+        path = self.path(file_info['hash'], size)
+        for attempt in range(2):
+            with self._lock:
+                cached = path in self._entries
+                if cached:
+                    self._entries.move_to_end(path)
+            if cached:
+                try:
+                    os.utime(path)
+                    with open(path, 'rb') as f:
+                        return f.read()
+                except FileNotFoundError:
+                    self._forget(path)
+            if attempt == 0:
+                future = self.submit(file_info)
+                if future is None:
+                    return None
+                future.result(timeout)
+        return None
+    
+    def submit(self, file_info):
+        """Gerar em segundo plano as miniaturas de todos os tamanhos (uma vez por hash)"""
+        file_hash = file_info['hash']
+        if self.kind(file_info['filename']) is None or file_hash in self._failed:
+            return None
+        with self._lock:
+            future = self._pending.get(file_hash)
+            if future is None:
+                future = self._executor.submit(self._generate, file_info)
+                self._pending[file_hash] = future
+                future.add_done_callback(lambda _: self._pending.pop(file_hash, None))
+        return future
+    
+    def _generate(self, file_info):
+        file_hash = file_info['hash']
+        paths = {size: self.path(file_hash, size) for size in THUMBNAIL_SIZES}
+        missing = {size: path for size, path in paths.items() if path not in self._entries}
+        if not missing:
+            return
+        os.makedirs(os.path.dirname(paths['small']), exist_ok=True)
+        try:
+            if self.kind(file_info['filename']) == 'image':
+                self._resize_image(file_info, missing)
+            else:
+                self._poster_frame(file_info, missing)
+        except Exception as e:
+            # Pillow e ffmpeg levantam erros variados para arquivos corrompidos
+            print(f"Erro ao gerar miniatura de {file_info['filename']}: {e}")
+            self._failed.add(file_hash)
+            for path in missing.values():
+                for leftover in (path, path + '.part'):
+                    try:
+                        os.remove(leftover)
+                    except OSError:
+                        pass
+            return
+        for path in missing.values():
+            self._add(path)
+    
+    def _resize_image(self, file_info, targets):
+        with self._open_content(file_info) as f, Image.open(f) as original:
+            # JPEG: decodificar já reduzida, sem montar a imagem inteira na memória
+            original.draft('RGB', (max(THUMBNAIL_SIZES.values()),) * 2)
+            image = ImageOps.exif_transpose(original)
+            if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+                # Transparência vira fundo branco (JPEG não tem canal alfa)
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, 'white')
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+            for size in sorted(targets, key=THUMBNAIL_SIZES.get, reverse=True):
+                side = THUMBNAIL_SIZES[size]
+                image.thumbnail((side, side))
+                temporary = targets[size] + '.part'
+                image.save(temporary, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+                os.replace(temporary, targets[size])
+    
+    def _poster_frame(self, file_info, targets):
+        for size, path in targets.items():
+            side = THUMBNAIL_SIZES[size]
+            temporary = path + '.part'
+            # Vídeos mais curtos que o instante escolhido usam o primeiro quadro
+            for second in (THUMBNAIL_POSTER_SECOND, 0):
+                subprocess.run(
+                    [self.ffmpeg, '-v', 'error', '-y', '-ss', str(second), '-i', file_info['filepath'],
+                     '-frames:v', '1', '-vf',
+                     f'scale={side}:{side}:force_original_aspect_ratio=decrease',
+                     '-q:v', '4', '-f', 'image2', '-c:v', 'mjpeg', temporary],
+                    check=True, capture_output=True, timeout=THUMBNAIL_TIMEOUT)
+                if os.path.exists(temporary) and os.path.getsize(temporary):
+                    break
+            else:
+                raise IOError('ffmpeg não extraiu nenhum quadro')
+            os.replace(temporary, path)
+    
+    def _add(self, path):
+        size = os.path.getsize(path)
+        with self._lock:
+            self._bytes -= self._entries.pop(path, 0)
+            self._entries[path] = size
+            self._bytes += size
+            self._evict()
+    
+    def _forget(self, path):
+        with self._lock:
+            self._bytes -= self._entries.pop(path, 0)
+    
+    def _evict(self):
+        """Apagar as miniaturas menos usadas até caber no limite (com a trava)"""
+        while self._bytes > self.max_bytes and self._entries:
+            path, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    def status(self):
+        with self._lock:
+            return {'images': Image is not None, 'videos': self.ffmpeg is not None,
+                    'cached': len(self._entries), 'bytes': self._bytes,
+                    'max_bytes': self.max_bytes, 'pending': len(self._pending)}
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class HashingFile:
+    """Arquivo temporário que calcula o SHA-256 enquanto os dados são gravados"""
+    
+    def __init__(self, folder):
+        # Criado na própria pasta de destino para que o rename final seja atômico
+        fd, self.path = tempfile.mkstemp(prefix='.upload-', suffix='.tmp', dir=folder)
+        self._file = os.fdopen(fd, 'w+b', buffering=UPLOAD_BUFFER_SIZE)
+        self._hash = hashlib.sha256()
+        self.pieces = PieceHasher()
+        self.size = 0
+        self.hash_seconds = 0.0  # Tempo gasto só no cálculo dos hashes
+        self.committed = False
+    
+    def write(self, data):
+        started = time.perf_counter()
+        self._hash.update(data)
+        self.pieces.update(data)
+        self.hash_seconds += time.perf_counter() - started
+        self.size += len(data)
+        return self._file.write(data)
+    
+    def hexdigest(self):
+        return self._hash.hexdigest()
+    
+    def commit(self, store):
+        """Guardar o conteúdo no ObjectStore (rename atômico); retorna o caminho do objeto"""
+        self._file.close()
+        self.path = store.put(self.path, self.hexdigest())
+        self.committed = True
+        return self.path
+    
+    def close(self):
+        """Fechar o arquivo, descartando-o se não foi confirmado com commit()"""
+        self._file.close()
+        if not self.committed and os.path.exists(self.path):
+            os.remove(self.path)
+    
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class UploadFormDataParser(FormDataParser):
+    """Parser multipart que lê o corpo da requisição em blocos grandes"""
+    
+    def _parse_multipart(self, stream, mimetype, content_length, options):
+        parser = MultiPartParser(
+            stream_factory=self.stream_factory,
+            max_form_memory_size=self.max_form_memory_size,
+            max_form_parts=self.max_form_parts,
+            cls=self.cls,
+            buffer_size=UPLOAD_BUFFER_SIZE,
+        )
+        boundary = options.get('boundary', '').encode('ascii')
+        if not boundary:
+            raise ValueError('Missing boundary')
+        
+        form, files = parser.parse(stream, boundary, content_length)
+        return stream, form, files
+
+
+class UploadRequest(Request):
+    """Requisição que grava uploads direto na pasta compartilhada, já calculando o hash"""
+    
+    form_data_parser_class = UploadFormDataParser
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingFile(current_app.config['UPLOAD_FOLDER'])
+
+
+def merge_range(ranges, start, end):
+    """Acrescentar [start, end) a uma lista ordenada de intervalos disjuntos"""
+    merged = []
+    for a, b in sorted(ranges + [[start, end]]):
+        if merged and a <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], b)
+        else:
+            merged.append([a, b])
+    return merged
+
+
+class UploadSessions:
+    """Sessões de upload retomável, persistidas no mesmo banco do índice
+    
+    Os dados de cada sessão são gravados, em qualquer ordem, em um arquivo
+    `.upload-<id>.part` na pasta compartilhada; a sessão guarda os intervalos
+    de bytes já recebidos.
+    """
+    
+    COLUMNS = ('id', 'filename', 'size', 'sha256', 'created', 'updated', 'received')
+    
+    def __init__(self, db_path, folder):
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS upload_sessions (
+                    id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    received TEXT NOT NULL
+                )
+            ''')
+        self._sessions = {}
+        for row in self._conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM upload_sessions"):
+            session = dict(zip(self.COLUMNS, row))
+            session['received'] = json.loads(session['received'])
+            self._sessions[session['id']] = session
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+    
+    def part_path(self, upload_id):
+        return os.path.join(self.folder, f'.upload-{upload_id}.part')
+    
+    def pending_bytes(self):
+        """Bytes declarados pelas sessões abertas que ainda não chegaram"""
+        with self._lock:
+            return sum(session['size'] - sum(end - start for start, end in session['received'])
+                       for session in self._sessions.values())
+    
+    def create(self, filename, size, sha256=None):
+        """Abrir uma nova sessão, reservando o arquivo parcial"""
+        upload_id = uuid.uuid4().hex
+        path = self.part_path(upload_id)
+        try:
+            with open(path, 'wb') as f:
+                f.truncate(size)
+        except OSError:
+            # Tamanho recusado pelo sistema de arquivos (EFBIG, disco cheio...)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            raise
+        
+        now = time.time()
+        session = {
+            'id': upload_id,
+            'filename': filename,
+            'size': size,
+            'sha256': sha256,
+            'created': now,
+            'updated': now,
+            'received': [],
+        }
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    f"INSERT INTO upload_sessions ({', '.join(self.COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                    tuple(json.dumps(v) if k == 'received' else v for k, v in session.items()))
+            self._sessions[upload_id] = session
+        return self._copy(session)
+    
+    def get(self, upload_id):
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            return self._copy(session) if session else None
+    
+    def write(self, upload_id, offset, stream):
+        """Gravar os dados de `stream` a partir de `offset`
+        
+        Retorna a sessão atualizada, ou None se nenhum byte foi recebido.
+        """
+        session = self.get(upload_id)
+        if session is None:
+            raise KeyError(upload_id)
+        
+        written = 0
+        f = open(self.part_path(upload_id), 'r+b')
+        try:
+            f.seek(offset)
+            while True:
+                chunk = stream.read(UPLOAD_BUFFER_SIZE)
+                if not chunk:
+                    break
+                if offset + written + len(chunk) > session['size']:
+                    raise ValueError('Dados além do tamanho declarado do arquivo')
+                f.write(chunk)
+                written += len(chunk)
+        finally:
+            # Só marca como recebido o que de fato chegou ao arquivo
+            f.close()
+            if written:
+                session = self._mark_received(upload_id, offset, offset + written)
+        return session if written else None
+    
+    def _mark_received(self, upload_id, start, end):
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            if session is None:
+                raise KeyError(upload_id)
+            session['received'] = merge_range(session['received'], start, end)
+            session['updated'] = time.time()
+            with self._conn:
+                self._conn.execute('UPDATE upload_sessions SET received = ?, updated = ? WHERE id = ?',
+                                   (json.dumps(session['received']), session['updated'], upload_id))
+            return self._copy(session)
+    
+    def remove(self, upload_id):
+        """Encerrar a sessão e apagar o arquivo parcial, se ainda existir"""
+        with self._lock:
+            with self._conn:
+                self._conn.execute('DELETE FROM upload_sessions WHERE id = ?', (upload_id,))
+            self._sessions.pop(upload_id, None)
+        try:
+            os.remove(self.part_path(upload_id))
+        except FileNotFoundError:
+            pass
+    
+    def collect_garbage(self, ttl=UPLOAD_SESSION_TTL):
+        """Descartar sessões paradas e arquivos temporários órfãos; retorna quantos removeu"""
+        cutoff = time.time() - ttl
+        with self._lock:
+            stale = [upload_id for upload_id, session in self._sessions.items()
+                     if session['updated'] < cutoff]
+            active = {f'.upload-{upload_id}.part' for upload_id in self._sessions}
+        for upload_id in stale:
+            self.remove(upload_id)
+        
+        # Sobras de uploads e downloads em enxame interrompidos por queda do servidor
+        removed = len(stale)
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.name.startswith(('.upload-', '.swarm-')) and entry.name not in active:
+                    try:
+                        if entry.stat().st_mtime < cutoff:
+                            os.remove(entry.path)
+                            removed += 1
+                    except OSError:
+                        pass
+        return removed
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+    
+    @staticmethod
+    def is_complete(session):
+        return session['size'] == 0 or session['received'] == [[0, session['size']]]
+    
+    @staticmethod
+    def _copy(session):
+        return dict(session, received=[list(r) for r in session['received']])
+
+
+class DownloadCounters:
+    """Contadores de downloads por thread, somados e gravados em lotes
+    
+    Cada thread de requisição incrementa um de COUNTER_STRIPES dicionários,
+    escolhido pelo id da thread e protegido por uma trava que quase só
+    disputa com `flush`. O número de dicionários é fixo: o servidor de
+    desenvolvimento cria uma thread por requisição, e um dicionário por
+    thread cresceria sem limite. Periodicamente os dicionários são
+    esvaziados, somados e gravados no índice em uma transação; as somas de
+    cada lote alimentam a janela usada para downloads/min.
+    """
+    
+    def __init__(self, index, window=DOWNLOAD_RATE_WINDOW):
+        self.index = index
+        self.window = window
+        self._shards = [(threading.Lock(), {}) for _ in range(COUNTER_STRIPES)]  # (trava, contadores)
+        self._flush_lock = threading.Lock()
+        self._recent = deque()  # (instante, {hash: quantidade}) de cada lote
+        self._recent_totals = {}  # Soma dos lotes dentro da janela
+    
+    def _shard(self):
+        # Ids nativos são sequenciais: threads vizinhas caem em dicionários diferentes
+        return self._shards[threading.get_native_id() % len(self._shards)]
+    
+    def increment(self, file_hash):
+        """Registrar um download (sem acesso ao disco)"""
+        lock, counts = self._shard()
+        with lock:
+            counts[file_hash] = counts.get(file_hash, 0) + 1
+    
+    def pending(self, file_hash):
+        """Downloads do arquivo ainda não gravados no índice"""
+        return sum(counts.get(file_hash, 0) for _, counts in self._shards)
+    
+    def count(self, info):
+        """Total de downloads de uma entrada do índice, incluindo os pendentes"""
+        return info['download_count'] + self.pending(info['hash'])
+    
+    def flush(self):
+        """Somar os contadores de todas as threads e gravá-los no índice
+        
+        Retorna {hash: downloads} do lote gravado.
+        """
+        with self._flush_lock:
+            merged = {}
+            for lock, counts in self._shards:
+                with lock:
+                    taken = dict(counts)
+                    counts.clear()
+                for file_hash, count in taken.items():
+                    merged[file_hash] = merged.get(file_hash, 0) + count
+            if merged:
+                self.index.add_downloads(merged)
+            self._record(merged)
+            return merged
+    
+    def _record(self, merged):
+        """Acrescentar um lote à janela de taxas e descartar os antigos"""
+        now = time.monotonic()
+        if merged:
+            self._recent.append((now, merged))
+            for file_hash, count in merged.items():
+                self._recent_totals[file_hash] = self._recent_totals.get(file_hash, 0) + count
+        while self._recent and self._recent[0][0] < now - self.window:
+            _, expired = self._recent.popleft()
+            for file_hash, count in expired.items():
+                remaining = self._recent_totals[file_hash] - count
+                if remaining:
+                    self._recent_totals[file_hash] = remaining
+                else:
+                    del self._recent_totals[file_hash]
+    
+    def rate(self, file_hash):
+        """Downloads por minuto do arquivo na janela recente"""
+        return self._recent_totals.get(file_hash, 0) * 60 / self.window
+    
+    def rates(self, limit=10):
+        """Total de downloads por minuto e os arquivos mais baixados agora"""
+        totals = dict(self._recent_totals)
+        top = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return {
+            'per_minute': sum(totals.values()) * 60 / self.window,
+            'top': [{'hash': file_hash, 'per_minute': count * 60 / self.window}
+                    for file_hash, count in top]
+        }
+
+
+class Metrics:
+    """Métricas pré-agregadas em memória, expostas no formato texto do Prometheus
+    
+    Como em DownloadCounters, cada thread soma em um de COUNTER_STRIPES
+    dicionários, escolhido pelo id da thread e protegido por uma trava que
+    quase só disputa com `render`: registrar uma medida não escreve em disco
+    nem em log, e /metrics percorre sempre o mesmo número de dicionários. Valores que já são mantidos em
+    outro objeto (tamanho do índice, bytes calculados pelo FileHasher...)
+    são lidos por um `callback` só quando /metrics é pedido.
+    """
+    
+    def __init__(self):
+        self._shards = [(threading.Lock(), {}) for _ in range(COUNTER_STRIPES)]  # (trava, {(nome, rótulos): valor})
+        self._families = {}  # nome -> (tipo, ajuda, nomes dos rótulos, limites dos buckets, callback)
+    
+    def counter(self, name, help_text, labels=(), callback=None):
+        self._families[name] = ('counter', help_text, labels, None, callback)
+    
+    def gauge(self, name, help_text, labels=(), callback=None):
+        self._families[name] = ('gauge', help_text, labels, None, callback)
+    
+    def histogram(self, name, help_text, labels=(), buckets=METRICS_LATENCY_BUCKETS):
+        self._families[name] = ('histogram', help_text, labels, tuple(buckets), None)
+    
+    def _shard(self):
+        return self._shards[threading.get_native_id() % len(self._shards)]
+    
+    def inc(self, name, labels=(), value=1):
+        """Somar a um contador ou medidor; `labels` traz os valores na ordem declarada"""
+        lock, values = self._shard()
+        key = (name, labels)
+        with lock:
+            values[key] = values.get(key, 0) + value
+    
+    def observe(self, name, value, labels=()):
+        """Registrar uma medida em um histograma"""
+        bounds = self._families[name][3]
+        lock, values = self._shard()
+        key = (name, labels)
+        with lock:
+            counts = values.get(key)
+            if counts is None:
+                counts = values[key] = [0] * (len(bounds) + 1) + [0.0]  # Buckets, +Inf e soma
+            counts[bisect.bisect_left(bounds, value)] += 1
+            counts[-1] += value
+    
+    def _merged(self):
+        """Somar as medidas de todos os dicionários, agrupadas por métrica"""
+        merged = {}
+        for lock, values in self._shards:
+            with lock:
+                items = [(key, list(value) if isinstance(value, list) else value)
+                         for key, value in values.items()]
+            for (name, labels), value in items:
+                samples = merged.setdefault(name, {})
+                if isinstance(value, list):
+                    total = samples.setdefault(labels, [0] * len(value))
+                    for i, count in enumerate(value):
+                        total[i] += count
+                else:
+                    samples[labels] = samples.get(labels, 0) + value
+        return merged
+    
+    @staticmethod
+    def _labels(names, values):
+        if not names:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for value in values)
+        return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+    
+    def render(self):
+        """Todas as métricas no formato texto do Prometheus"""
+        merged = self._merged()
+        lines = []
+        for name, (kind, help_text, label_names, bounds, callback) in self._families.items():
+            if callback is not None:
+                samples = callback()
+                if not isinstance(samples, dict):
+                    samples = {(): samples}
+            else:
+                samples = merged.get(name, {})
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(samples.items()):
+                if kind != 'histogram':
+                    lines.append(f'{name}{self._labels(label_names, labels)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(bounds + (float('inf'),), value):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append(f"{name}_bucket{self._labels(label_names + ('le',), labels + (le,))} {cumulative}")
+                lines.append(f'{name}_sum{self._labels(label_names, labels)} {value[-1]}')
+                lines.append(f'{name}_count{self._labels(label_names, labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+class MeasuredBody:
+    """Corpo de resposta WSGI que conta os bytes enviados e avisa quando termina"""
+    
+    def __init__(self, body, on_close):
+        self._body = body
+        self._on_close = on_close
+        self.sent = 0
+    
+    def __iter__(self):
+        for chunk in self._body:
+            self.sent += len(chunk)
+            yield chunk
+    
+    def close(self):
+        try:
+            close = getattr(self._body, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._on_close(self.sent)
+
+
+def peer_url(host, port):
+    """URL base de um servidor a partir do endereço e da porta"""
+    if ':' in host:
+        host = f'[{host}]'
+    return f'http://{host}:{port}'
+
+
+class PeerRegistry:
+    """Outros servidores conhecidos e uma cópia do catálogo de cada um
+    
+    Os catálogos são sincronizados por deltas: de cada peer guardamos até
+    qual alteração (`seq`) já lemos e pedimos só as seguintes. Se o peer
+    recriar o índice (novo `catalog_id`), ele responde com o catálogo
+    inteiro e `reset`, e a cópia local é descartada.
+    """
+    
+    def __init__(self, server_id, port, timeout=PEER_TIMEOUT):
+        self.server_id = server_id
+        self.port = port
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._peers = {}
+    
+    @staticmethod
+    def normalize(url):
+        url = url.strip().rstrip('/')
+        if '://' not in url:
+            url = 'http://' + url
+        return url
+    
+    def add(self, url, source='config', server_id=None):
+        """Registrar um peer ('config', 'multicast' ou 'inbound'); retorna True se for novo
+        
+        Com `server_id`, um servidor já registrado por outra URL não é
+        duplicado, apenas marcado como visto.
+        """
+        url = self.normalize(url)
+        with self._lock:
+            peer = self._peers.get(url)
+            if peer is None and server_id is not None:
+                peer = next((other for other in self._peers.values()
+                             if other['server_id'] == server_id), None)
+            if peer is not None:
+                peer['last_seen'] = time.time()
+                if source == 'config' and peer['url'] == url:
+                    peer['source'] = 'config'
+                return False
+            self._peers[url] = {
+                'url': url,
+                'source': source,
+                'server_id': None,
+                'catalog_id': None,
+                'seq': 0,
+                'files': {},
+                'failures': 0,
+                'last_seen': time.time(),
+                'last_sync': None,
+            }
+            return True
+    
+    def remove(self, url):
+        with self._lock:
+            self._peers.pop(self.normalize(url), None)
+    
+    def sync(self, peer):
+        """Trazer as alterações do catálogo de um peer desde a última sincronização"""
+        while True:
+            response = requests.get(f"{peer['url']}/catalog/changes", timeout=self.timeout, params={
+                'since': peer['seq'],
+                'catalog_id': peer['catalog_id'] or '',
+                'limit': CATALOG_PAGE_LIMIT,
+                'server_id': self.server_id,
+                'port': self.port,
+            })
+            response.raise_for_status()
+            data = response.json()
+            
+            with self._lock:
+                if data['server_id'] == self.server_id or self._is_duplicate(peer, data['server_id']):
+                    self._peers.pop(peer['url'], None)
+                    return
+                files = {} if data['reset'] else dict(peer['files'])
+                for change in data['changes']:
+                    if change['op'] == 'add':
+                        files[change['hash']] = {'filename': change['filename'], 'size': change['size']}
+                    else:
+                        files.pop(change['hash'], None)
+                # Trocar o dicionário inteiro: leitores nunca veem um catálogo pela metade
+                peer.update(files=files, seq=data['seq'], catalog_id=data['catalog_id'],
+                            server_id=data['server_id'])
+            if not data['more']:
+                return
+    
+    def _is_duplicate(self, peer, server_id):
+        """O mesmo servidor já está registrado por outra URL?
+        
+        A URL configurada prevalece sobre as descobertas; entre duas
+        descobertas, fica a que foi registrada primeiro.
+        """
+        for other in self._peers.values():
+            if other is peer or other['server_id'] != server_id:
+                continue
+            if peer['source'] == 'config' and other['source'] != 'config':
+                self._peers.pop(other['url'], None)
+                return False
+            return True
+        return False
+    
+    def sync_all(self):
+        """Sincronizar todos os peers e esquecer os descobertos que sumiram"""
+        with self._lock:
+            peers = list(self._peers.values())
+        for peer in peers:
+            try:
+                self.sync(peer)
+            except (requests.RequestException, ValueError, KeyError) as e:
+                peer['failures'] += 1
+                if peer['failures'] == PEER_MAX_FAILURES:
+                    print(f"⚠️  Peer {peer['url']} offline: {e}")
+                continue
+            if peer['failures'] >= PEER_MAX_FAILURES:
+                print(f"🔗 Peer {peer['url']} de volta")
+            peer['failures'] = 0
+            peer['last_seen'] = peer['last_sync'] = time.time()
+        
+        cutoff = time.time() - PEER_EXPIRY
+        with self._lock:
+            for peer in list(self._peers.values()):
+                if peer['source'] != 'config' and peer['last_seen'] < cutoff:
+                    del self._peers[peer['url']]
+    
+    @staticmethod
+    def is_online(peer):
+        return peer['last_sync'] is not None and peer['failures'] < PEER_MAX_FAILURES
+    
+    def online(self):
+        """Pares (url, server_id) dos peers online"""
+        with self._lock:
+            peers = list(self._peers.values())
+        return [(peer['url'], peer['server_id']) for peer in peers if self.is_online(peer)]
+    
+    def locate(self, file_hash):
+        """URLs dos peers online que têm o arquivo"""
+        with self._lock:
+            peers = list(self._peers.values())
+        return [peer['url'] for peer in peers
+                if self.is_online(peer) and file_hash in peer['files']]
+    
+    def lookup(self, file_hash):
+        """Nome e tamanho do arquivo segundo algum peer online, ou None"""
+        with self._lock:
+            peers = list(self._peers.values())
+        for peer in peers:
+            if self.is_online(peer) and file_hash in peer['files']:
+                return peer['files'][file_hash]
+        return None
+    
+    def snapshot(self):
+        """Estado dos peers para /peers e /status"""
+        with self._lock:
+            peers = list(self._peers.values())
+        return [{
+            'url': peer['url'],
+            'server_id': peer['server_id'],
+            'source': peer['source'],
+            'online': self.is_online(peer),
+            'file_count': len(peer['files']),
+            'catalog_seq': peer['seq'],
+            'failures': peer['failures'],
+            'last_sync': peer['last_sync'],
+        } for peer in peers]
+
+
+class TokenBucket:
+    """Balde de fichas: limita a taxa média a `rate` bytes/s, com rajadas de até `burst`
+    
+    `consume` reserva as fichas e dorme o necessário; como a reserva é
+    feita antes da espera, quem pede primeiro é atendido primeiro.
+    """
+    
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def set_rate(self, rate, burst=None):
+        """Trocar a taxa sem perder as fichas acumuladas até agora"""
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            self.capacity = burst or rate
+            self._tokens = min(self._tokens, self.capacity)
+    
+    def consume(self, amount):
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+    
+    def try_consume(self, amount):
+        """Consumir sem esperar se houver fichas; senão, segundos até haver
+        
+        Pedidos maiores que a capacidade são aceitos com o balde cheio,
+        deixando o saldo negativo.
+        """
+        with self._lock:
+            self._refill()
+            needed = min(amount, self.capacity)
+            if self._tokens >= needed:
+                self._tokens -= amount
+                return 0
+            return (needed - self._tokens) / self.rate
+
+
+class BandwidthScheduler:
+    """Escalonador de banda de um sentido (envio ou recebimento)
+    
+    Cada transferência pede vez para cada bloco com `ShapedTransfer.acquire`.
+    O limite por IP é um TokenBucket por cliente. O limite global é dividido
+    entre as transferências que esperam por enfileiramento justo ponderado
+    (start-time fair queueing): cada bloco recebe uma marca de tempo virtual
+    que avança bloco/peso a cada pedido da transferência, e o bloco com a
+    menor marca é liberado primeiro quando há fichas. Assim transferências
+    ativas dividem a banda por igual, e classes de peso maior (pré-
+    visualizações) passam na frente de downloads e da replicação sem
+    bloqueá-los por completo.
+    """
+    
+    def __init__(self, rate=0, per_ip_rate=0, weights=BANDWIDTH_WEIGHTS):
+        self.rate = 0
+        self.per_ip_rate = 0
+        self.weights = dict(weights)
+        self._bucket = None  # Balde global; None sem limite global
+        self._clients = {}  # IP -> [TokenBucket ou None, transferências abertas]
+        self._waiting = []  # Heap de (marca virtual, ordem de chegada, vez)
+        self._virtual = 0.0  # Marca do último bloco liberado
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+        self.configure(rate, per_ip_rate)
+    
+    @property
+    def active(self):
+        """Se há algum limite (sem limites, os envios seguem sem passar pelo escalonador)"""
+        return bool(self.rate or self.per_ip_rate)
+    
+    @staticmethod
+    def _burst(rate):
+        return max(rate * BANDWIDTH_BURST, BANDWIDTH_BLOCK_SIZE)
+    
+    def _client_bucket(self, bucket):
+        """Balde de um cliente ajustado ao limite por IP atual"""
+        if not self.per_ip_rate:
+            return None
+        if bucket is None:
+            return TokenBucket(self.per_ip_rate, self._burst(self.per_ip_rate))
+        bucket.set_rate(self.per_ip_rate, self._burst(self.per_ip_rate))
+        return bucket
+    
+    def configure(self, rate=None, per_ip_rate=None, weights=None):
+        """Alterar limites (bytes/s, 0 = sem limite) e pesos; vale também para transferências em andamento"""
+        with self._lock:
+            if weights:
+                self.weights.update(weights)
+            if per_ip_rate is not None:
+                self.per_ip_rate = per_ip_rate
+                for client in self._clients.values():
+                    client[0] = self._client_bucket(client[0])
+            if rate is None:
+                return
+            self.rate = rate
+            if not rate:
+                # Sem limite global: liberar todos os que esperam
+                self._bucket = None
+                waiting, self._waiting = self._waiting, []
+                for _, _, turn in waiting:
+                    turn['granted'] = True
+                    turn['event'].set()
+            elif self._bucket is None:
+                self._bucket = TokenBucket(rate, self._burst(rate))
+            else:
+                self._bucket.set_rate(rate, self._burst(rate))
+                if self._waiting:
+                    self._waiting[0][2]['event'].set()  # Recalcular a espera com a taxa nova
+    
+    def open(self, client, priority):
+        """Registrar uma transferência do cliente (IP) na classe `priority`"""
+        with self._lock:
+            entry = self._clients.get(client)
+            if entry is None:
+                entry = self._clients[client] = [self._client_bucket(None), 0]
+            entry[1] += 1
+        return ShapedTransfer(self, client, entry, priority)
+    
+    def _close(self, transfer):
+        with self._lock:
+            transfer.entry[1] -= 1
+            if not transfer.entry[1]:
+                self._clients.pop(transfer.client, None)
+    
+    def _wait_turn(self, transfer, amount):
+        """Esperar a vez de `amount` bytes no limite global
+        
+        Só a transferência no topo da fila espera pelas fichas (com
+        timeout); as demais esperam ser acordadas quando chegam ao topo.
+        """
+        with self._lock:
+            if self._bucket is None:
+                return
+            start = max(self._virtual, transfer.finish)
+            transfer.finish = start + amount / self.weights.get(transfer.priority, 1)
+            turn = {'event': threading.Event(), 'granted': False}
+            heapq.heappush(self._waiting, (start, next(self._order), turn))
+            timeout = 0 if self._waiting[0][2] is turn else None
+        while True:
+            turn['event'].wait(timeout)
+            turn['event'].clear()
+            with self._lock:
+                if turn['granted']:
+                    return
+                first = self._waiting[0]
+                if first[2] is not turn:
+                    # Alguém com marca menor chegou: ele passa a esperar pelas fichas
+                    first[2]['event'].set()
+                    timeout = None
+                    continue
+                timeout = self._bucket.try_consume(amount)
+                if not timeout:
+                    heapq.heappop(self._waiting)
+                    self._virtual = first[0]
+                    if self._waiting:
+                        self._waiting[0][2]['event'].set()
+                    return
+    
+    def status(self):
+        with self._lock:
+            return {
+                'rate_mbps': self.rate / (1024 * 1024),
+                'per_ip_mbps': self.per_ip_rate / (1024 * 1024),
+                'weights': dict(self.weights),
+                'clients': len(self._clients),
+                'transfers': sum(entry[1] for entry in self._clients.values()),
+                'waiting': len(self._waiting),
+            }
+
+
+class ShapedTransfer:
+    """Transferência registrada em um BandwidthScheduler (ver `open`)"""
+    
+    def __init__(self, scheduler, client, entry, priority):
+        self.scheduler = scheduler
+        self.client = client
+        self.entry = entry  # [balde do cliente, transferências abertas] no escalonador
+        self.priority = priority
+        self.finish = 0.0  # Marca virtual do fim do último bloco pedido
+        self._closed = False
+    
+    def acquire(self, amount):
+        """Esperar até poder enviar ou receber `amount` bytes"""
+        bucket = self.entry[0]
+        if bucket is not None:
+            bucket.consume(amount)
+        self.scheduler._wait_turn(self, amount)
+    
+    def iterate(self, body):
+        """Repassar os blocos de `body` no ritmo do escalonador; fecha tudo ao terminar"""
+        try:
+            for chunk in body:
+                self.acquire(len(chunk))
+                yield chunk
+        finally:
+            self.close()
+            close = getattr(body, 'close', None)
+            if close is not None:
+                close()
+    
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.scheduler._close(self)
+
+
+class ShapedStream:
+    """Corpo de requisição (upload) lido no ritmo de uma ShapedTransfer
+    
+    Substitui o wsgi.input; readinto também é limitado porque o werkzeug o
+    prefere a read quando existe.
+    """
+    
+    def __init__(self, stream, transfer):
+        self._stream = stream
+        self._transfer = transfer
+    
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self._stream.read()
+        else:
+            data = self._stream.read(min(size, BANDWIDTH_BLOCK_SIZE))
+        if data:
+            self._transfer.acquire(len(data))
+        return data
+    
+    def readinto(self, buffer):
+        view = memoryview(buffer)[:BANDWIDTH_BLOCK_SIZE]
+        if hasattr(self._stream, 'readinto'):
+            size = self._stream.readinto(view)
+        else:
+            data = self._stream.read(len(view))
+            size = len(data)
+            view[:size] = data
+        if size:
+            self._transfer.acquire(size)
+        return size
+    
+    def readline(self, size=-1):
+        data = self._stream.readline(size)
+        if data:
+            self._transfer.acquire(len(data))
+        return data
+
+
+def replica_targets(file_hash, peers, count, vnodes=REPLICATION_VNODES):
+    """Até `count` peers responsáveis pelo arquivo no anel de hash consistente
+    
+    `peers` são pares (url, server_id). Cada peer ocupa `vnodes` pontos do
+    anel; o arquivo fica com os primeiros peers distintos a partir da
+    posição do seu hash. A entrada ou saída de um peer só muda o destino
+    dos arquivos vizinhos a ele no anel.
+    """
+    ring = sorted((int(hashlib.sha256(f'{server_id}:{i}'.encode()).hexdigest()[:16], 16), url)
+                  for url, server_id in peers for i in range(vnodes))
+    start = bisect.bisect(ring, (int(file_hash[:16], 16), ''))
+    targets = []
+    for offset in range(len(ring)):
+        url = ring[(start + offset) % len(ring)][1]
+        if url not in targets:
+            targets.append(url)
+            if len(targets) == count:
+                break
+    return targets
+
+
+class Replicator:
+    """Mantém cada arquivo local em `factor - 1` peers além deste servidor
+    
+    A cada passada, os arquivos com menos cópias online que o desejado são
+    pedidos (POST /swarm/fetch) aos peers escolhidos por hash consistente;
+    o peer baixa do enxame com prioridade de fundo. Réplicas contam pelos
+    catálogos sincronizados, então um peer que sai da rede deixa de contar
+    e o arquivo é replicado de novo no próximo peer do anel.
+    """
+    
+    def __init__(self, index, peers, port, factor=REPLICATION_FACTOR):
+        self.index = index
+        self.peers = peers
+        self.port = port
+        self.factor = factor
+        self._requested = {}  # (hash, url do peer) -> (instante do pedido, aceito pelo peer)
+        self.status = {'factor': factor, 'files': 0, 'under_replicated': 0,
+                       'requests_open': 0, 'last_pass': None}
+    
+    def run_pass(self):
+        """Verificar todas as réplicas e pedir as que faltam"""
+        now = time.time()
+        # Pedidos concluídos (o peer já tem o arquivo) liberam a vaga na hora;
+        # os sem resultado são refeitos depois de REPLICATION_RETRY
+        self._requested = {
+            (file_hash, url): request for (file_hash, url), request in self._requested.items()
+            if request[0] > now - REPLICATION_RETRY and url not in self.peers.locate(file_hash)
+        }
+        online = self.peers.online()
+        wanted = min(self.factor - 1, len(online))
+        under_replicated = 0
+        files = self.index.values()
+        
+        for info in files:
+            file_hash = info['hash']
+            holders = set(self.peers.locate(file_hash))
+            if len(holders) >= wanted:
+                continue
+            under_replicated += 1
+            missing = wanted - len(holders)
+            for url in replica_targets(file_hash, online, wanted):
+                if missing == 0 or self.in_flight() >= REPLICATION_MAX_REQUESTS:
+                    break
+                if url in holders:
+                    continue
+                if (file_hash, url) not in self._requested:
+                    self._request(url, file_hash)
+                missing -= 1
+        
+        self.status.update(files=len(files), under_replicated=under_replicated,
+                           requests_open=self.in_flight(), last_pass=now)
+    
+    def in_flight(self):
+        """Pedidos aceitos pelos peers cujas réplicas ainda não apareceram nos catálogos"""
+        return sum(1 for _, accepted in self._requested.values() if accepted)
+    
+    def _request(self, url, file_hash):
+        """Pedir ao peer que baixe o arquivo (este servidor vai como fonte)"""
+        accepted = False
+        try:
+            response = requests.post(f'{url}/swarm/fetch', timeout=PEER_TIMEOUT, json={
+                'hash': file_hash,
+                'from_port': self.port,
+                'priority': 'background',
+            })
+            response.raise_for_status()
+            accepted = True
+        except requests.RequestException as e:
+            print(f"⚠️  Pedido de réplica de {file_hash[:16]} para {url} falhou: {e}")
+        # Falhas também esperam REPLICATION_RETRY, mas não ocupam vaga
+        self._requested[(file_hash, url)] = (time.time(), accepted)
+
+
+class SwarmError(Exception):
+    """Falha de um download em enxame"""
+
+
+class SwarmDownload:
+    """Baixa um arquivo em pedaços de vários peers ao mesmo tempo
+    
+    Cada peer recebe algumas conexões que pedem pedaços em /piece enquanto
+    houver trabalho, então peers rápidos baixam mais pedaços que os lentos.
+    Perto do fim, peers muito mais lentos que o melhor deixam de pegar
+    pedaços novos, e os pedaços ainda em andamento são pedidos também a
+    outros peers (endgame): vale a primeira resposta correta.
+    
+    Todo pedaço é conferido com o manifesto; um peer que envia dados
+    errados é banido na hora, e um que falha seguidamente também. O
+    arquivo completo é conferido com o hash antes de ser entregue.
+    """
+    
+    def __init__(self, file_hash, sources, part_path, hasher,
+                 connections_per_peer=SWARM_CONNECTIONS_PER_PEER, timeout=SWARM_TIMEOUT, headers=None):
+        self.file_hash = file_hash
+        self.headers = headers or {}
+        self.part_path = part_path
+        self.hasher = hasher
+        self.connections_per_peer = connections_per_peer
+        self.timeout = timeout
+        self.manifest = None
+        self.digest = None  # FileDigest do arquivo completo, após run()
+        self.elapsed = None
+        self.state = 'pending'
+        self.error = None
+        self.peers = [{
+            'url': PeerRegistry.normalize(url),
+            'banned': None,  # Motivo do banimento
+            'errors': 0,
+            'pieces': 0,
+            'bytes': 0,
+            'busy': 0.0,  # Segundos gastos em pedidos bem-sucedidos
+        } for url in dict.fromkeys(sources)]
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._write_lock = threading.Lock()
+        self._pending = deque()
+        self._in_flight = {}  # índice -> URLs dos peers que estão baixando o pedaço
+        self._done = set()
+        self._duplicates = 0
+        self._file = None
+    
+    def run(self):
+        """Baixar, conferir e deixar o arquivo completo em `part_path`"""
+        self.state = 'running'
+        started = time.monotonic()
+        try:
+            self._fetch_manifest()
+            self._download()
+            self.state = 'verifying'
+            self.digest = self.hasher.digest_file(self.part_path)
+            if self.digest.sha256 != self.file_hash:
+                raise SwarmError('O arquivo montado não confere com o hash')
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+            try:
+                os.remove(self.part_path)
+            except FileNotFoundError:
+                pass
+            raise
+        self.elapsed = time.monotonic() - started
+        self.state = 'done'
+        return self.digest
+    
+    def _fetch_manifest(self):
+        """Pedir o manifesto a todos os peers; vale o da maioria, os outros são banidos"""
+        def fetch(peer):
+            response = requests.get(f"{peer['url']}/manifest/{self.file_hash}",
+                                    headers=self.headers, timeout=PEER_TIMEOUT)
+            response.raise_for_status()
+            manifest = response.json()
+            digests = bytes.fromhex(''.join(manifest['pieces']))
+            expected = -(-manifest['size'] // manifest['piece_size']) if manifest['size'] else 0
+            if (manifest['hash'] != self.file_hash or len(manifest['pieces']) != expected
+                    or merkle_root(digests) != manifest['merkle_root']):
+                raise SwarmError('manifesto inconsistente')
+            return manifest
+        
+        votes = {}
+        with ThreadPoolExecutor(max_workers=min(16, len(self.peers) or 1)) as pool:
+            futures = {pool.submit(fetch, peer): peer for peer in self.peers}
+            for future in as_completed(futures):
+                peer = futures[future]
+                try:
+                    manifest = future.result()
+                except (requests.RequestException, ValueError, KeyError, TypeError, SwarmError) as e:
+                    peer['banned'] = f'sem manifesto: {e}'
+                    continue
+                votes.setdefault(manifest['merkle_root'], (manifest, []))[1].append(peer)
+        if not votes:
+            raise SwarmError('Nenhum peer forneceu o manifesto do arquivo')
+        
+        self.manifest, holders = max(votes.values(), key=lambda vote: len(vote[1]))
+        for peer in self.peers:
+            if not peer['banned'] and peer not in holders:
+                peer['banned'] = 'manifesto diverge da maioria'
+        self._digests = [bytes.fromhex(digest) for digest in self.manifest['pieces']]
+        self._pending.extend(range(len(self._digests)))
+    
+    def _download(self):
+        size = self.manifest['size']
+        with open(self.part_path, 'wb') as f:
+            f.truncate(size)
+        with open(self.part_path, 'r+b') as self._file:
+            workers = [threading.Thread(target=self._worker, args=(peer,), daemon=True)
+                       for peer in self.peers if not peer['banned']
+                       for _ in range(self.connections_per_peer)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        if len(self._done) < len(self._digests):
+            reasons = '; '.join(f"{peer['url']}: {peer['banned']}" for peer in self.peers if peer['banned'])
+            raise SwarmError(f'Download incompleto ({len(self._done)}/{len(self._digests)} pedaços). {reasons}')
+    
+    def _rate(self, peer):
+        return peer['bytes'] / peer['busy'] if peer['busy'] else None
+    
+    def _is_straggler(self, peer):
+        """Peer bem mais lento que o melhor, quando restam poucos pedaços"""
+        if len(self._pending) >= self.connections_per_peer * len(self.peers):
+            return False
+        rate = self._rate(peer)
+        rates = [self._rate(other) for other in self.peers if not other['banned']]
+        best = max((r for r in rates if r is not None), default=None)
+        return rate is not None and best is not None and rate < SWARM_SLOW_FACTOR * best
+    
+    def _next_piece(self, peer):
+        """Próximo pedaço para o peer, ou None quando não há mais trabalho para ele"""
+        with self._lock:
+            while True:
+                if peer['banned'] or len(self._done) == len(self._digests):
+                    return None
+                if not any(not other['banned'] for other in self.peers):
+                    return None
+                if self._pending and not self._is_straggler(peer):
+                    index = self._pending.popleft()
+                    self._in_flight[index] = {peer['url']}
+                    return index
+                # Endgame: repetir com este peer um pedaço que outro ainda está baixando
+                if not self._pending:
+                    for index, holders in self._in_flight.items():
+                        if peer['url'] not in holders:
+                            holders.add(peer['url'])
+                            return index
+                self._changed.wait(1)
+    
+    def _release(self, peer, index):
+        """Devolver um pedaço que não foi baixado por este peer"""
+        with self._lock:
+            holders = self._in_flight.get(index)
+            if holders is not None:
+                holders.discard(peer['url'])
+                if not holders:
+                    del self._in_flight[index]
+                    self._pending.appendleft(index)
+            self._changed.notify_all()
+    
+    def _ban(self, peer, reason):
+        with self._lock:
+            peer['banned'] = reason
+            for index in [index for index, holders in self._in_flight.items() if peer['url'] in holders]:
+                holders = self._in_flight[index]
+                holders.discard(peer['url'])
+                if not holders:
+                    del self._in_flight[index]
+                    self._pending.appendleft(index)
+            self._changed.notify_all()
+    
+    def _worker(self, peer):
+        session = requests.Session()
+        piece_size = self.manifest['piece_size']
+        size = self.manifest['size']
+        while True:
+            index = self._next_piece(peer)
+            if index is None:
+                return
+            started = time.monotonic()
+            try:
+                response = session.get(f"{peer['url']}/piece/{self.file_hash}/{index}",
+                                       headers=self.headers, timeout=self.timeout)
+                response.raise_for_status()
+                data = response.content
+            except requests.RequestException as e:
+                peer['errors'] += 1
+                if peer['errors'] >= SWARM_MAX_ERRORS:
+                    self._ban(peer, f'falhas seguidas: {e}')
+                    return
+                self._release(peer, index)
+                continue
+            
+            expected = min(piece_size, size - index * piece_size)
+            if len(data) != expected or hashlib.sha256(data).digest() != self._digests[index]:
+                self._ban(peer, f'pedaço {index} com conteúdo errado')
+                return
+            
+            with self._write_lock:
+                self._file.seek(index * piece_size)
+                self._file.write(data)
+            with self._lock:
+                peer['errors'] = 0
+                peer['pieces'] += 1
+                peer['bytes'] += len(data)
+                peer['busy'] += time.monotonic() - started
+                if index in self._done:
+                    self._duplicates += 1
+                else:
+                    self._done.add(index)
+                self._in_flight.pop(index, None)
+                self._changed.notify_all()
+    
+    def progress(self):
+        """Estado do download para a API e para o cliente de linha de comando"""
+        with self._lock:
+            return {
+                'hash': self.file_hash,
+                'state': self.state,
+                'error': self.error,
+                'filename': self.manifest['filename'] if self.manifest else None,
+                'size': self.manifest['size'] if self.manifest else None,
+                'pieces_done': len(self._done),
+                'piece_count': len(self.manifest['pieces']) if self.manifest else None,
+                'duplicate_pieces': self._duplicates,
+                'peers': [{
+                    'url': peer['url'],
+                    'pieces': peer['pieces'],
+                    'bytes': peer['bytes'],
+                    'mb_per_s': round(peer['bytes'] / peer['busy'] / (1024 * 1024), 2) if peer['busy'] else None,
+                    'banned': peer['banned'],
+                } for peer in self.peers],
+            }
+
+
+class LRUCache:
+    """Cache em memória limitado pelo total de bytes dos valores
+    
+    Os itens menos usados saem primeiro quando o total passa de `max_bytes`.
+    Seguro entre threads; conta acertos, falhas e remoções para `stats`.
+    """
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # chave -> (valor, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+    
+    def put(self, key, value, size):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+    
+    def stats(self):
+        """Ocupação e taxa de acertos desde o início"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'max_bytes': self.max_bytes,
+                'bytes': self._bytes,
+                'items': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+# Três ou mais caracteres não ASCII seguidos: comum em cirílico, grego ou
+# cp1250 lidos como cp1252, raro em português (no máximo "çõ", "ã”")
+NON_WESTERN_RUN = re.compile(r'[^\x00-\x7f]{3}')
+
+
+def looks_like_cp1252(sample):
+    """Se a amostra decodifica como cp1252 sem controles nem sequências improváveis"""
+    try:
+        text = sample.decode('cp1252')
+    except UnicodeDecodeError:
+        return False
+    if any(ord(c) < 32 and c not in '\t\n\r\f' for c in text):
+        return False
+    return NON_WESTERN_RUN.search(text) is None
+
+
+def detect_text_encoding(sample):
+    """Codificação do texto pela amostra: BOM, UTF-8, cp1252 plausível, charset_normalizer ou cp1252
+    
+    Retorna sempre um codec sem BOM ('utf-16-le' em vez de 'utf-16'),
+    para que qualquer janela do arquivo possa ser decodificada sozinha.
+    """
+    for bom, encoding in ((codecs.BOM_UTF32_LE, 'utf-32-le'), (codecs.BOM_UTF32_BE, 'utf-32-be'),
+                          (codecs.BOM_UTF8, 'utf-8'), (codecs.BOM_UTF16_LE, 'utf-16-le'),
+                          (codecs.BOM_UTF16_BE, 'utf-16-be')):
+        if sample.startswith(bom):
+            return encoding
+    try:
+        sample.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError as e:
+        if e.start >= len(sample) - 3 and e.reason == 'unexpected end of data':
+            return 'utf-8'  # Caractere cortado no fim da amostra
+    # Texto em português salvo no Windows: o charset_normalizer costuma
+    # preferir cp1250 ou hp-roman8 ("açăo", "aÓÐo") por pequenas diferenças
+    if looks_like_cp1252(sample):
+        return 'cp1252'
+    if detect_charset is not None:
+        matches = detect_charset(sample)
+        best = matches.best()
+        if best is not None:
+            # Páginas de código igualmente limpas: preferir a ocidental (português)
+            for match in matches:
+                if 'cp1252' in match.could_be_from_charset and match.chaos <= best.chaos:
+                    return 'cp1252'
+            return codecs.lookup(best.encoding).name
+    return 'cp1252'  # Padrão do Windows em português
+
+
+def find_line_end(data, newline, count=1):
+    """Posição logo após a `count`-ésima quebra de linha, ou -1
+    
+    Em UTF-16/32 só valem ocorrências alinhadas ao tamanho do caractere.
+    """
+    unit = len(newline)
+    position = 0
+    for _ in range(count):
+        position = data.find(newline, position)
+        while position != -1 and position % unit:
+            position = data.find(newline, position + 1)
+        if position == -1:
+            return -1
+        position += unit
+    return position
+
+
+def find_last_line_end(data, newline):
+    """Posição logo após a última quebra de linha, ou -1"""
+    unit = len(newline)
+    position = data.rfind(newline)
+    while position != -1 and position % unit:
+        position = data.rfind(newline, 0, position + unit - 1)
+    return -1 if position == -1 else position + unit
+
+
+def decode_text_window(data, encoding, lines=None, at_end=False):
+    """Decodificar uma janela do arquivo sem cortar linhas nem caracteres
+    
+    Retorna (texto, bytes consumidos). Fora do fim do arquivo, a janela
+    termina na última quebra de linha (ou na `lines`-ésima); sem nenhuma,
+    termina no último caractere completo.
+    """
+    newline = '\n'.encode(encoding)
+    cut = len(data)
+    if lines:
+        end = find_line_end(data, newline, lines)
+        if end != -1:
+            cut, at_end = end, False
+    if cut == len(data) and not at_end:
+        end = find_last_line_end(data, newline)
+        if end > 0:
+            cut = end
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    text = decoder.decode(data[:cut], final=at_end and cut == len(data))
+    return text, cut - len(decoder.getstate()[0])
+
+
+class EventStream:
+    """Distribuição de eventos Server-Sent Events às páginas abertas
+    
+    Cada conexão de /events tem sua fila; `publish` formata a mensagem uma
+    vez e a coloca em todas as filas sem bloquear. Um cliente lento cuja
+    fila enche é desligado e, ao reconectar com Last-Event-ID, recebe de
+    novo o que perdeu. O número de conexões é limitado porque cada uma
+    ocupa uma thread do servidor enquanto estiver aberta.
+    """
+    
+    def __init__(self, max_streams=EVENTS_MAX_STREAMS, queue_size=EVENTS_QUEUE_SIZE):
+        self.max_streams = max_streams
+        self.queue_size = queue_size
+        self._queues = set()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def format(event, data, event_id=None):
+        """Mensagem SSE com o evento, o ID opcional e os dados em JSON"""
+        lines = [f'event: {event}']
+        if event_id is not None:
+            lines.append(f'id: {event_id}')
+        lines.append(f'data: {json.dumps(data)}')
+        return '\n'.join(lines) + '\n\n'
+    
+    def subscribe(self):
+        """Fila de uma nova conexão, ou None se o limite foi atingido"""
+        with self._lock:
+            if len(self._queues) >= self.max_streams:
+                return None
+            events = queue.Queue(self.queue_size)
+            self._queues.add(events)
+            return events
+    
+    def unsubscribe(self, events):
+        with self._lock:
+            self._queues.discard(events)
+    
+    def publish(self, event, data, event_id=None, seq=None):
+        """Enviar um evento a todas as conexões
+        
+        `seq` identifica alterações do catálogo, para que uma conexão que
+        acabou de reenviar o histórico não repita as mesmas alterações.
+        """
+        with self._lock:
+            queues = list(self._queues)
+        if not queues:
+            return
+        message = (seq, self.format(event, data, event_id))
+        for events in queues:
+            try:
+                events.put_nowait(message)
+            except queue.Full:
+                self.disconnect(events)
+    
+    def disconnect(self, events):
+        """Sinalizar o fim da conexão (None), descartando eventos se a fila estiver cheia"""
+        self.unsubscribe(events)
+        while True:
+            try:
+                events.put_nowait(None)
+                return
+            except queue.Full:
+                try:
+                    events.get_nowait()
+                except queue.Empty:
+                    pass
+    
+    def close(self):
+        """Encerrar todas as conexões (ao desligar o servidor)"""
+        with self._lock:
+            queues = list(self._queues)
+        for events in queues:
+            self.disconnect(events)
+    
+    def __len__(self):
+        return len(self._queues)
+
+
+def iter_file_range(f, start, length, close=True, block_size=DOWNLOAD_BLOCK_SIZE):
+    """Ler `length` bytes de `f` a partir de `start`, em blocos"""
+    try:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(block_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        if close:
+            f.close()
+
+
+def content_disposition(filename, as_attachment):
+    """Argumentos do cabeçalho Content-Disposition, com nomes não ASCII pela RFC 5987"""
+    value = 'attachment' if as_attachment else 'inline'
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        quoted = quote(filename, safe="!#$&+-.^_`|~")
+        return value, {'filename': simple, 'filename*': f"UTF-8''{quoted}"}
+    return value, {'filename': filename}
+
 
 class P2PFileServer:
-    def __init__(self, port=5000, upload_folder='shared_files'):
+    def __init__(self, port=5000, upload_folder='shared_files', peers=(), discovery=True,
+                 replication=REPLICATION_FACTOR, replication_bandwidth=REPLICATION_BANDWIDTH,
+                 compression=STORAGE_COMPRESSION, hot_cache_bytes=HOT_CACHE_BYTES,
+                 hot_cache_max_object=HOT_CACHE_MAX_OBJECT):
         self.app = Flask(__name__)
+        self.app.request_class = UploadRequest
+        self.setup_templates()
         self.port = port
-        self.upload_folder = upload_folder
-        self.shared_files = {}  # Dicionário de arquivos compartilhados
+        self.upload_folder = os.path.abspath(upload_folder)
+        self.app.config['UPLOAD_FOLDER'] = self.upload_folder
         self.server_id = self.generate_server_id()
-        self.ngrok_url = None  # URL do Ngrok se disponível
+        self.hasher = FileHasher()
+        self.ngrok_url = None  # URL do Ngrok se disponível (escrita apenas pelo monitor)
+        self._ngrok_listeners = []  # Callbacks chamados quando a URL do Ngrok muda
+        self._ngrok_wakeup = threading.Event()
+        self._ngrok_checked = threading.Condition()
+        self._ngrok_checks = 0  # Quantas verificações o monitor já concluiu
         
         # Criar pasta de uploads se não existir
         if not os.path.exists(self.upload_folder):
             os.makedirs(self.upload_folder)
-            
-        # Tentar detectar URL do Ngrok
-        self.detect_ngrok_url()
         
-        # Iniciar thread para verificar Ngrok periodicamente
+        # Índice persistente de arquivos compartilhados (sobrevive a reinícios)
+        self.shared_files = FileIndex(os.path.join(self.upload_folder, INDEX_FILENAME))
+        self.objects = ObjectStore(self.upload_folder)
+        self.scan_status = {'state': 'pending', 'index_ready': False}
+        self.upload_sessions = UploadSessions(self.shared_files.db_path, self.upload_folder)
+        self.download_counters = DownloadCounters(self.shared_files)
+        self.text_previews = LRUCache(TEXT_PREVIEW_CACHE_BYTES)  # Janelas de texto por hash
+        self.hot_objects = LRUCache(hot_cache_bytes)  # Conteúdo e miniaturas pequenos por hash
+        self.hot_cache_max_object = min(hot_cache_max_object, hot_cache_bytes)
+        self.thumbnails = Thumbnails(self.upload_folder, self.open_content)
+        
+        # Atualizações ao vivo para as páginas abertas (/events)
+        self.events = EventStream()
+        self._events_lock = threading.Lock()
+        self._events_seq = self.shared_files.last_seq()  # Última alteração do catálogo publicada
+        self._live_downloads = {}  # hash -> contadores publicados, enquanto downloads/min > 0
+        self.shared_files.add_listener(self.publish_catalog_changes)
+        
+        # Outros servidores: lista configurada e descoberta na rede local
+        self.peers = PeerRegistry(self.server_id, self.port)
+        self._peer_wakeup = threading.Event()
+        self.swarm_jobs = {}  # hash -> SwarmDownload em andamento ou concluído
+        
+        # Replicação: envio a réplicas limitado para não competir com downloads
+        self.replicator = Replicator(self.shared_files, self.peers, self.port, replication)
+        self.replication_bucket = TokenBucket(replication_bandwidth)
+        
+        # Limites de banda por sentido, ajustáveis em /admin/bandwidth
+        self.bandwidth = {
+            'download': BandwidthScheduler(BANDWIDTH_DOWNLOAD_RATE, BANDWIDTH_PER_IP_RATE),
+            'upload': BandwidthScheduler(BANDWIDTH_UPLOAD_RATE, BANDWIDTH_PER_IP_RATE),
+        }
+        self._replication_wakeup = threading.Event()
+        for url in peers:
+            self.peers.add(url)
+        
+        # Compressão no armazenamento, feita em segundo plano após cada upload
+        if compression == 'zstd' and zstandard is None:
+            print("⚠️  zstandard não está instalado (pip install zstandard): usando gzip")
+            compression = 'gzip'
+        self.compressor = StorageCompressor(self.shared_files, self.objects, compression)
+        self._compression_wakeup = threading.Event()
+        
+        # Métricas pré-agregadas, lidas em /metrics
+        self.metrics = Metrics()
+        self.setup_metrics()
+            
+        # Iniciar thread que detecta o Ngrok (única responsável por atualizar ngrok_url)
+        self.add_ngrok_listener(self._log_ngrok_change)
+        self.add_ngrok_listener(self._publish_ngrok_change)
         self.start_ngrok_monitor()
+        
+        # Adotar em segundo plano arquivos que já estão na pasta compartilhada
+        self.start_index_scan()
+        self.start_upload_janitor()
+        self.start_download_flusher()
+        self.start_peer_sync()
+        if discovery:
+            self.start_peer_discovery()
+        if replication > 1:
+            self.start_replication()
+        if compression:
+            self.start_compression()
             
         self.setup_routes()
         
+    def setup_metrics(self):
+        """Declarar as métricas e medir cada requisição no nível WSGI"""
+        metrics = self.metrics
+        metrics.counter('p2pshare_http_requests_total', 'Requisições atendidas',
+                        ('route', 'method', 'status'))
+        metrics.histogram('p2pshare_http_request_duration_seconds',
+                          'Duração das requisições até o fim do envio da resposta (sem /events)',
+                          ('route', 'method'))
+        metrics.counter('p2pshare_http_received_bytes_total', 'Bytes recebidos no corpo das requisições',
+                        ('route',))
+        metrics.counter('p2pshare_http_sent_bytes_total', 'Bytes enviados no corpo das respostas',
+                        ('route',))
+        metrics.counter('p2pshare_transfer_bytes_total', 'Bytes de uploads e downloads de arquivos',
+                        ('direction',))
+        metrics.counter('p2pshare_transfer_seconds_total', 'Tempo somado das transferências de arquivos',
+                        ('direction',))
+        metrics.gauge('p2pshare_active_transfers', 'Uploads e downloads em andamento', ('direction',))
+        for direction in ('upload', 'download'):
+            metrics.inc('p2pshare_active_transfers', (direction,), 0)
+        metrics.counter('p2pshare_hashed_bytes_total', 'Bytes lidos pelo cálculo de SHA-256',
+                        callback=lambda: self.hasher.hashed_bytes)
+        metrics.counter('p2pshare_hash_seconds_total', 'Tempo somado do cálculo de SHA-256',
+                        callback=lambda: self.hasher.hash_seconds)
+        metrics.gauge('p2pshare_index_files', 'Arquivos no índice',
+                      callback=lambda: len(self.shared_files))
+        metrics.gauge('p2pshare_index_disk_bytes', 'Tamanho do índice SQLite em disco (com o WAL)',
+                      callback=self.index_disk_size)
+        metrics.histogram('p2pshare_ngrok_detect_duration_seconds', 'Duração das consultas à API do Ngrok',
+                          buckets=METRICS_NGROK_BUCKETS)
+        metrics.gauge('p2pshare_live_event_streams', 'Conexões abertas em /events',
+                      callback=lambda: len(self.events))
+        for field, kind, help_text in (('hits', 'counter', 'Consultas atendidas pelo cache em memória'),
+                                       ('misses', 'counter', 'Consultas ao cache em memória que foram ao disco'),
+                                       ('evictions', 'counter', 'Itens removidos do cache em memória por falta de espaço'),
+                                       ('bytes', 'gauge', 'Bytes ocupados no cache em memória'),
+                                       ('max_bytes', 'gauge', 'Limite de bytes do cache em memória')):
+            suffix = '_total' if kind == 'counter' else ''
+            declare = metrics.counter if kind == 'counter' else metrics.gauge
+            declare(f'p2pshare_memory_cache_{field}{suffix}', help_text, ('cache',),
+                    callback=lambda field=field: {(cache,): stats[field]
+                                                  for cache, stats in self.memory_cache_stats().items()})
+        
+        @self.app.before_request
+        def label_request():
+            # Rótulos lidos pelo middleware quando a resposta termina
+            request.environ['p2pshare.route'] = request.url_rule.rule if request.url_rule else 'unmatched'
+            direction = TRANSFER_ENDPOINTS.get(request.endpoint)
+            if direction:
+                request.environ['p2pshare.transfer'] = direction
+                metrics.inc('p2pshare_active_transfers', (direction,))
+        
+        self.app.wsgi_app = self.measure_requests(self.app.wsgi_app)
+    
+    def measure_requests(self, wsgi_app):
+        """Middleware WSGI que registra duração, bytes e status de cada requisição
+        
+        A medida é feita quando o servidor fecha o corpo da resposta, então
+        downloads longos contam o tempo inteiro do envio. O wsgi.file_wrapper
+        é devolvido ao servidor sem embrulho, para não perder o sendfile();
+        nesse caso os bytes enviados são os do Content-Length.
+        """
+        metrics = self.metrics
+        
+        def app(environ, start_response):
+            started = time.perf_counter()
+            response = {'status': '500', 'length': 0, 'stream': False}
+            
+            def capture(status, headers, exc_info=None):
+                response['status'] = status.split(' ', 1)[0]
+                for name, value in headers:
+                    name = name.lower()
+                    if name == 'content-length':
+                        response['length'] = int(value)
+                    elif name == 'content-type':
+                        response['stream'] = value.startswith('text/event-stream')
+                return start_response(status, headers, exc_info)
+            
+            def finish(sent):
+                elapsed = time.perf_counter() - started
+                route = environ.get('p2pshare.route', 'unmatched')
+                method = environ['REQUEST_METHOD']
+                received = int(environ.get('CONTENT_LENGTH') or 0)
+                metrics.inc('p2pshare_http_requests_total', (route, method, response['status']))
+                if not response['stream']:
+                    metrics.observe('p2pshare_http_request_duration_seconds', elapsed, (route, method))
+                if received:
+                    metrics.inc('p2pshare_http_received_bytes_total', (route,), received)
+                if sent:
+                    metrics.inc('p2pshare_http_sent_bytes_total', (route,), sent)
+                direction = environ.get('p2pshare.transfer')
+                if direction:
+                    metrics.inc('p2pshare_active_transfers', (direction,), -1)
+                    metrics.inc('p2pshare_transfer_bytes_total', (direction,),
+                                received if direction == 'upload' else sent)
+                    metrics.inc('p2pshare_transfer_seconds_total', (direction,), elapsed)
+            
+            body = wsgi_app(environ, capture)
+            file_wrapper = environ.get('wsgi.file_wrapper')
+            if isinstance(file_wrapper, type) and isinstance(body, file_wrapper):
+                close = getattr(body, 'close', None)
+                
+                def close_and_record():
+                    try:
+                        if close is not None:
+                            close()
+                    finally:
+                        finish(response['length'])
+                body.close = close_and_record
+                return body
+            return MeasuredBody(body, finish)
+        
+        return app
+    
+    def memory_cache_stats(self):
+        """Estatísticas dos caches em memória: objetos pequenos e janelas de texto"""
+        return {
+            'objects': dict(self.hot_objects.stats(), max_object=self.hot_cache_max_object),
+            'text_previews': self.text_previews.stats(),
+        }
+    
+    def index_disk_size(self):
+        """Bytes ocupados pelo índice SQLite e seu WAL"""
+        total = 0
+        for suffix in ('', '-wal'):
+            try:
+                total += os.path.getsize(self.shared_files.db_path + suffix)
+            except OSError:
+                pass
+        return total
+    
+    def setup_templates(self):
+        """Compilar os templates uma única vez e preparar os arquivos estáticos"""
+        self.app.jinja_loader = DictLoader({
+            'index.html': HTML_TEMPLATE,
+            'view.html': FILE_VIEW_TEMPLATE,
+            'not_found.html': FILE_NOT_FOUND_TEMPLATE,
+        })
+        for name in self.app.jinja_loader.list_templates():
+            self.app.jinja_env.get_template(name)
+        
+        # Versão de cada arquivo estático = início do hash do conteúdo
+        self.assets = {}
+        for name, content, mimetype in (('app.css', INDEX_CSS, 'text/css'),
+                                        ('app.js', INDEX_JS, 'application/javascript')):
+            data = content.encode('utf-8')
+            self.assets[name] = (data, mimetype, hashlib.sha256(data).hexdigest()[:12])
+        self.asset_versions = {name: asset[2] for name, asset in self.assets.items()}
+    
     def generate_server_id(self):
         """Gerar ID único para o servidor"""
         hostname = socket.gethostname()
@@ -36,85 +2969,828 @@ class P2PFileServer:
     
     def calculate_file_hash(self, filepath):
         """Calcular hash SHA-256 do arquivo"""
-        hash_sha256 = hashlib.sha256()
-        with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_sha256.update(chunk)
-        return hash_sha256.hexdigest()
+        return self.hasher.hash_file(filepath)
     
-    def detect_ngrok_url(self):
-        """Detectar URL do Ngrok se estiver rodando"""
+    def file_stat_fields(self, filepath):
+        """Metadados do sistema de arquivos guardados no índice"""
+        st = os.stat(filepath)
+        return {
+            'size': st.st_size,
+            'mtime': st.st_mtime,
+            'mtime_ns': st.st_mtime_ns,
+            'inode': st.st_ino,
+        }
+    
+    def start_index_scan(self):
+        """Iniciar a varredura incremental da pasta compartilhada em thread separada"""
+        scan_thread = threading.Thread(target=self.scan_upload_folder, daemon=True)
+        scan_thread.start()
+    
+    def scan_upload_folder(self):
+        """Importar os arquivos soltos na pasta compartilhada e conferir os objetos
+        
+        Arquivos colocados diretamente na pasta (inclusive os guardados ali
+        por versões anteriores) são movidos, sem cópia, para objects/ e o
+        nome original vira um nome do conteúdo. Arquivos já indexados cujo
+        (inode, tamanho, mtime_ns) não mudou não têm o hash recalculado; os
+        demais são calculados em um pool de threads. Entradas sem objeto
+        saem do índice e objetos sem entrada são apagados.
+        """
+        status = {
+            'state': 'scanning',
+            'index_ready': False,
+            'started': time.time(),
+            'files_seen': 0,
+            'files_unchanged': 0,
+            'files_to_hash': 0,
+            'files_hashed': 0,
+            'files_removed': 0,
+            'objects_collected': 0,
+            'bytes_to_hash': 0,
+            'bytes_hashed': 0,
+            'errors': 0,
+        }
+        self.scan_status = status
+        
+        # Retrato do índice antes da varredura; uploads feitos durante ela não são tocados
+        indexed = {info['filepath']: info for info in self.shared_files.values()}
+        to_hash = {}  # caminho -> tamanho
+        
         try:
-            # Tentar acessar a API local do Ngrok
-            response = requests.get('http://localhost:4040/api/tunnels', timeout=3)
-            if response.status_code == 200:
-                data = response.json()
-                tunnels = data.get('tunnels', [])
-                
-                for tunnel in tunnels:
-                    config = tunnel.get('config', {})
-                    public_url = tunnel.get('public_url', '')
+            migrated = []
+            with os.scandir(self.upload_folder) as entries:
+                for entry in entries:
+                    # Ignorar o índice, uploads em andamento, outros ocultos e objects/
+                    if entry.name.startswith('.') or not entry.is_file():
+                        continue
+                    st = entry.stat()
+                    status['files_seen'] += 1
                     
-                    # Verificar se é o túnel para nossa porta
-                    addr = config.get('addr', '')
-                    if f'localhost:{self.port}' in addr or f'127.0.0.1:{self.port}' in addr:
-                        self.ngrok_url = public_url
-                        print(f"🌍 Ngrok detectado: {self.ngrok_url}")
-                        return True
-                    
-                    # Fallback: pegar qualquer túnel HTTP se for porta 5000
-                    if self.port == 5000 and public_url and 'http' in public_url:
-                        self.ngrok_url = public_url
-                        print(f"🌍 Ngrok detectado (fallback): {self.ngrok_url}")
-                        return True
-                        
+                    info = indexed.get(entry.path)
+                    if info and (info['inode'], info['size'], info['mtime_ns']) == \
+                            (st.st_ino, st.st_size, st.st_mtime_ns):
+                        # Indexado por uma versão anterior: só mover para objects/
+                        status['files_unchanged'] += 1
+                        filepath = self.objects.put(entry.path, info['hash'])
+                        migrated.append(dict(info, filepath=filepath, **self.file_stat_fields(filepath)))
+                        continue
+                    to_hash[entry.path] = st.st_size
+                    status['files_to_hash'] += 1
+                    status['bytes_to_hash'] += st.st_size
+            if migrated:
+                self.shared_files.add_many(migrated)
+            
+            batch = []
+            for path, digest, error in self.hasher.hash_many(to_hash, pieces=True):
+                try:
+                    if error:
+                        raise error
+                    file_hash = digest.sha256
+                    filename = os.path.basename(path)
+                    mtime = os.stat(path).st_mtime
+                    filepath = self.objects.put(path, file_hash)
+                except OSError as e:
+                    print(f"Erro ao indexar {path}: {e}")
+                    status['errors'] += 1
+                    continue
+                
+                existing = self.shared_files.get(file_hash)
+                if existing is not None:
+                    # Conteúdo já indexado: um nome a mais (e o caminho novo, se era um arquivo solto)
+                    if existing['filepath'] != filepath:
+                        self.shared_files.add(dict(existing, filepath=filepath,
+                                                   **self.file_stat_fields(filepath)))
+                    self.shared_files.add_name(file_hash, filename)
+                elif any(info['hash'] == file_hash for info in batch):
+                    self.shared_files.add_name(file_hash, filename)
+                else:
+                    batch.append(dict(self.file_stat_fields(filepath), **digest.pieces.index_fields(),
+                        hash=file_hash,
+                        filename=filename,
+                        filepath=filepath,
+                        upload_time=mtime,
+                        download_count=0))
+                status['files_hashed'] += 1
+                status['bytes_hashed'] += to_hash[path]
+                if len(batch) >= SCAN_BATCH_SIZE:
+                    self.shared_files.add_many(batch)
+                    batch = []
+            if batch:
+                self.shared_files.add_many(batch)
+            
+            # Entradas cujo objeto sumiu (inclusive arquivos antigos alterados ou apagados)
+            removed = [info['hash'] for info in indexed.values()
+                       if not os.path.exists(self.shared_files.get(info['hash'], info)['filepath'])]
+            if removed:
+                self.shared_files.remove_many(removed)
+                status['files_removed'] = len(removed)
+            
+            status['objects_collected'] = self.objects.collect_garbage(self.shared_files)
+            status['state'] = 'ready'
+        except Exception as e:
+            print(f"Erro na varredura da pasta compartilhada: {e}")
+            status['state'] = 'error'
+            status['error'] = str(e)
+        
+        status['finished'] = time.time()
+        status['index_ready'] = True
+        self._compression_wakeup.set()
+        if status['files_hashed'] or status['files_removed'] or status['objects_collected']:
+            print(f"📚 Índice atualizado: {status['files_hashed']} arquivo(s) indexado(s), "
+                  f"{status['files_removed']} removido(s), "
+                  f"{status['objects_collected']} objeto(s) órfão(s) apagado(s)")
+    
+    def start_upload_janitor(self):
+        """Limpar periodicamente sessões de upload abandonadas"""
+        def janitor():
+            while True:
+                try:
+                    removed = self.upload_sessions.collect_garbage()
+                    if removed:
+                        print(f"🧹 {removed} upload(s) abandonado(s) removido(s)")
+                except Exception as e:
+                    print(f"Erro ao limpar uploads abandonados: {e}")
+                time.sleep(UPLOAD_GC_INTERVAL)
+        
+        janitor_thread = threading.Thread(target=janitor, daemon=True)
+        janitor_thread.start()
+    
+    def start_download_flusher(self):
+        """Gravar periodicamente no índice os downloads contados em memória"""
+        def flusher():
+            while True:
+                time.sleep(DOWNLOAD_FLUSH_INTERVAL)
+                try:
+                    self.publish_download_counts(self.download_counters.flush())
+                except Exception as e:
+                    print(f"Erro ao gravar contadores de downloads: {e}")
+        
+        flusher_thread = threading.Thread(target=flusher, daemon=True)
+        flusher_thread.start()
+    
+    def start_peer_sync(self):
+        """Sincronizar periodicamente os catálogos dos peers"""
+        def sync_loop():
+            while True:
+                try:
+                    self.peers.sync_all()
+                except Exception as e:
+                    print(f"Erro ao sincronizar peers: {e}")
+                self._peer_wakeup.wait(PEER_SYNC_INTERVAL)
+                self._peer_wakeup.clear()
+        
+        sync_thread = threading.Thread(target=sync_loop, daemon=True)
+        sync_thread.start()
+    
+    def start_peer_discovery(self):
+        """Anunciar este servidor na rede local e ouvir anúncios de outros (UDP multicast)"""
+        announcement = json.dumps({
+            'service': 'p2pshare',
+            'server_id': self.server_id,
+            'port': self.port
+        }).encode()
+        
+        try:
+            listener_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            listener_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, 'SO_REUSEPORT'):
+                listener_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            listener_socket.bind(('', DISCOVERY_PORT))
+            membership = struct.pack('4s4s', socket.inet_aton(DISCOVERY_GROUP), socket.inet_aton('0.0.0.0'))
+            listener_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            
+            announcer_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            announcer_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        except OSError as e:
+            print(f"⚠️  Descoberta na rede local indisponível: {e}")
+            return
+        
+        def announcer():
+            while True:
+                try:
+                    announcer_socket.sendto(announcement, (DISCOVERY_GROUP, DISCOVERY_PORT))
+                except OSError:
+                    pass  # Sem rede no momento; tentar no próximo anúncio
+                time.sleep(DISCOVERY_INTERVAL)
+        
+        def listener():
+            while True:
+                try:
+                    data, (host, _) = listener_socket.recvfrom(1024)
+                    message = json.loads(data)
+                    if message.get('service') != 'p2pshare' or message.get('server_id') == self.server_id:
+                        continue
+                    url = peer_url(host, int(message['port']))
+                except (OSError, ValueError, KeyError, TypeError):
+                    continue
+                if self.peers.add(url, source='multicast', server_id=message['server_id']):
+                    print(f"🔗 Peer descoberto na rede local: {url}")
+                    self._peer_wakeup.set()
+        
+        threading.Thread(target=announcer, daemon=True).start()
+        threading.Thread(target=listener, daemon=True).start()
+    
+    def start_replication(self):
+        """Verificar periodicamente as réplicas (e logo após cada novo arquivo)"""
+        def replication_loop():
+            while True:
+                # Esperar primeiro: a varredura e a sincronização precisam de um tempo
+                self._replication_wakeup.wait(REPLICATION_INTERVAL)
+                self._replication_wakeup.clear()
+                try:
+                    self.replicator.run_pass()
+                except Exception as e:
+                    print(f"Erro na replicação: {e}")
+        
+        replication_thread = threading.Thread(target=replication_loop, daemon=True)
+        replication_thread.start()
+    
+    def start_compression(self):
+        """Comprimir em segundo plano os arquivos novos que compensam"""
+        def compression_loop():
+            while True:
+                self._compression_wakeup.wait(COMPRESSION_INTERVAL)
+                self._compression_wakeup.clear()
+                # A varredura pode estar movendo arquivos soltos para objects/
+                if not self.scan_status['index_ready']:
+                    continue
+                try:
+                    self.compressor.run_pass()
+                except Exception as e:
+                    print(f"Erro na compressão: {e}")
+        
+        compression_thread = threading.Thread(target=compression_loop, daemon=True)
+        compression_thread.start()
+    
+    def start_swarm_fetch(self, file_hash, sources, background=False):
+        """Baixar um arquivo dos peers em segundo plano e publicá-lo aqui
+        
+        Com `background`, o download usa uma conexão por peer e pede aos
+        peers o envio limitado de prioridade de fundo (replicação).
+        """
+        part_path = os.path.join(self.upload_folder, f'.swarm-{file_hash}.part')
+        if background:
+            download = SwarmDownload(file_hash, sources, part_path, self.hasher, connections_per_peer=1,
+                                     headers={'X-P2P-Priority': 'background'})
+        else:
+            download = SwarmDownload(file_hash, sources, part_path, self.hasher)
+        self.swarm_jobs[file_hash] = download
+        
+        def fetch():
+            try:
+                digest = download.run()
+            except Exception as e:
+                print(f"❌ Download em enxame de {file_hash[:16]} falhou: {e}")
+                return
+            filename = secure_filename(download.manifest['filename']) or file_hash
+            filepath = self.objects.put(part_path, file_hash)
+            self.register_file(filepath, filename, file_hash, digest.pieces)
+            size_mb = download.manifest['size'] / (1024 * 1024)
+            print(f"📥 {filename} baixado de {len(sources)} peer(s): "
+                  f"{size_mb:.1f} MB em {download.elapsed:.1f}s")
+        
+        threading.Thread(target=fetch, daemon=True).start()
+        return download
+    
+    def register_file(self, filepath, filename, file_hash, pieces):
+        """Adicionar ao índice um arquivo já guardado no ObjectStore
+        
+        Se o conteúdo já estava indexado, apenas o nome novo é acrescentado.
+        """
+        if file_hash in self.shared_files:
+            self.shared_files.add_name(file_hash, filename)
+            return
+        self.shared_files.add({
+            'filename': filename,
+            'filepath': filepath,
+            'hash': file_hash,
+            'upload_time': time.time(),
+            'download_count': 0,
+            **self.file_stat_fields(filepath),
+            **pieces.index_fields()
+        })
+        self.thumbnails.submit(self.shared_files[file_hash])
+        self._replication_wakeup.set()
+        self._compression_wakeup.set()
+    
+    def upload_result(self, file_hash, filename, **extra):
+        """Resposta JSON comum aos endpoints de upload"""
+        base_url = self.get_base_url(request)
+        share_link = f"{base_url}/download/{file_hash}"
+        
+        return jsonify({
+            'message': 'Arquivo enviado com sucesso',
+            'file_hash': file_hash,
+            'filename': filename,
+            'share_link': share_link,
+            'ngrok_url': self.ngrok_url,
+            **extra
+        })
+    
+    def upload_session_status(self, session):
+        """Representação JSON de uma sessão de upload retomável"""
+        return {
+            'upload_id': session['id'],
+            'filename': session['filename'],
+            'size': session['size'],
+            'chunk_size': UPLOAD_CHUNK_SIZE,
+            'received': session['received'],
+            'bytes_received': sum(end - start for start, end in session['received']),
+            'complete': UploadSessions.is_complete(session),
+        }
+    
+    @staticmethod
+    def cache_forever(response):
+        """Permitir que navegadores e CDNs guardem a resposta sem nunca revalidar
+        
+        Usado em URLs que identificam o conteúdo (hash ou versão): o que
+        elas devolvem nunca muda.
+        """
+        response.cache_control.public = True
+        response.cache_control.max_age = ASSET_MAX_AGE
+        response.cache_control.immutable = True
+        return response
+    
+    @staticmethod
+    def json_conditional(data):
+        """Resposta JSON com ETag fraca do corpo; 304 se o cliente já tem a mesma versão
+        
+        O cliente guarda a resposta, mas revalida a cada uso (no-cache),
+        já que listas e links mudam com o catálogo e o túnel do Ngrok.
+        """
+        response = jsonify(data)
+        response.add_etag(weak=True)
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    
+    def client_address(self):
+        """IP do cliente; pelo Ngrok (conexão local), o último de X-Forwarded-For
+        
+        O Ngrok acrescenta o endereço real ao fim da lista; o que vem antes
+        foi enviado pelo próprio cliente e não serve para identificá-lo.
+        """
+        address = request.remote_addr or ''
+        forwarded = request.headers.get('X-Forwarded-For')
+        if forwarded and address in ('127.0.0.1', '::1'):
+            return forwarded.split(',')[-1].strip() or address
+        return address
+    
+    def is_local_request(self):
+        """Se a requisição veio desta máquina sem passar pelo Ngrok"""
+        return request.remote_addr in ('127.0.0.1', '::1') and 'X-Forwarded-For' not in request.headers
+    
+    def shaped(self, body, priority, direction='download'):
+        """`body` enviado no ritmo do escalonador de banda, ou como está se não há limites"""
+        scheduler = self.bandwidth[direction]
+        if not scheduler.active:
+            return body
+        return scheduler.open(self.client_address(), priority).iterate(body)
+    
+    def requested_ranges(self, file_info):
+        """Intervalos [início, fim) pedidos no cabeçalho Range
+        
+        Retorna None para enviar o arquivo inteiro (sem Range, Range inválido
+        ou If-Range que não confere) e [] se nenhum intervalo é satisfazível.
+        """
+        byte_range = request.range
+        if byte_range is None or byte_range.units != 'bytes' or len(byte_range.ranges) > MAX_RANGES:
+            return None
+        
+        # If-Range: o intervalo só vale se o cliente tem a mesma versão do arquivo
+        if_range = request.if_range
+        if if_range.etag is not None and if_range.etag != file_info['hash']:
+            return None
+        if if_range.date is not None and (file_info['mtime'] is None or
+                                          int(file_info['mtime']) > if_range.date.timestamp()):
+            return None
+        
+        size = file_info['size']
+        ranges = []
+        for start, end in byte_range.ranges:
+            if start < 0:
+                start, end = max(size + start, 0), size
+            else:
+                end = size if end is None else min(end, size)
+            if start < end:
+                ranges.append((start, end))
+        return ranges
+    
+    def file_body(self, f, start, length):
+        """Corpo da resposta com `length` bytes do arquivo a partir de `start`
+        
+        Usa o wsgi.file_wrapper do servidor quando existe: o gunicorn envia
+        com sendfile() (cópia zero pelo kernel) e o waitress lê em blocos
+        grandes, ambos limitados pelo Content-Length da resposta. Objetos
+        comprimidos lidos por CompressedReader vão em blocos pelo iterador,
+        assim como tudo enquanto houver limite de banda.
+        """
+        if self.bandwidth['download'].active:
+            # Blocos pequenos, liberados um a um pelo escalonador de banda
+            return iter_file_range(f, start, length, block_size=BANDWIDTH_BLOCK_SIZE)
+        if isinstance(f, io.BytesIO):
+            # Objeto do cache em memória: um só bloco, sem passar pelo disco
+            return [f.getvalue()[start:start + length]]
+        file_wrapper = request.environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None and hasattr(f, 'fileno'):
+            f.seek(start)
+            return file_wrapper(f, DOWNLOAD_BLOCK_SIZE)
+        return iter_file_range(f, start, length)
+    
+    def hot_read(self, key, read, max_size=None):
+        """Bytes de um objeto pequeno pelo cache em memória, chamando `read` na falta
+        
+        A chave inclui o hash do conteúdo, que nunca muda: nada no cache
+        precisa ser invalidado, só sai por falta de espaço. Retorna None
+        (sem chamar `read`) se `max_size` passa do limite por objeto; o
+        resultado de `read` só é guardado se couber nesse limite.
+        """
+        if max_size is not None and max_size > self.hot_cache_max_object:
+            return None
+        data = self.hot_objects.get(key)
+        if data is None:
+            data = read()
+            if data is not None and len(data) <= self.hot_cache_max_object:
+                self.hot_objects.put(key, data, len(data))
+        return data
+    
+    def read_content(self, file_info):
+        """Conteúdo original inteiro de um arquivo"""
+        with self.open_content(file_info) as f:
+            return f.read()
+    
+    def read_stored(self, file_info):
+        """Objeto como está guardado no disco (comprimido, se for o caso)"""
+        with open(file_info['filepath'], 'rb') as f:
+            return f.read()
+    
+    def open_content(self, file_info):
+        """Abrir o conteúdo original do arquivo, esteja ele guardado comprimido ou não"""
+        try:
+            if file_info.get('encoding') in COMPRESSION_SUFFIXES:
+                frame_size, offsets = self.shared_files.get_frames(file_info['hash'])
+                return CompressedReader(file_info['filepath'], file_info['encoding'],
+                                        frame_size, offsets, file_info['size'])
+            return open(file_info['filepath'], 'rb')
+        except FileNotFoundError:
+            # O compressor pode ter acabado de trocar o objeto original pelo comprimido
+            current = self.shared_files.get(file_info['hash'])
+            if current is None or current['filepath'] == file_info['filepath']:
+                raise
+            return self.open_content(current)
+    
+    def send_content(self, file_info, as_attachment=False, priority='bulk'):
+        """Enviar o conteúdo de um arquivo com ETag, Range (inclusive múltiplos) e If-Range
+        
+        Se o objeto está guardado comprimido e o cliente aceita a mesma
+        codificação, o pedido sem Range recebe o objeto como está, com
+        Content-Encoding. Intervalos sempre se referem ao conteúdo original
+        (o do SHA-256), descomprimido só nos quadros necessários. `priority`
+        é a classe do envio no escalonador de banda.
+        
+        A ETag é o próprio hash (ou hash-codificação na variante comprimida)
+        e a resposta pode ficar em cache para sempre; If-None-Match é
+        respondido com 304 só com o índice em memória, sem abrir o arquivo.
+        Arquivos pequenos são servidos do cache em memória (hot_read).
+        """
+        file_hash = file_info['hash']
+        size = file_info['size']
+        mimetype = mimetypes.guess_type(file_info['filename'])[0] or 'application/octet-stream'
+        encoding = file_info.get('encoding')
+        compressed = encoding in COMPRESSION_SUFFIXES
+        
+        ranges = self.requested_ranges(file_info)
+        send_encoded = compressed and ranges is None and request.accept_encodings[encoding] > 0
+        etag = f'{file_hash}-{encoding}' if send_encoded else file_hash
+        
+        headers = Headers()
+        headers['ETag'] = f'"{etag}"'
+        headers['Accept-Ranges'] = 'bytes'
+        if compressed:
+            headers['Vary'] = 'Accept-Encoding'
+        if file_info['mtime']:
+            headers['Last-Modified'] = http_date(file_info['mtime'])
+        disposition, names = content_disposition(file_info['filename'], as_attachment)
+        headers.set('Content-Disposition', disposition, **names)
+        
+        # As duas variantes têm o mesmo conteúdo: qualquer uma delas em cache serve
+        for cached in dict.fromkeys((etag, file_hash)):
+            if request.if_none_match.contains(cached):
+                headers['ETag'] = f'"{cached}"'
+                return self.cache_forever(Response(status=304, headers=headers))
+        
+        if ranges == []:
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status=416, headers=headers)
+        
+        if send_encoded:
+            data = self.hot_read((file_hash, encoding), lambda: self.read_stored(file_info), size)
+            f = io.BytesIO(data) if data is not None else open(file_info['filepath'], 'rb')
+            status, length = 200, len(data) if data is not None else os.fstat(f.fileno()).st_size
+            headers['Content-Encoding'] = encoding
+            body = self.shaped(self.file_body(f, 0, length), priority)
+            response = Response(body, status=status, headers=headers,
+                                mimetype=mimetype, direct_passthrough=True)
+            response.content_length = length
+            return self.cache_forever(response)
+        
+        data = self.hot_read(file_hash, lambda: self.read_content(file_info), size)
+        f = io.BytesIO(data) if data is not None else self.open_content(file_info)
+        if ranges is None:
+            status, length = 200, size
+            body = self.file_body(f, 0, size)
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            status, length = 206, end - start
+            headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+            body = self.file_body(f, start, length)
+        else:
+            # Vários intervalos: multipart/byteranges montado em blocos
+            boundary = uuid.uuid4().hex
+            parts = []
+            for i, (start, end) in enumerate(ranges):
+                separator = b'' if i == 0 else b'\r\n'
+                part_header = separator + (f'--{boundary}\r\n'
+                                           f'Content-Type: {mimetype}\r\n'
+                                           f'Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n').encode()
+                parts.append((part_header, start, end))
+            closing = f'\r\n--{boundary}--\r\n'.encode()
+            
+            def multipart_body():
+                try:
+                    for part_header, start, end in parts:
+                        yield part_header
+                        yield from iter_file_range(f, start, end - start, close=False)
+                    yield closing
+                finally:
+                    f.close()
+            
+            status = 206
+            length = sum(len(h) + end - start for h, start, end in parts) + len(closing)
+            mimetype = f'multipart/byteranges; boundary={boundary}'
+            body = multipart_body()
+        
+        body = self.shaped(body, priority)
+        response = Response(body, status=status, headers=headers,
+                            mimetype=mimetype, direct_passthrough=True)
+        response.content_length = length
+        return self.cache_forever(response)
+    
+    def text_preview(self, file_info, offset=0, length=TEXT_PREVIEW_WINDOW, lines=None):
+        """Janela de texto do arquivo a partir de `offset`, lida e decodificada no servidor
+        
+        Só `length` bytes são lidos do disco (e, em objetos comprimidos, só
+        os quadros que os cobrem). A codificação é detectada uma vez, pelo
+        início do arquivo; como o conteúdo de um hash nunca muda, as janelas
+        prontas ficam em cache até saírem por falta de espaço.
+        """
+        file_hash = file_info['hash']
+        key = (file_hash, offset, length, lines)
+        cached = self.text_previews.get(key)
+        if cached is not None:
+            return cached
+        
+        size = file_info['size']
+        encoding = self.text_previews.get((file_hash, 'encoding'))
+        with self.open_content(file_info) as f:
+            if encoding is None:
+                encoding = detect_text_encoding(f.read(TEXT_PREVIEW_WINDOW))
+                self.text_previews.put((file_hash, 'encoding'), encoding, len(encoding))
+            f.seek(offset)
+            data = f.read(length)
+        
+        at_end = offset + len(data) >= size
+        text, consumed = decode_text_window(data, encoding, lines, at_end)
+        if offset == 0:
+            text = text.lstrip('\ufeff')
+        next_offset = offset + consumed
+        preview = {
+            'hash': file_hash,
+            'encoding': encoding,
+            'size': size,
+            'offset': offset,
+            'next_offset': next_offset if next_offset < size and consumed else None,
+            'text': text,
+        }
+        self.text_previews.put(key, preview, len(text) * 2)
+        return preview
+    
+    def get_manifest(self, file_hash):
+        """Manifesto de pedaços de um arquivo (calculado na hora para entradas antigas)"""
+        file_info = self.shared_files.get(file_hash)
+        if file_info is None:
+            return None
+        
+        piece_digests = self.shared_files.get_pieces(file_hash)
+        if piece_digests is None:
+            digest = self.hasher.digest_file(file_info['filepath'])
+            if digest.sha256 != file_hash:
+                raise IOError(f"Conteúdo de {file_info['filepath']} não confere com o hash")
+            piece_digests = digest.pieces.digests()
+            self.shared_files.set_pieces(file_hash, digest.pieces.piece_size, piece_digests)
+            file_info = self.shared_files[file_hash]
+        
+        return {
+            'hash': file_hash,
+            'filename': file_info['filename'],
+            'size': file_info['size'],
+            'piece_size': file_info['piece_size'],
+            'piece_count': len(piece_digests) // 32,
+            'merkle_root': file_info['merkle_root'],
+            'names': self.shared_files.names(file_hash),
+            'pieces': [piece_digests[i:i + 32].hex() for i in range(0, len(piece_digests), 32)],
+        }
+    
+    def file_summary(self, info):
+        """Dados de um arquivo mostrados nos cartões da página principal"""
+        return {
+            'hash': info['hash'],
+            'filename': info['filename'],
+            'size': info['size'],
+            'upload_time': info['upload_time'],
+            'download_count': self.download_counters.count(info),
+            'downloads_per_minute': self.download_counters.rate(info['hash']),
+            'thumbnail': self.thumbnails.kind(info['filename']) is not None,
+        }
+    
+    def live_status(self):
+        """Estado enviado às páginas ao conectar em /events e quando o túnel muda"""
+        return {
+            'ngrok_url': self.ngrok_url,
+            'ngrok_active': self.ngrok_url is not None,
+            'file_count': len(self.shared_files),
+        }
+    
+    def catalog_event(self, change):
+        """Evento 'file' de uma alteração do catálogo: (dados, ID do evento)
+        
+        Adições levam os dados do cartão; o ID ('catalogo:seq') volta no
+        Last-Event-ID quando o navegador reconecta.
+        """
+        info = self.shared_files.get(change['hash'])
+        if change['op'] == 'add' and info is not None:
+            data = dict(self.file_summary(info), op='add')
+        else:
+            data = {'op': 'remove', 'hash': change['hash']}
+        data['total'] = len(self.shared_files)
+        return data, f"{self.shared_files.catalog_id}:{change['seq']}"
+    
+    def publish_catalog_changes(self):
+        """Listener do índice: enviar às páginas as alterações ainda não publicadas"""
+        with self._events_lock:
+            if not len(self.events):
+                self._events_seq = self.shared_files.last_seq()
+                return
+            more = True
+            while more:
+                changes, more = self.shared_files.changes_since(self._events_seq)
+                for change in changes:
+                    data, event_id = self.catalog_event(change)
+                    self.events.publish('file', data, event_id, seq=change['seq'])
+                    self._events_seq = change['seq']
+    
+    def publish_download_counts(self, merged):
+        """Enviar às páginas os contadores e downloads/min que mudaram
+        
+        Além dos arquivos do lote, são conferidos os que ainda tinham
+        downloads/min no envio anterior, cuja taxa cai conforme a janela avança.
+        """
+        published = self._live_downloads
+        live = {}
+        files = {}
+        for file_hash in set(merged) | set(published):
+            info = self.shared_files.get(file_hash)
+            if info is None:
+                continue
+            counts = {
+                'download_count': self.download_counters.count(info),
+                'downloads_per_minute': self.download_counters.rate(file_hash),
+            }
+            if counts['downloads_per_minute']:
+                live[file_hash] = counts
+            if counts != published.get(file_hash):
+                files[file_hash] = counts
+        self._live_downloads = live  # Trocado inteiro: /events/poll lê sem trava
+        if files:
+            self.events.publish('downloads', {'files': files})
+    
+    def detect_ngrok_url(self):
+        """Detectar URL do Ngrok se estiver rodando (sem alterar o estado do servidor)"""
+        try:
+            return self._query_ngrok_api()
         except Exception as e:
             print(f"Tentando detectar Ngrok: {e}")
-            pass
-        return False
+        return None
+    
+    def _query_ngrok_api(self):
+        """Consultar a API local do Ngrok; levanta exceção se a API estiver fora do ar"""
+        started = time.perf_counter()
+        try:
+            response = requests.get('http://localhost:4040/api/tunnels', timeout=3)
+        finally:
+            self.metrics.observe('p2pshare_ngrok_detect_duration_seconds', time.perf_counter() - started)
+        if response.status_code != 200:
+            return None
+        
+        data = response.json()
+        tunnels = data.get('tunnels', [])
+        
+        for tunnel in tunnels:
+            config = tunnel.get('config', {})
+            public_url = tunnel.get('public_url', '')
+            
+            # Verificar se é o túnel para nossa porta
+            addr = config.get('addr', '')
+            if f'localhost:{self.port}' in addr or f'127.0.0.1:{self.port}' in addr:
+                return public_url
+            
+            # Fallback: pegar qualquer túnel HTTP se for porta 5000
+            if self.port == 5000 and public_url and 'http' in public_url:
+                return public_url
+        return None
+    
+    def add_ngrok_listener(self, callback):
+        """Registrar callback(old_url, new_url) chamado quando a URL do Ngrok muda"""
+        self._ngrok_listeners.append(callback)
+    
+    def _log_ngrok_change(self, old_url, new_url):
+        """Listener padrão: informar mudanças do túnel no console"""
+        if new_url:
+            print(f"🎉 Ngrok conectado! Acesso público: {new_url}")
+        elif old_url:
+            print("⚠️  Ngrok desconectado")
+    
+    def _publish_ngrok_change(self, old_url, new_url):
+        """Listener: avisar as páginas abertas da mudança do túnel"""
+        self.events.publish('status', self.live_status())
+    
+    def _set_ngrok_url(self, url):
+        """Publicar nova URL do Ngrok e notificar os listeners (chamado só pelo monitor)"""
+        old_url = self.ngrok_url
+        if url == old_url:
+            return
+        self.ngrok_url = url
+        for callback in list(self._ngrok_listeners):
+            try:
+                callback(old_url, url)
+            except Exception as e:
+                print(f"Erro em listener do Ngrok: {e}")
     
     def start_ngrok_monitor(self):
         """Iniciar monitoramento do Ngrok em thread separada"""
         def monitor_ngrok():
-            import time
+            delay = NGROK_CHECK_INTERVAL
             while True:
+                started = time.monotonic()
                 try:
-                    time.sleep(5)  # Verificar a cada 5 segundos
-                    old_url = self.ngrok_url
-                    self.detect_ngrok_url()
-                    
-                    # Se detectou Ngrok pela primeira vez
-                    if not old_url and self.ngrok_url:
-                        print(f"🎉 Ngrok conectado! Acesso público: {self.ngrok_url}")
-                    elif old_url and not self.ngrok_url:
-                        print("⚠️  Ngrok desconectado")
-                        
-                except Exception as e:
-                    pass  # Ignorar erros silenciosamente
+                    self._set_ngrok_url(self._query_ngrok_api())
+                    delay = NGROK_CHECK_INTERVAL
+                except Exception:
+                    # API do Ngrok fora do ar: espaçar as tentativas (backoff exponencial)
+                    self._set_ngrok_url(None)
+                    delay = min(delay * 2, NGROK_MAX_BACKOFF)
+                
+                with self._ngrok_checked:
+                    self._ngrok_checks += 1
+                    self._ngrok_checked.notify_all()
+                
+                # Dormir até o próximo ciclo ou até alguém pedir uma verificação
+                self._ngrok_wakeup.wait(delay)
+                self._ngrok_wakeup.clear()
+                
+                # Evitar verificações em rajada quando muitos pedidos acordam o monitor
+                elapsed = time.monotonic() - started
+                if elapsed < NGROK_MIN_INTERVAL:
+                    time.sleep(NGROK_MIN_INTERVAL - elapsed)
                     
         # Criar thread daemon
         monitor_thread = threading.Thread(target=monitor_ngrok, daemon=True)
         monitor_thread.start()
     
+    def request_ngrok_check(self, timeout=None):
+        """Pedir ao monitor uma verificação imediata e aguardar o resultado"""
+        with self._ngrok_checked:
+            target = self._ngrok_checks + 1
+        self._ngrok_wakeup.set()
+        self.wait_ngrok_check(target, timeout)
+        return self.ngrok_url
+    
+    def wait_ngrok_check(self, count=1, timeout=None):
+        """Aguardar até o monitor concluir `count` verificações"""
+        with self._ngrok_checked:
+            return self._ngrok_checked.wait_for(lambda: self._ngrok_checks >= count, timeout)
+    
     def get_base_url(self, request_obj=None):
-        """Obter URL base correto (Ngrok ou local)"""
-        # Tentar detectar novamente se não tiver detectado antes
-        if not self.ngrok_url:
-            self.detect_ngrok_url()
-            
-        if self.ngrok_url:
-            return self.ngrok_url
+        """Obter URL base correto (Ngrok ou local) sem bloquear a requisição"""
+        ngrok_url = self.ngrok_url
+        if ngrok_url:
+            return ngrok_url
         elif request_obj:
             # Verificar se a requisição veio através do Ngrok
             host = request_obj.headers.get('Host', '')
             if 'ngrok.io' in host or 'ngrok-free.app' in host or 'ngrok.app' in host:
-                scheme = 'https' if request_obj.is_secure else 'https'  # Ngrok sempre usa HTTPS
-                detected_url = f"{scheme}://{host}"
-                # Salvar para uso futuro
-                if not self.ngrok_url:
-                    self.ngrok_url = detected_url
-                    print(f"🌍 Ngrok detectado via requisição: {self.ngrok_url}")
-                return detected_url
+                # Ngrok sempre usa HTTPS; pedir ao monitor que confirme o túnel
+                self._ngrok_wakeup.set()
+                return f"https://{host}"
         
         # Fallback para localhost
         return f"http://localhost:{self.port}"
@@ -126,11 +3802,23 @@ class P2PFileServer:
         def index():
             """Página principal com interface web"""
             base_url = self.get_base_url(request)
-            return render_template_string(HTML_TEMPLATE, 
-                                        files=self.shared_files,
-                                        server_id=self.server_id,
-                                        base_url=base_url,
-                                        ngrok_active=self.ngrok_url is not None)
+            return render_template('index.html',
+                                   file_count=len(self.shared_files),
+                                   server_id=self.server_id,
+                                   base_url=base_url,
+                                   local_url=f"http://localhost:{self.port}",
+                                   ngrok_active=self.ngrok_url is not None,
+                                   asset_versions=self.asset_versions)
+        
+        @self.app.route('/assets/<name>')
+        def get_asset(name):
+            """CSS e JavaScript da página principal, com cache de longa duração"""
+            if name not in self.assets:
+                return jsonify({'error': 'Arquivo não encontrado'}), 404
+            data, mimetype, version = self.assets[name]
+            response = Response(data, mimetype=mimetype)
+            response.set_etag(version)
+            return self.cache_forever(response).make_conditional(request)
         
         @self.app.route('/upload', methods=['POST'])
         def upload_file():
@@ -144,39 +3832,167 @@ class P2PFileServer:
             
             if file:
                 filename = secure_filename(file.filename)
-                filepath = os.path.join(self.upload_folder, filename)
-                file.save(filepath)
                 
-                # Calcular hash e metadados do arquivo
-                file_hash = self.calculate_file_hash(filepath)
-                file_size = os.path.getsize(filepath)
+                # O corpo já foi gravado e "hasheado" em uma única passada (ver UploadRequest);
+                # se o conteúdo já existe, o temporário é descartado e só o nome é registrado
+                file_hash = file.stream.hexdigest()
+                filepath = file.stream.commit(self.objects)
+                self.hasher.record(file.stream.size, file.stream.hash_seconds)
                 
                 # Adicionar arquivo à lista de compartilhados
-                self.shared_files[file_hash] = {
-                    'filename': filename,
-                    'filepath': filepath,
-                    'size': file_size,
-                    'hash': file_hash,
-                    'upload_time': time.time(),
-                    'download_count': 0
-                }
-                
-                base_url = self.get_base_url(request)
-                share_link = f"{base_url}/download/{file_hash}"
-                
-                return jsonify({
-                    'message': 'Arquivo enviado com sucesso',
-                    'file_hash': file_hash,
-                    'filename': filename,
-                    'share_link': share_link,
-                    'ngrok_url': self.ngrok_url
-                })
+                self.register_file(filepath, filename, file_hash, file.stream.pieces)
+                return self.upload_result(file_hash, filename)
+        
+        @self.app.route('/uploads', methods=['POST'])
+        def create_upload():
+            """Abrir uma sessão de upload retomável"""
+            data = request.get_json(silent=True) or {}
+            filename = secure_filename(data.get('filename') or '')
+            size = data.get('size')
+            sha256 = data.get('sha256')
+            if isinstance(sha256, str):
+                sha256 = sha256.lower()
+            
+            if not filename:
+                return jsonify({'error': 'Nome de arquivo inválido'}), 400
+            if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+                return jsonify({'error': 'Tamanho de arquivo inválido'}), 400
+            # Conferido aqui para o cliente não descobrir o erro só depois de enviar tudo
+            if sha256 not in (None, '') and not is_sha256(sha256):
+                return jsonify({'error': 'Hash SHA-256 inválido'}), 400
+            if size > UPLOAD_MAX_SIZE:
+                return jsonify({'error': f'Arquivo maior que o limite de {UPLOAD_MAX_SIZE // 1024 ** 3} GB'}), 413
+            # O arquivo parcial é esparso: o espaço só é ocupado quando os dados chegam
+            available = shutil.disk_usage(self.upload_folder).free - self.upload_sessions.pending_bytes()
+            if size > available:
+                return jsonify({'error': 'Espaço insuficiente no servidor para este arquivo'}), 413
+            if len(self.upload_sessions) >= UPLOAD_MAX_SESSIONS:
+                response = jsonify({'error': 'Muitos uploads em andamento, tente novamente mais tarde'})
+                response.headers['Retry-After'] = '60'
+                return response, 429
+            
+            try:
+                session = self.upload_sessions.create(filename, size, sha256 or None)
+            except OSError as e:
+                return jsonify({'error': f'Erro ao reservar o arquivo: {e}'}), 500
+            return jsonify(self.upload_session_status(session)), 201
+        
+        @self.app.route('/uploads/check', methods=['POST'])
+        def check_upload():
+            """Verificar o hash antes do envio: se o conteúdo já existe, nada é transferido
+            
+            O cliente calcula o SHA-256 localmente e envia {filename, size,
+            sha256}. Se o índice já tem esse conteúdo com o mesmo tamanho, o
+            nome novo é registrado na hora e o link é devolvido com
+            `exists: true`; senão a resposta é `exists: false` e o cliente
+            segue com o upload normal.
+            """
+            data = request.get_json(silent=True) or {}
+            filename = secure_filename(data.get('filename') or '')
+            size = data.get('size')
+            sha256 = str(data.get('sha256') or '').lower()
+            
+            if not filename:
+                return jsonify({'error': 'Nome de arquivo inválido'}), 400
+            if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+                return jsonify({'error': 'Tamanho de arquivo inválido'}), 400
+            if not is_sha256(sha256):
+                return jsonify({'error': 'Hash SHA-256 inválido'}), 400
+            
+            file_info = self.shared_files.get(sha256)
+            if file_info is None or file_info['size'] != size:
+                return jsonify({'exists': False})
+            
+            self.shared_files.add_name(sha256, filename)
+            return self.upload_result(sha256, filename, exists=True,
+                                      message='Arquivo já existia no servidor; nenhum dado enviado')
+        
+        @self.app.route('/uploads/<upload_id>', methods=['GET'])
+        def get_upload(upload_id):
+            """Consultar os intervalos já recebidos de um upload"""
+            session = self.upload_sessions.get(upload_id)
+            if session is None:
+                return jsonify({'error': 'Upload não encontrado'}), 404
+            return jsonify(self.upload_session_status(session))
+        
+        @self.app.route('/uploads/<upload_id>', methods=['PUT'])
+        def put_upload_chunk(upload_id):
+            """Receber um pedaço do arquivo a partir de ?offset=N (em qualquer ordem)"""
+            offset = request.args.get('offset', type=int)
+            if offset is None or offset < 0:
+                return jsonify({'error': 'Parâmetro offset inválido'}), 400
+            
+            try:
+                session = self.upload_sessions.write(upload_id, offset, request.stream)
+            except (KeyError, FileNotFoundError):
+                return jsonify({'error': 'Upload não encontrado'}), 404
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if session is None:
+                return jsonify({'error': 'Nenhum dado recebido'}), 400
+            return jsonify(self.upload_session_status(session))
+        
+        @self.app.route('/uploads/<upload_id>', methods=['DELETE'])
+        def cancel_upload(upload_id):
+            """Cancelar um upload retomável"""
+            if self.upload_sessions.get(upload_id) is None:
+                return jsonify({'error': 'Upload não encontrado'}), 404
+            self.upload_sessions.remove(upload_id)
+            return jsonify({'message': 'Upload cancelado'})
+        
+        @self.app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+        def finalize_upload(upload_id):
+            """Verificar o arquivo completo e publicá-lo na pasta compartilhada"""
+            session = self.upload_sessions.get(upload_id)
+            if session is None:
+                return jsonify({'error': 'Upload não encontrado'}), 404
+            if not UploadSessions.is_complete(session):
+                return jsonify(dict(self.upload_session_status(session),
+                                    error='Upload incompleto')), 409
+            
+            part_path = self.upload_sessions.part_path(upload_id)
+            try:
+                digest = self.hasher.digest_file(part_path)
+            except FileNotFoundError:
+                return jsonify({'error': 'Upload não encontrado'}), 404
+            if session['sha256'] and digest.sha256 != session['sha256']:
+                self.upload_sessions.remove(upload_id)
+                return jsonify({'error': 'Hash do arquivo recebido não confere',
+                                'expected': session['sha256'],
+                                'received': digest.sha256}), 422
+            
+            filename = session['filename']
+            try:
+                filepath = self.objects.put(part_path, digest.sha256)
+            except FileNotFoundError:
+                # Outra chamada de finalize já publicou o arquivo
+                return jsonify({'error': 'Upload não encontrado'}), 404
+            self.upload_sessions.remove(upload_id)
+            
+            self.register_file(filepath, filename, digest.sha256, digest.pieces)
+            return self.upload_result(digest.sha256, filename)
+        
+        def redirect_to_peer(file_hash, route):
+            """Redirecionar para um peer que tenha o arquivo, ou None
+            
+            O redirecionamento leva `hops=1`, e quem o recebe não redireciona
+            de novo: catálogos desatualizados não criam ciclos.
+            """
+            if request.args.get('hops'):
+                return None
+            holders = self.peers.locate(file_hash)
+            if not holders:
+                return None
+            args = request.args.to_dict()
+            args['hops'] = 1
+            query = '&'.join(f'{quote(str(key))}={quote(str(value))}' for key, value in args.items())
+            return redirect(f'{random.choice(holders)}/{route}/{file_hash}?{query}')
         
         @self.app.route('/view/<file_hash>')
         def view_file(file_hash):
             """Página de visualização do arquivo"""
             if file_hash not in self.shared_files:
-                return render_template_string(FILE_NOT_FOUND_TEMPLATE), 404
+                return redirect_to_peer(file_hash, 'view') or (render_template('not_found.html'), 404)
             
             file_info = self.shared_files[file_hash]
             base_url = self.get_base_url(request)
@@ -196,13 +4012,120 @@ class P2PFileServer:
             elif filename.endswith(('.txt', '.md', '.py', '.js', '.html', '.css', '.json', '.xml')):
                 file_type = 'text'
             
-            return render_template_string(FILE_VIEW_TEMPLATE, 
-                                        file_info=file_info,
-                                        file_hash=file_hash,
-                                        file_type=file_type,
-                                        base_url=base_url,
-                                        ngrok_active=self.ngrok_url is not None)
+            return render_template('view.html',
+                                   file_info=file_info,
+                                   file_hash=file_hash,
+                                   file_type=file_type,
+                                   thumbnail=self.thumbnails.kind(file_info['filename']) is not None,
+                                   download_count=self.download_counters.count(file_info),
+                                   downloads_per_minute=self.download_counters.rate(file_hash),
+                                   base_url=base_url,
+                                   ngrok_active=self.ngrok_url is not None)
 
+        @self.app.route('/catalog/changes')
+        def catalog_changes():
+            """Alterações do catálogo desde `since`, para a sincronização entre peers
+            
+            Um peer que envia server_id e port é registrado de volta, para
+            que basta configurar a ligação em um dos lados.
+            """
+            since = max(0, request.args.get('since', 0, type=int))
+            limit = max(1, min(request.args.get('limit', CATALOG_PAGE_LIMIT, type=int), CATALOG_PAGE_LIMIT))
+            reset = request.args.get('catalog_id') != self.shared_files.catalog_id
+            if reset:
+                since = 0
+            changes, more = self.shared_files.changes_since(since, limit)
+            
+            remote_id = request.args.get('server_id')
+            remote_port = request.args.get('port', type=int)
+            # Pelo Ngrok (ou de outro processo local) o endereço seria desta
+            # máquina: registrá-lo faria o servidor consultar portas locais
+            direct = ('X-Forwarded-For' not in request.headers
+                      and request.remote_addr not in ('127.0.0.1', '::1'))
+            if remote_id and remote_id != self.server_id and remote_port and direct:
+                if self.peers.add(peer_url(request.remote_addr, remote_port), source='inbound',
+                                  server_id=remote_id):
+                    self._peer_wakeup.set()
+            
+            return jsonify({
+                'server_id': self.server_id,
+                'catalog_id': self.shared_files.catalog_id,
+                'reset': reset,
+                'seq': changes[-1]['seq'] if changes else since,
+                'more': more,
+                'changes': changes
+            })
+        
+        @self.app.route('/peers', methods=['GET', 'POST'])
+        def list_peers():
+            """Listar os peers conhecidos ou adicionar um (POST {"url": ...}, só local)"""
+            if request.method == 'POST':
+                # Peers recebem consultas periódicas e redirecionamentos de visitantes
+                if not self.is_local_request():
+                    return jsonify({'error': 'Disponível apenas a partir do próprio servidor'}), 403
+                data = request.get_json(silent=True) or {}
+                if not isinstance(data.get('url'), str) or not data['url'].strip():
+                    return jsonify({'error': 'Informe a URL do peer'}), 400
+                self.peers.add(data['url'])
+                self._peer_wakeup.set()
+                return jsonify({'success': True, 'url': self.peers.normalize(data['url'])}), 201
+            return jsonify({'server_id': self.server_id, 'peers': self.peers.snapshot()})
+        
+        @self.app.route('/swarm/fetch', methods=['POST'])
+        def swarm_fetch():
+            """Baixar para este servidor um arquivo que está em outros peers
+            
+            Corpo JSON: {"hash": ..., "peers": [...]} (peers opcional; sem
+            ele são usados os peers que têm o arquivo segundo os catálogos).
+            Só pedidos desta máquina escolhem os peers: de fora, o servidor
+            faria requisições a endereços escolhidos por quem chama.
+            """
+            data = request.get_json(silent=True) or {}
+            file_hash = str(data.get('hash') or '').lower()
+            if not is_sha256(file_hash):
+                return jsonify({'error': 'Hash inválido'}), 400
+            if file_hash in self.shared_files:
+                return jsonify({'hash': file_hash, 'state': 'done', 'local': True})
+            
+            current = self.swarm_jobs.get(file_hash)
+            if current is not None and current.state in ('pending', 'running', 'verifying'):
+                return jsonify(current.progress()), 202
+            
+            if data.get('peers') and not self.is_local_request():
+                return jsonify({'error': 'Apenas pedidos locais podem indicar peers'}), 403
+            sources = data.get('peers') or self.peers.locate(file_hash)
+            if not isinstance(sources, list):
+                return jsonify({'error': 'Lista de peers inválida'}), 400
+            sources = [str(url) for url in sources]
+            # Quem pede a réplica informa a própria porta e entra como fonte; pelo
+            # Ngrok o endereço seria o do túnel (esta máquina), então é ignorada
+            from_port = data.get('from_port')
+            if (isinstance(from_port, int) and not isinstance(from_port, bool)
+                    and 'X-Forwarded-For' not in request.headers):
+                sources.insert(0, peer_url(request.remote_addr, from_port))
+            if not sources:
+                return jsonify({'error': 'Nenhum peer conhecido tem o arquivo'}), 404
+            download = self.start_swarm_fetch(file_hash, sources,
+                                              background=data.get('priority') == 'background')
+            return jsonify(download.progress()), 202
+        
+        @self.app.route('/swarm/jobs/<file_hash>')
+        def swarm_job(file_hash):
+            """Progresso de um download em enxame"""
+            download = self.swarm_jobs.get(file_hash)
+            if download is None:
+                return jsonify({'error': 'Download não encontrado'}), 404
+            return jsonify(download.progress())
+        
+        @self.app.route('/locate/<file_hash>')
+        def locate_file(file_hash):
+            """Onde o arquivo está disponível: neste servidor e/ou em peers"""
+            return jsonify({
+                'hash': file_hash,
+                'local': file_hash in self.shared_files,
+                'peers': self.peers.locate(file_hash)
+            })
+        
         @self.app.route('/download/<file_hash>')
         def download_file(file_hash):
             """Endpoint que redireciona para visualização ou faz download direto"""
@@ -214,47 +4137,286 @@ class P2PFileServer:
             if is_browser and not request.args.get('direct'):
                 return redirect(f'/view/{file_hash}')
             
-            # Caso contrário, fazer download direto
+            # Caso contrário, fazer download direto (ou de um peer que tenha o arquivo)
+            if file_hash not in self.shared_files:
+                return redirect_to_peer(file_hash, 'download') or (jsonify({'error': 'Arquivo não encontrado'}), 404)
+            
+            file_info = self.shared_files[file_hash]
+            response = self.send_content(file_info, as_attachment=True)
+            if response.status_code != 304:  # Revalidação de cópia em cache não conta
+                self.download_counters.increment(file_hash)
+            return response
+        
+        @self.app.route('/preview/<file_hash>')
+        def preview_file(file_hash):
+            """Endpoint para preview direto do arquivo (para imagens, vídeos, etc.)"""
+            if file_hash not in self.shared_files:
+                return redirect_to_peer(file_hash, 'preview') or (jsonify({'error': 'Arquivo não encontrado'}), 404)
+            
+            file_info = self.shared_files[file_hash]
+            return self.send_content(file_info, as_attachment=False, priority='interactive')
+        
+        @self.app.route('/thumb/<file_hash>')
+        def get_thumbnail(file_hash):
+            """Miniatura JPEG de uma imagem ou quadro de capa de um vídeo (?size=small|large)"""
+            size = request.args.get('size', 'small')
+            if size not in THUMBNAIL_SIZES:
+                return jsonify({'error': f"Tamanho inválido: use {', '.join(THUMBNAIL_SIZES)}"}), 400
+            if file_hash not in self.shared_files:
+                return redirect_to_peer(file_hash, 'thumb') or (jsonify({'error': 'Arquivo não encontrado'}), 404)
+            
+            try:
+                data = self.hot_read((file_hash, 'thumb', size),
+                                     lambda: self.thumbnails.get(self.shared_files[file_hash], size))
+            except FutureTimeoutError:
+                response = jsonify({'error': 'Miniatura em preparação, tente novamente'})
+                response.headers['Retry-After'] = '5'
+                return response, 503
+            if data is None:
+                return jsonify({'error': 'Miniatura indisponível para este arquivo'}), 404
+            
+            # O conteúdo de um hash nunca muda: a miniatura pode ficar no cache do navegador
+            response = Response(data, mimetype='image/jpeg')
+            response.set_etag(f'{file_hash}-{size}')
+            return self.cache_forever(response).make_conditional(request)
+        
+        @self.app.route('/text/<file_hash>')
+        def preview_text(file_hash):
+            """Trecho de texto do arquivo, sem enviar o arquivo inteiro
+            
+            Parâmetros: offset (byte inicial, o `next_offset` da janela
+            anterior), length (bytes lidos, até 1 MiB) e lines (máximo de
+            linhas). A janela termina em uma quebra de linha, exceto no fim.
+            """
             if file_hash not in self.shared_files:
+                return redirect_to_peer(file_hash, 'text') or (jsonify({'error': 'Arquivo não encontrado'}), 404)
+            
+            offset = request.args.get('offset', 0, type=int)
+            length = request.args.get('length', TEXT_PREVIEW_WINDOW, type=int)
+            lines = request.args.get('lines', type=int)
+            if offset < 0:
+                return jsonify({'error': 'Parâmetro offset inválido'}), 400
+            if lines is not None and lines < 1:
+                return jsonify({'error': 'Parâmetro lines inválido'}), 400
+            length = max(1024, min(length, TEXT_PREVIEW_MAX_WINDOW))
+            
+            file_info = self.shared_files[file_hash]
+            try:
+                return jsonify(self.text_preview(file_info, offset, length, lines))
+            except OSError as e:
+                return jsonify({'error': f'Erro ao ler arquivo: {e}'}), 500
+        
+        @self.app.route('/manifest/<file_hash>')
+        def get_file_manifest(file_hash):
+            """Manifesto com os hashes dos pedaços e a raiz de Merkle do arquivo"""
+            try:
+                manifest = self.get_manifest(file_hash)
+            except FileNotFoundError:
                 return jsonify({'error': 'Arquivo não encontrado'}), 404
+            except OSError as e:
+                return jsonify({'error': f'Erro ao ler arquivo: {e}'}), 500
+            if manifest is None:
+                return jsonify({'error': 'Arquivo não encontrado'}), 404
+            return jsonify(manifest)
+        
+        @self.app.route('/piece/<file_hash>/<int:index>')
+        def get_file_piece(file_hash, index):
+            """Conteúdo de um pedaço do arquivo, para verificação e nova tentativa individual"""
+            file_info = self.shared_files.get(file_hash)
+            if file_info is None:
+                return jsonify({'error': 'Arquivo não encontrado'}), 404
+            # Entradas indexadas antes do endereçamento por pedaços usam o tamanho
+            # padrão; os hashes dos pedaços só são calculados quando /manifest é pedido
+            piece_size = file_info['piece_size'] or PIECE_SIZE
+            offset = index * piece_size
+            if offset >= file_info['size']:
+                return jsonify({'error': 'Pedaço inexistente'}), 404
             
-            file_info = self.shared_files[file_hash]
-            file_info['download_count'] += 1
+            length = min(piece_size, file_info['size'] - offset)
+            etag = f'{file_hash}-piece-{index}'
+            if request.if_none_match.contains(etag):
+                return self.cache_forever(Response(status=304, headers={'ETag': f'"{etag}"'}))
             
-            return send_file(file_info['filepath'], 
-                           as_attachment=True, 
-                           download_name=file_info['filename'])
-        
-        @self.app.route('/preview/<file_hash>')
-        def preview_file(file_hash):
-            """Endpoint para preview direto do arquivo (para imagens, vídeos, etc.)"""
-            if file_hash not in self.shared_files:
+            try:
+                f = self.open_content(file_info)
+            except FileNotFoundError:
                 return jsonify({'error': 'Arquivo não encontrado'}), 404
+            except OSError as e:
+                return jsonify({'error': f'Erro ao ler arquivo: {e}'}), 500
             
-            file_info = self.shared_files[file_hash]
-            return send_file(file_info['filepath'], 
-                           as_attachment=False)
+            background = request.headers.get('X-P2P-Priority') == 'background'
+            if background or self.bandwidth['download'].active:
+                # Em blocos: a replicação respeita a banda reservada a ela e
+                # tudo passa pelo escalonador de banda, se houver limites
+                def blocks():
+                    for block in iter_file_range(f, offset, length, block_size=REPLICATION_BLOCK_SIZE):
+                        if background:
+                            self.replication_bucket.consume(len(block))
+                        yield block
+                body = self.shaped(blocks(), 'background' if background else 'bulk')
+                response = Response(body, mimetype='application/octet-stream')
+                response.content_length = length
+            else:
+                try:
+                    with f:
+                        f.seek(offset)
+                        data = f.read(length)
+                except OSError as e:
+                    return jsonify({'error': f'Erro ao ler arquivo: {e}'}), 500
+                response = Response(data, mimetype='application/octet-stream')
+            
+            response.set_etag(etag)
+            return self.cache_forever(response)
         
         @self.app.route('/files')
         def list_files():
-            """Listar todos os arquivos disponíveis"""
-            files_list = []
-            base_url = self.get_base_url(request)
-            for file_hash, info in self.shared_files.items():
-                files_list.append({
-                    'hash': file_hash,
-                    'filename': info['filename'],
-                    'size': info['size'],
-                    'download_count': info['download_count'],
-                    'share_link': f"{base_url}/download/{file_hash}"
-                })
-            return jsonify(files_list)
+            """Listar os arquivos disponíveis
+            
+            Parâmetros: sort (name, size, upload_time, download_count),
+            order (asc/desc), prefix ou q (trecho do nome), limit e cursor
+            para paginação, format=ndjson para receber um arquivo por linha.
+            Sem limit nem format, retorna a lista completa em um array.
+            """
+            link_prefix = f"{self.get_base_url(request)}/download/"
+            
+            def describe(info):
+                return dict(self.file_summary(info), share_link=link_prefix + info['hash'])
+            
+            sort = request.args.get('sort', 'upload_time')
+            if sort not in FileIndex.SORT_COLUMNS:
+                return jsonify({'error': f"Ordenação inválida: use {', '.join(FileIndex.SORT_COLUMNS)}"}), 400
+            order = request.args.get('order', 'asc' if sort == 'name' else 'desc')
+            if order not in ('asc', 'desc'):
+                return jsonify({'error': 'Ordem inválida: use asc ou desc'}), 400
+            query = {
+                'sort': sort,
+                'descending': order == 'desc',
+                'prefix': request.args.get('prefix') or None,
+                'search': request.args.get('q') or None,
+            }
+            
+            if request.args.get('format') == 'ndjson':
+                def generate():
+                    for info in self.shared_files.iter_files(**query):
+                        yield json.dumps(describe(info)) + '\n'
+                return Response(generate(), mimetype='application/x-ndjson')
+            
+            limit = request.args.get('limit', type=int)
+            if limit is None:
+                return self.json_conditional([describe(info) for info in self.shared_files.values()])
+            
+            limit = max(1, min(limit, FILES_PAGE_LIMIT))
+            after = None
+            if request.args.get('cursor'):
+                try:
+                    after = decode_cursor(request.args['cursor'])
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+            page = self.shared_files.page(limit + 1, after=after, **query)
+            next_cursor = encode_cursor(page[limit - 1], sort) if len(page) > limit else None
+            return self.json_conditional({
+                'files': [describe(info) for info in page[:limit]],
+                'total': len(self.shared_files),
+                'next_cursor': next_cursor
+            })
+        
+        @self.app.route('/events', methods=['GET'])
+        def live_events():
+            """Atualizações ao vivo da página principal (Server-Sent Events)
+            
+            Eventos: status (túnel do Ngrok e total de arquivos, ao conectar e
+            quando o túnel muda), file (arquivo adicionado ou removido),
+            downloads (contadores e downloads/min) e reset (alterações perdidas:
+            a página deve recarregar a lista). Ao reconectar, o navegador envia
+            Last-Event-ID e recebe as alterações do catálogo feitas enquanto
+            esteve desconectado.
+            """
+            if request.method != 'GET':
+                # O Flask aceita HEAD junto com GET, mas HEAD não lê o corpo
+                # e a vaga ficaria ocupada sem ninguém receber eventos
+                return jsonify({'error': 'Use GET'}), 405, {'Allow': 'GET'}
+            events = self.events.subscribe()
+            if events is None:
+                return jsonify({'error': 'Limite de conexões ao vivo atingido'}), 503, {'Retry-After': '30'}
+            catalog_id, _, last_seq = request.headers.get('Last-Event-ID', '').partition(':')
+            
+            def generate():
+                try:
+                    yield f'retry: {EVENTS_RETRY}\n\n'
+                    # O ID do estado inicial marca de onde continuar se a conexão cair
+                    sent_seq = self.shared_files.last_seq()
+                    yield EventStream.format('status', self.live_status(),
+                                             f'{self.shared_files.catalog_id}:{sent_seq}')
+                    if catalog_id:
+                        if catalog_id == self.shared_files.catalog_id and last_seq.isdigit():
+                            changes, more = self.shared_files.changes_since(int(last_seq))
+                        else:
+                            changes, more = [], True
+                        if more:
+                            yield EventStream.format('reset', {})
+                        else:
+                            for change in changes:
+                                yield EventStream.format('file', *self.catalog_event(change))
+                                sent_seq = max(sent_seq, change['seq'])
+                    
+                    while True:
+                        try:
+                            message = events.get(timeout=EVENTS_KEEPALIVE)
+                        except queue.Empty:
+                            yield ': keep-alive\n\n'
+                            continue
+                        if message is None:
+                            return
+                        seq, text = message
+                        # Alterações já enviadas no reenvio acima
+                        if seq is not None and seq <= sent_seq:
+                            continue
+                        yield text
+                finally:
+                    self.events.unsubscribe(events)
+            
+            response = Response(generate(), mimetype='text/event-stream',
+                                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+            # Libera a vaga mesmo se a conexão cair antes de o corpo começar a
+            # ser lido (o finally do gerador só roda se ele chegou a iniciar)
+            response.call_on_close(lambda: self.events.unsubscribe(events))
+            return response
+        
+        @self.app.route('/events/poll')
+        def poll_events():
+            """Os mesmos dados de /events em uma consulta rápida, sem prender uma thread
+            
+            Usado pelas páginas recusadas pelo limite de conexões ao vivo.
+            `since` é o último ID recebido ('catalogo:seq'); a resposta traz o
+            estado, as alterações do catálogo desde então (ou reset), os
+            contadores dos arquivos com downloads/min e o próximo ID.
+            """
+            catalog_id, _, last_seq = request.args.get('since', '').partition(':')
+            changes, more = [], False
+            if catalog_id:
+                if catalog_id == self.shared_files.catalog_id and last_seq.isdigit():
+                    changes, more = self.shared_files.changes_since(int(last_seq))
+                else:
+                    more = True
+            
+            if more or not catalog_id:
+                seq = self.shared_files.last_seq()  # A página parte da lista que tem agora
+            else:
+                seq = changes[-1]['seq'] if changes else int(last_seq)
+            return jsonify({
+                'id': f'{self.shared_files.catalog_id}:{seq}',
+                'status': self.live_status(),
+                'reset': more,
+                'changes': [] if more else [self.catalog_event(change)[0] for change in changes],
+                'downloads': self._live_downloads,
+                'poll_interval': EVENTS_POLL_INTERVAL,
+            })
         
         @self.app.route('/refresh_ngrok')
         def refresh_ngrok():
             """Atualizar detecção do Ngrok"""
             old_url = self.ngrok_url
-            self.detect_ngrok_url()
+            self.request_ngrok_check(timeout=NGROK_REFRESH_TIMEOUT)
             return jsonify({
                 'old_url': old_url,
                 'new_url': self.ngrok_url,
@@ -270,331 +4432,277 @@ class P2PFileServer:
                 'port': self.port,
                 'ngrok_url': self.ngrok_url,
                 'ngrok_active': self.ngrok_url is not None,
-                'file_count': len(self.shared_files)
+                'file_count': len(self.shared_files),
+                'index_ready': self.scan_status['index_ready'],
+                'index_scan': self.scan_status,
+                'downloads': self.download_counters.rates(),
+                'peers_online': sum(1 for peer in self.peers.snapshot() if peer['online']),
+                'replication': self.replicator.status,
+                'compression': self.compressor.status,
+                'thumbnails': self.thumbnails.status(),
+                'bandwidth': {direction: scheduler.status() for direction, scheduler in self.bandwidth.items()},
+                'memory_cache': self.memory_cache_stats()
             })
         
-        @self.app.route('/debug_ngrok')
-        def debug_ngrok():
-            """Debug da detecção do Ngrok"""
-            try:
-                response = requests.get('http://localhost:4040/api/tunnels', timeout=3)
-                if response.status_code == 200:
-                    data = response.json()
-                    return jsonify({
-                        'ngrok_api_working': True,
-                        'tunnels_data': data,
-                        'current_ngrok_url': self.ngrok_url,
-                        'port_looking_for': self.port
-                    })
-                else:
-                    return jsonify({
-                        'ngrok_api_working': False,
-                        'status_code': response.status_code,
-                        'current_ngrok_url': self.ngrok_url
-                    })
-            except Exception as e:
-                return jsonify({
-                    'ngrok_api_working': False,
-                    'error': str(e),
-                    'current_ngrok_url': self.ngrok_url
-                })
+        @self.app.before_request
+        def shape_upload():
+            # Uploads: o corpo é lido no ritmo do escalonador de banda
+            scheduler = self.bandwidth['upload']
+            if TRANSFER_ENDPOINTS.get(request.endpoint) == 'upload' and scheduler.active:
+                transfer = scheduler.open(self.client_address(), 'bulk')
+                request.environ['p2pshare.upload_transfer'] = transfer
+                request.environ['wsgi.input'] = ShapedStream(request.environ['wsgi.input'], transfer)
         
-        @self.app.route('/get_link/<file_hash>')
-        def get_file_link(file_hash):
-            """Obter link correto para um arquivo específico"""
-            if file_hash not in self.shared_files:
-                return jsonify({'error': 'Arquivo não encontrado'}), 404
+        @self.app.teardown_request
+        def close_upload_transfer(error=None):
+            transfer = request.environ.get('p2pshare.upload_transfer')
+            if transfer is not None:
+                transfer.close()
+        
+        @self.app.route('/admin/bandwidth', methods=['GET', 'PUT'])
+        def admin_bandwidth():
+            """Consultar ou alterar os limites de banda (só a partir desta máquina)
             
-            base_url = self.get_base_url(request)
-            file_info = self.shared_files[file_hash]
+            PUT com {"download": {...}, "upload": {...}}, cada um com
+            rate_mbps (limite global), per_ip_mbps e weights ({classe: peso});
+            0 desliga o limite e campos omitidos ficam como estão.
+            """
+            if not self.is_local_request():
+                return jsonify({'error': 'Disponível apenas a partir do próprio servidor'}), 403
             
-            return jsonify({
-                'file_hash': file_hash,
-                'filename': file_info['filename'],
-                'download_link': f"{base_url}/download/{file_hash}",
-                'base_url': base_url,
-                'ngrok_active': self.ngrok_url is not None,
-                'link_type': 'mundial' if self.ngrok_url else 'local'
-            })
-    
-    def start_server(self):
-        """Iniciar servidor"""
-        print(f"Iniciando servidor P2P na porta {self.port}")
-        print(f"ID do servidor: {self.server_id}")
-        print(f"Pasta de arquivos: {self.upload_folder}")
-        print(f"Acesse: http://localhost:{self.port}")
+            if request.method == 'PUT':
+                config = request.get_json(silent=True)
+                if not isinstance(config, dict) or not set(config) <= set(self.bandwidth):
+                    return jsonify({'error': 'Envie {"download": {...}, "upload": {...}}'}), 400
+                changes = {}
+                for direction, settings in config.items():
+                    if not isinstance(settings, dict):
+                        return jsonify({'error': f'Configuração inválida para {direction}'}), 400
+                    change = {}
+                    for field, key in (('rate_mbps', 'rate'), ('per_ip_mbps', 'per_ip_rate')):
+                        if field in settings:
+                            value = settings[field]
+                            if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+                                return jsonify({'error': f'{field} deve ser um número >= 0'}), 400
+                            change[key] = int(value * 1024 * 1024)
+                    weights = settings.get('weights')
+                    if weights is not None:
+                        if (not isinstance(weights, dict) or not set(weights) <= set(BANDWIDTH_WEIGHTS) or
+                                not all(isinstance(w, (int, float)) and not isinstance(w, bool) and w > 0
+                                        for w in weights.values())):
+                            return jsonify({'error': f"weights: pesos > 0 para {', '.join(BANDWIDTH_WEIGHTS)}"}), 400
+                        change['weights'] = weights
+                    changes[direction] = change
+                for direction, change in changes.items():
+                    self.bandwidth[direction].configure(**change)
+            
+            return jsonify({direction: scheduler.status() for direction, scheduler in self.bandwidth.items()})
         
-        if self.ngrok_url:
-            print(f"🌍 Acesso público: {self.ngrok_url}")
-        else:
-            print("💡 Para acesso público, execute: criar_link_publico.bat")
+        @self.app.route('/metrics')
+        def get_metrics():
+            """Métricas do servidor no formato texto do Prometheus"""
+            return Response(self.metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
         
-        self.app.run(host='0.0.0.0', port=self.port, debug=False)
-
-# Template HTML para interface web
-HTML_TEMPLATE = '''
-<!DOCTYPE html>
-<html lang="pt-BR">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Servidor P2P - Compartilhamento de Arquivos</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-            padding: 20px;
-        }
-
-        .container {
-            max-width: 1200px;
-            margin: 0 auto;
-            background: rgba(255, 255, 255, 0.95);
-            border-radius: 15px;
-            box-shadow: 0 20px 40px rgba(0, 0, 0, 0.1);
-            overflow: hidden;
-        }
-
-        .header {
-            background: linear-gradient(45deg, #4CAF50, #2196F3);
-            color: white;
-            padding: 30px;
-            text-align: center;
-        }
-
-        .header h1 {
-            font-size: 2.5em;
-            margin-bottom: 10px;
-        }
-
-        .server-info {
-            display: flex;
-            justify-content: center;
-            gap: 30px;
-            margin-top: 20px;
-            flex-wrap: wrap;
-        }
-
-        .info-card {
-            background: rgba(255, 255, 255, 0.2);
-            padding: 15px 25px;
-            border-radius: 10px;
-            text-align: center;
-        }
-
-        .content {
-            padding: 40px;
-        }
-
-        .section {
-            margin-bottom: 40px;
-        }
-
-        .section h2 {
-            color: #333;
-            margin-bottom: 20px;
-            padding-bottom: 10px;
-            border-bottom: 3px solid #4CAF50;
-            display: inline-block;
-        }
-
-        .upload-area {
-            border: 3px dashed #4CAF50;
-            border-radius: 10px;
-            padding: 40px;
-            text-align: center;
-            background: #f8f9fa;
-            transition: all 0.3s ease;
-        }
-
-        .upload-area:hover {
-            background: #e8f5e8;
-            border-color: #2196F3;
-        }
-
-        .upload-area input[type="file"] {
-            display: none;
-        }
-
-        .upload-btn {
-            display: inline-block;
-            padding: 15px 30px;
-            background: #4CAF50;
-            color: white;
-            border-radius: 25px;
-            cursor: pointer;
-            font-size: 16px;
-            transition: all 0.3s ease;
-            text-decoration: none;
-        }
-
-        .upload-btn:hover {
-            background: #45a049;
-            transform: translateY(-2px);
-        }
-
-        .submit-btn {
-            background: #2196F3;
-            color: white;
-            border: none;
-            padding: 12px 25px;
-            border-radius: 25px;
-            cursor: pointer;
-            font-size: 16px;
-            margin-top: 20px;
-            transition: all 0.3s ease;
-        }
-
-        .submit-btn:hover {
-            background: #1976D2;
-            transform: translateY(-2px);
-        }
-
-        .files-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fill, minmax(300px, 1fr));
-            gap: 20px;
-        }
-
-        .file-card {
-            background: white;
-            border-radius: 10px;
-            padding: 20px;
-            box-shadow: 0 5px 15px rgba(0, 0, 0, 0.1);
-            transition: all 0.3s ease;
-        }
-
-        .file-card:hover {
-            transform: translateY(-5px);
-            box-shadow: 0 10px 25px rgba(0, 0, 0, 0.15);
-        }
-
-        .file-name {
-            font-weight: bold;
-            color: #333;
-            margin-bottom: 10px;
-            word-break: break-word;
-        }
-
-        .file-info {
-            color: #666;
-            font-size: 14px;
-            margin-bottom: 15px;
-        }
-
-        .download-link {
-            display: inline-block;
-            padding: 8px 15px;
-            background: #4CAF50;
-            color: white;
-            text-decoration: none;
-            border-radius: 15px;
-            transition: all 0.3s ease;
-            margin-right: 5px;
-            margin-bottom: 5px;
-            font-size: 13px;
-            min-width: 70px;
-            text-align: center;
-        }
-
-        .download-link:hover {
-            background: #45a049;
-            transform: scale(1.05);
-        }
-
-        .copy-btn {
-            padding: 8px 15px;
-            background: #FF9800;
-            color: white;
-            border: none;
-            border-radius: 15px;
-            cursor: pointer;
-            transition: all 0.3s ease;
-            margin-right: 5px;
-            margin-bottom: 5px;
-            font-size: 13px;
-            min-width: 70px;
-        }
-
-        .copy-btn:hover {
-            background: #F57C00;
-        }
-
-        .file-actions {
-            display: flex;
-            flex-wrap: wrap;
-            gap: 5px;
-            align-items: center;
-        }
-
-        .no-files {
-            text-align: center;
-            color: #666;
-            font-style: italic;
-            padding: 40px;
-        }
-
-        .status-message {
-            padding: 15px;
-            border-radius: 8px;
-            margin: 20px 0;
-            text-align: center;
-        }
-
-        .success {
-            background: #d4edda;
-            color: #155724;
-            border: 1px solid #c3e6cb;
-        }
-
-        .error {
-            background: #f8d7da;
-            color: #721c24;
-            border: 1px solid #f5c6cb;
-        }
-
-        @media (max-width: 768px) {
-            .header h1 {
-                font-size: 2em;
-            }
-
-            .server-info {
-                gap: 15px;
-            }
+        @self.app.route('/debug_ngrok')
+        def debug_ngrok():
+            """Debug da detecção do Ngrok"""
+            try:
+                response = requests.get('http://localhost:4040/api/tunnels', timeout=3)
+                if response.status_code == 200:
+                    data = response.json()
+                    return jsonify({
+                        'ngrok_api_working': True,
+                        'tunnels_data': data,
+                        'current_ngrok_url': self.ngrok_url,
+                        'port_looking_for': self.port
+                    })
+                else:
+                    return jsonify({
+                        'ngrok_api_working': False,
+                        'status_code': response.status_code,
+                        'current_ngrok_url': self.ngrok_url
+                    })
+            except Exception as e:
+                return jsonify({
+                    'ngrok_api_working': False,
+                    'error': str(e),
+                    'current_ngrok_url': self.ngrok_url
+                })
+        
+        @self.app.route('/get_link/<file_hash>')
+        def get_file_link(file_hash):
+            """Obter link correto para um arquivo específico"""
+            if file_hash not in self.shared_files:
+                return jsonify({'error': 'Arquivo não encontrado'}), 404
+            
+            base_url = self.get_base_url(request)
+            file_info = self.shared_files[file_hash]
+            
+            return self.json_conditional({
+                'file_hash': file_hash,
+                'filename': file_info['filename'],
+                'download_link': f"{base_url}/download/{file_hash}",
+                'base_url': base_url,
+                'ngrok_active': self.ngrok_url is not None,
+                'link_type': 'mundial' if self.ngrok_url else 'local'
+            })
+    
+    def start_server(self, mode='dev', threads=SERVER_THREADS,
+                     connection_limit=SERVER_CONNECTION_LIMIT,
+                     channel_timeout=SERVER_CHANNEL_TIMEOUT):
+        """Iniciar servidor
+        
+        mode='dev' usa o servidor de desenvolvimento do Flask; mode='waitress'
+        usa o servidor WSGI de produção com pool de threads. O modo gunicorn
+        é iniciado por run_gunicorn(), que cria o servidor dentro do worker.
+        """
+        self.print_banner()
+        
+        if mode == 'waitress':
+            self.run_waitress(threads, connection_limit, channel_timeout)
+        else:
+            try:
+                self.app.run(host='0.0.0.0', port=self.port, debug=False, threaded=True)
+            finally:
+                self.shutdown()
+    
+    def print_banner(self):
+        """Mostrar endereço, pasta e estado do Ngrok ao iniciar"""
+        print(f"Iniciando servidor P2P na porta {self.port}")
+        print(f"ID do servidor: {self.server_id}")
+        print(f"Pasta de arquivos: {self.upload_folder}")
+        print(f"Acesse: http://localhost:{self.port}")
+        
+        # Dar ao monitor a chance de concluir a primeira detecção do Ngrok
+        self.wait_ngrok_check(timeout=NGROK_REFRESH_TIMEOUT)
+        if self.ngrok_url:
+            print(f"🌍 Acesso público: {self.ngrok_url}")
+        else:
+            print("💡 Para acesso público, execute: criar_link_publico.bat")
+    
+    def run_waitress(self, threads, connection_limit, channel_timeout):
+        """Servir com waitress: keep-alive, limite de conexões e encerramento gracioso"""
+        try:
+            from waitress import create_server
+        except ImportError:
+            raise SystemExit("waitress não está instalado. Execute: pip install waitress")
+        
+        server = create_server(
+            self.app,
+            host='0.0.0.0',
+            port=self.port,
+            threads=threads,
+            connection_limit=connection_limit,
+            channel_timeout=channel_timeout,
+            backlog=SERVER_BACKLOG,
+            # poll() não tem o limite de 1024 descritores do select()
+            asyncore_use_poll=hasattr(select, 'poll'),
+            # Manter o X-Forwarded-For do Ngrok: client_address() só confia nele
+            # em conexões locais, e sem ele os usuários do túnel pareceriam locais
+            clear_untrusted_proxy_headers=False,
+            ident='P2PShare',
+        )
+        # Cada página aberta prende uma thread em /events; as demais consultam /events/poll
+        self.events.max_streams = max(1, threads // EVENTS_THREAD_DIVISOR)
+        # Fila de tarefas cheia é esperado sob carga; não poluir o console
+        logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+        print(f"⚙️  waitress: {threads} threads, até {connection_limit} conexões")
+        
+        # SIGTERM encerra como Ctrl+C: para de aceitar conexões e espera as
+        # requisições em andamento por alguns segundos. As conexões de
+        # /events não terminam sozinhas, então são fechadas antes.
+        def stop(signum, frame):
+            self.events.close()
+            sys.exit(0)
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        try:
+            server.run()
+        finally:
+            self.shutdown()
+    
+    def shutdown(self):
+        """Liberar recursos do servidor ao encerrar"""
+        self.events.close()
+        self.hasher.shutdown()
+        self.thumbnails.shutdown()
+        self.download_counters.flush()
+        self.upload_sessions.close()
+        self.shared_files.close()
+        print("👋 Servidor encerrado")
 
-            .content {
-                padding: 20px;
+def run_gunicorn(port, upload_folder, threads=SERVER_THREADS,
+                 connection_limit=SERVER_CONNECTION_LIMIT,
+                 channel_timeout=SERVER_CHANNEL_TIMEOUT,
+                 peers=(), discovery=True, replication=REPLICATION_FACTOR,
+                 replication_bandwidth=REPLICATION_BANDWIDTH, compression=STORAGE_COMPRESSION,
+                 hot_cache_bytes=HOT_CACHE_BYTES, hot_cache_max_object=HOT_CACHE_MAX_OBJECT):
+    """Servir com gunicorn (Linux/macOS): um único worker gthread, downloads via sendfile()
+    
+    O P2PFileServer é criado dentro do worker, depois do fork, para que as
+    threads de fundo e a conexão com o índice pertençam ao processo que atende.
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit("gunicorn não está instalado. Execute: pip install gunicorn")
+    
+    class P2PGunicornApplication(BaseApplication):
+        def load_config(self):
+            settings = {
+                'bind': f'0.0.0.0:{port}',
+                'workers': 1,  # Índice em memória: um único processo
+                'worker_class': 'gthread',
+                'threads': threads,
+                'worker_connections': connection_limit,
+                'keepalive': channel_timeout,
+                'backlog': SERVER_BACKLOG,
+                'graceful_timeout': 30,
+                'timeout': 0,  # Transferências longas não devem derrubar o worker
+                'sendfile': True,
+                'worker_exit': lambda arbiter, worker: self.server.shutdown(),
             }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+        
+        def load(self):
+            self.server = P2PFileServer(port=port, upload_folder=upload_folder,
+                                        peers=peers, discovery=discovery,
+                                        replication=replication,
+                                        replication_bandwidth=replication_bandwidth,
+                                        compression=compression,
+                                        hot_cache_bytes=hot_cache_bytes,
+                                        hot_cache_max_object=hot_cache_max_object)
+            self.server.events.max_streams = max(1, threads // EVENTS_THREAD_DIVISOR)
+            self.server.print_banner()
+            print(f"⚙️  gunicorn: {threads} threads, até {connection_limit} conexões, sendfile ativo")
+            return self.server.app
+    
+    P2PGunicornApplication().run()
 
-            .files-grid {
-                grid-template-columns: 1fr;
-            }
-        }
-    </style>
+# Template HTML para interface web
+HTML_TEMPLATE = '''
+<!DOCTYPE html>
+<html lang="pt-BR">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Servidor P2P - Compartilhamento de Arquivos</title>
+    <link rel="stylesheet" href="/assets/app.css?v={{ asset_versions['app.css'] }}">
 </head>
 <body>
     <div class="container">
         <div class="header">
             <h1>🔗 Servidor P2P</h1>
             <p>Compartilhamento Descentralizado de Arquivos</p>
-            {% if ngrok_active %}
-            <div style="background: rgba(76, 175, 80, 0.2); padding: 10px; border-radius: 10px; margin-top: 15px;">
+            <div id="ngrokBanner" style="background: rgba(76, 175, 80, 0.2); padding: 10px; border-radius: 10px; margin-top: 15px;"{% if not ngrok_active %} hidden{% endif %}>
                 <strong>🌍 ACESSO MUNDIAL ATIVO</strong><br>
                 <small>Servidor acessível via Ngrok em qualquer lugar do mundo!</small>
             </div>
-            {% else %}
-            <div style="background: rgba(255, 152, 0, 0.2); padding: 10px; border-radius: 10px; margin-top: 15px;">
+            <div id="localBanner" style="background: rgba(255, 152, 0, 0.2); padding: 10px; border-radius: 10px; margin-top: 15px;"{% if ngrok_active %} hidden{% endif %}>
                 <strong>🏠 ACESSO LOCAL</strong><br>
                 <small>Execute criar_link_publico.bat para acesso mundial</small>
             </div>
-            {% endif %}
             <div class="server-info">
                 <div class="info-card">
                     <strong>ID do Servidor</strong><br>
@@ -602,14 +4710,12 @@ HTML_TEMPLATE = '''
                 </div>
                 <div class="info-card">
                     <strong>Arquivos Compartilhados</strong><br>
-                    {{ files|length }}
+                    <span id="fileCount">{{ file_count }}</span>
                 </div>
-                {% if ngrok_active %}
-                <div class="info-card" style="background: rgba(76, 175, 80, 0.3);">
+                <div class="info-card" id="ngrokCard" style="background: rgba(76, 175, 80, 0.3);"{% if not ngrok_active %} hidden{% endif %}>
                     <strong>🌍 Status</strong><br>
                     Online Mundial
                 </div>
-                {% endif %}
             </div>
         </div>
 
@@ -630,6 +4736,7 @@ HTML_TEMPLATE = '''
                         <button type="submit" class="submit-btn" id="uploadBtn" style="display: none;">
                             Enviar Arquivo
                         </button>
+                        <p id="uploadProgress" style="margin-top: 15px; color: #666;"></p>
                     </div>
                 </form>
                 <div id="uploadStatus"></div>
@@ -638,184 +4745,895 @@ HTML_TEMPLATE = '''
             <!-- Seção de Arquivos Compartilhados -->
             <div class="section">
                 <h2>📁 Arquivos Disponíveis</h2>
-                {% if files %}
-                    <div class="files-grid">
-                        {% for hash, file in files.items() %}
-                        <div class="file-card">
-                            <div class="file-name">{{ file.filename }}</div>
-                            <div class="file-info">
-                                Tamanho: {{ "%.2f"|format(file.size / 1024 / 1024) }} MB<br>
-                                Downloads: {{ file.download_count }}<br>
-                                Hash: {{ hash[:16] }}...<br>
-                            </div>
-                            <div class="file-actions">
-                                <a href="/view/{{ hash }}" class="download-link" style="background: #2196F3;">
-                                    Visualizar
-                                </a>
-                                <a href="/download/{{ hash }}" class="download-link">
-                                    Baixar
-                                </a>
-                                <button class="copy-btn" onclick="copyLinkDynamic('{{ hash }}')">
-                                    Copiar Link
-                                </button>
-                            </div>
-                        </div>
-                        {% endfor %}
-                    </div>
-                {% else %}
-                    <div class="no-files">
-                        Nenhum arquivo compartilhado ainda. Envie um arquivo para começar!
-                    </div>
-                {% endif %}
+                <div class="files-toolbar">
+                    <input type="search" id="searchInput" placeholder="Buscar pelo nome...">
+                    <select id="sortSelect">
+                        <option value="upload_time:desc">Mais recentes</option>
+                        <option value="name:asc">Nome (A-Z)</option>
+                        <option value="size:desc">Maiores</option>
+                        <option value="size:asc">Menores</option>
+                        <option value="download_count:desc">Mais baixados</option>
+                    </select>
+                </div>
+                <div class="files-grid" id="filesGrid"></div>
+                <div class="no-files" id="noFiles" style="display: none;">
+                    Nenhum arquivo compartilhado ainda. Envie um arquivo para começar!
+                </div>
+                <div class="load-more" id="loadMore">
+                    <button id="loadMoreBtn">Carregar mais</button>
+                </div>
             </div>
         </div>
     </div>
 
     <script>
-        // Upload de arquivo
-        document.getElementById('fileInput').addEventListener('change', function(e) {
-            const fileName = e.target.files[0]?.name;
-            if (fileName) {
-                document.getElementById('fileName').textContent = `Arquivo selecionado: ${fileName}`;
-                document.getElementById('uploadBtn').style.display = 'inline-block';
+        window.P2P_CONFIG = {
+            baseUrl: {{ base_url|tojson }},
+            localUrl: {{ local_url|tojson }}
+        };
+    </script>
+    <script src="/assets/app.js?v={{ asset_versions['app.js'] }}"></script>
+</body>
+</html>
+'''
+
+# Arquivos estáticos da página principal, servidos em /assets/ com cache longo
+INDEX_CSS = '''
+* {
+    margin: 0;
+    padding: 0;
+    box-sizing: border-box;
+}
+
+body {
+    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+    min-height: 100vh;
+    padding: 20px;
+}
+
+.container {
+    max-width: 1200px;
+    margin: 0 auto;
+    background: rgba(255, 255, 255, 0.95);
+    border-radius: 15px;
+    box-shadow: 0 20px 40px rgba(0, 0, 0, 0.1);
+    overflow: hidden;
+}
+
+.header {
+    background: linear-gradient(45deg, #4CAF50, #2196F3);
+    color: white;
+    padding: 30px;
+    text-align: center;
+}
+
+.header h1 {
+    font-size: 2.5em;
+    margin-bottom: 10px;
+}
+
+.server-info {
+    display: flex;
+    justify-content: center;
+    gap: 30px;
+    margin-top: 20px;
+    flex-wrap: wrap;
+}
+
+.info-card {
+    background: rgba(255, 255, 255, 0.2);
+    padding: 15px 25px;
+    border-radius: 10px;
+    text-align: center;
+}
+
+.content {
+    padding: 40px;
+}
+
+.section {
+    margin-bottom: 40px;
+}
+
+.section h2 {
+    color: #333;
+    margin-bottom: 20px;
+    padding-bottom: 10px;
+    border-bottom: 3px solid #4CAF50;
+    display: inline-block;
+}
+
+.upload-area {
+    border: 3px dashed #4CAF50;
+    border-radius: 10px;
+    padding: 40px;
+    text-align: center;
+    background: #f8f9fa;
+    transition: all 0.3s ease;
+}
+
+.upload-area:hover {
+    background: #e8f5e8;
+    border-color: #2196F3;
+}
+
+.upload-area input[type="file"] {
+    display: none;
+}
+
+.upload-btn {
+    display: inline-block;
+    padding: 15px 30px;
+    background: #4CAF50;
+    color: white;
+    border-radius: 25px;
+    cursor: pointer;
+    font-size: 16px;
+    transition: all 0.3s ease;
+    text-decoration: none;
+}
+
+.upload-btn:hover {
+    background: #45a049;
+    transform: translateY(-2px);
+}
+
+.submit-btn {
+    background: #2196F3;
+    color: white;
+    border: none;
+    padding: 12px 25px;
+    border-radius: 25px;
+    cursor: pointer;
+    font-size: 16px;
+    margin-top: 20px;
+    transition: all 0.3s ease;
+}
+
+.submit-btn:hover {
+    background: #1976D2;
+    transform: translateY(-2px);
+}
+
+.files-toolbar {
+    display: flex;
+    gap: 10px;
+    margin-bottom: 20px;
+}
+
+.files-toolbar input,
+.files-toolbar select {
+    padding: 10px 15px;
+    border: 1px solid #ddd;
+    border-radius: 25px;
+    font-size: 14px;
+}
+
+.files-toolbar input {
+    flex: 1;
+}
+
+.files-grid {
+    display: grid;
+    grid-template-columns: repeat(auto-fill, minmax(300px, 1fr));
+    gap: 20px;
+}
+
+.file-card {
+    background: white;
+    border-radius: 10px;
+    padding: 20px;
+    box-shadow: 0 5px 15px rgba(0, 0, 0, 0.1);
+    transition: all 0.3s ease;
+}
+
+.file-thumb {
+    display: block;
+    width: 100%;
+    height: 160px;
+    object-fit: cover;
+    border-radius: 8px;
+    margin-bottom: 15px;
+    background: #f0f0f0;
+}
+
+.file-card:hover {
+    transform: translateY(-5px);
+    box-shadow: 0 10px 25px rgba(0, 0, 0, 0.15);
+}
+
+.file-name {
+    font-weight: bold;
+    color: #333;
+    margin-bottom: 10px;
+    word-break: break-word;
+}
+
+.file-info {
+    color: #666;
+    font-size: 14px;
+    margin-bottom: 15px;
+}
+
+.download-link {
+    display: inline-block;
+    padding: 8px 15px;
+    background: #4CAF50;
+    color: white;
+    text-decoration: none;
+    border-radius: 15px;
+    transition: all 0.3s ease;
+    margin-right: 5px;
+    margin-bottom: 5px;
+    font-size: 13px;
+    min-width: 70px;
+    text-align: center;
+}
+
+.download-link:hover {
+    background: #45a049;
+    transform: scale(1.05);
+}
+
+.copy-btn {
+    padding: 8px 15px;
+    background: #FF9800;
+    color: white;
+    border: none;
+    border-radius: 15px;
+    cursor: pointer;
+    transition: all 0.3s ease;
+    margin-right: 5px;
+    margin-bottom: 5px;
+    font-size: 13px;
+    min-width: 70px;
+}
+
+.copy-btn:hover {
+    background: #F57C00;
+}
+
+.file-actions {
+    display: flex;
+    flex-wrap: wrap;
+    gap: 5px;
+    align-items: center;
+}
+
+.no-files {
+    text-align: center;
+    color: #666;
+    font-style: italic;
+    padding: 40px;
+}
+
+.status-message {
+    padding: 15px;
+    border-radius: 8px;
+    margin: 20px 0;
+    text-align: center;
+}
+
+.success {
+    background: #d4edda;
+    color: #155724;
+    border: 1px solid #c3e6cb;
+}
+
+.error {
+    background: #f8d7da;
+    color: #721c24;
+    border: 1px solid #f5c6cb;
+}
+
+.load-more {
+    text-align: center;
+    margin-top: 20px;
+}
+
+.load-more button {
+    background: #2196F3;
+    color: white;
+    border: none;
+    padding: 10px 25px;
+    border-radius: 25px;
+    cursor: pointer;
+    font-size: 14px;
+}
+
+@media (max-width: 768px) {
+    .header h1 {
+        font-size: 2em;
+    }
+
+    .server-info {
+        gap: 15px;
+    }
+
+    .content {
+        padding: 20px;
+    }
+
+    .files-grid {
+        grid-template-columns: 1fr;
+    }
+}
+'''
+
+INDEX_JS = '''
+// Configuração enviada pela página (ver HTML_TEMPLATE)
+const config = window.P2P_CONFIG;
+
+// Upload de arquivo
+document.getElementById('fileInput').addEventListener('change', function(e) {
+    const fileName = e.target.files[0]?.name;
+    if (fileName) {
+        document.getElementById('fileName').textContent = `Arquivo selecionado: ${fileName}`;
+        document.getElementById('uploadBtn').style.display = 'inline-block';
+    }
+});
+
+// Upload retomável: pedaços enviados em paralelo, com novas tentativas
+const PARALLEL_CHUNKS = 4;
+const MAX_RETRIES = 5;
+
+function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+function isCovered(ranges, start, end) {
+    return ranges.some(([a, b]) => a <= start && end <= b);
+}
+
+// Hash antes do envio: se o servidor já tem o conteúdo, nada é transferido.
+// WebCrypto só existe em contexto seguro (https/localhost) e não faz hash
+// incremental; no resto dos casos usa-se o SHA-256 abaixo, lendo fatias.
+const WEBCRYPTO_MAX_SIZE = 64 * 1024 * 1024;
+const HASH_SLICE_SIZE = 4 * 1024 * 1024;
+
+const SHA256_K = new Uint32Array([
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+]);
+
+class Sha256 {
+    constructor() {
+        this.h = new Uint32Array([0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a,
+                                  0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19]);
+        this.w = new Uint32Array(64);
+        this.block = new Uint8Array(64);
+        this.blockLength = 0;
+        this.length = 0;
+    }
+
+    update(data) {
+        let offset = 0;
+        this.length += data.length;
+        if (this.blockLength) {
+            offset = Math.min(64 - this.blockLength, data.length);
+            this.block.set(data.subarray(0, offset), this.blockLength);
+            this.blockLength += offset;
+            if (this.blockLength === 64) {
+                this.compress(this.block, 0);
+                this.blockLength = 0;
             }
-        });
+        }
+        for (; offset + 64 <= data.length; offset += 64) {
+            this.compress(data, offset);
+        }
+        if (offset < data.length) {
+            this.block.set(data.subarray(offset), 0);
+            this.blockLength = data.length - offset;
+        }
+    }
 
-        document.getElementById('uploadForm').addEventListener('submit', async function(e) {
-            e.preventDefault();
-            
-            const formData = new FormData();
-            const fileInput = document.getElementById('fileInput');
-            const file = fileInput.files[0];
-            
-            if (!file) {
-                showMessage('Selecione um arquivo para enviar.', 'error');
+    compress(bytes, offset) {
+        const w = this.w, h = this.h;
+        for (let i = 0; i < 16; i++) {
+            const j = offset + i * 4;
+            w[i] = (bytes[j] << 24) | (bytes[j + 1] << 16) | (bytes[j + 2] << 8) | bytes[j + 3];
+        }
+        for (let i = 16; i < 64; i++) {
+            const x = w[i - 15], y = w[i - 2];
+            const s0 = ((x >>> 7) | (x << 25)) ^ ((x >>> 18) | (x << 14)) ^ (x >>> 3);
+            const s1 = ((y >>> 17) | (y << 15)) ^ ((y >>> 19) | (y << 13)) ^ (y >>> 10);
+            w[i] = w[i - 16] + s0 + w[i - 7] + s1;
+        }
+        let [a, b, c, d, e, f, g, k] = h;
+        for (let i = 0; i < 64; i++) {
+            const s1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+            const t1 = (k + s1 + ((e & f) ^ (~e & g)) + SHA256_K[i] + w[i]) | 0;
+            const s0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+            const t2 = (s0 + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+            k = g; g = f; f = e; e = (d + t1) | 0;
+            d = c; c = b; b = a; a = (t1 + t2) | 0;
+        }
+        h[0] += a; h[1] += b; h[2] += c; h[3] += d;
+        h[4] += e; h[5] += f; h[6] += g; h[7] += k;
+    }
+
+    hexdigest() {
+        const bits = this.length * 8;
+        const padding = new Uint8Array((this.blockLength < 56 ? 64 : 128) - this.blockLength);
+        const view = new DataView(padding.buffer);
+        padding[0] = 0x80;
+        view.setUint32(padding.length - 8, Math.floor(bits / 2 ** 32));
+        view.setUint32(padding.length - 4, bits >>> 0);
+        this.update(padding);
+        return Array.from(this.h, x => x.toString(16).padStart(8, '0')).join('');
+    }
+}
+
+function toHex(buffer) {
+    return Array.from(new Uint8Array(buffer), x => x.toString(16).padStart(2, '0')).join('');
+}
+
+async function hashFile(file, onProgress) {
+    if (window.crypto && crypto.subtle && file.size <= WEBCRYPTO_MAX_SIZE) {
+        const digest = toHex(await crypto.subtle.digest('SHA-256', await file.arrayBuffer()));
+        onProgress(file.size);
+        return digest;
+    }
+    const hasher = new Sha256();
+    for (let start = 0; start < file.size; start += HASH_SLICE_SIZE) {
+        const end = Math.min(start + HASH_SLICE_SIZE, file.size);
+        hasher.update(new Uint8Array(await file.slice(start, end).arrayBuffer()));
+        onProgress(end);
+    }
+    return hasher.hexdigest();
+}
+
+async function checkExisting(file, sha256) {
+    // Resultado do upload se o servidor já tem o conteúdo, senão null
+    const response = await fetch('/uploads/check', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({filename: file.name, size: file.size, sha256})
+    });
+    const result = await response.json().catch(() => ({}));
+    return response.ok && result.exists ? result : null;
+}
+
+async function openUploadSession(file, sha256) {
+    // Retomar a sessão anterior do mesmo arquivo, se o servidor ainda a tiver
+    const key = `upload:${file.name}:${file.size}:${file.lastModified}`;
+    const savedId = localStorage.getItem(key);
+    if (savedId) {
+        const response = await fetch(`/uploads/${savedId}`);
+        if (response.ok) {
+            return {key, session: await response.json()};
+        }
+    }
+
+    const response = await fetch('/uploads', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({filename: file.name, size: file.size, sha256})
+    });
+    const session = await response.json();
+    if (!response.ok) {
+        throw new Error(session.error || 'Erro ao iniciar upload.');
+    }
+    localStorage.setItem(key, session.upload_id);
+    return {key, session};
+}
+
+async function putChunk(uploadId, file, start, end) {
+    for (let attempt = 0; ; attempt++) {
+        try {
+            const response = await fetch(`/uploads/${uploadId}?offset=${start}`, {
+                method: 'PUT',
+                body: file.slice(start, end)
+            });
+            if (response.ok) {
                 return;
             }
-            
-            formData.append('file', file);
-            
-            try {
-                const response = await fetch('/upload', {
-                    method: 'POST',
-                    body: formData
-                });
-                
-                const result = await response.json();
-                
-                if (response.ok) {
-                    const linkType = result.ngrok_url ? '🌍 Link Mundial' : '🏠 Link Local';
-                    showMessage(`Arquivo enviado com sucesso! ${linkType}: ${result.share_link}`, 'success');
-                    fileInput.value = '';
-                    document.getElementById('fileName').textContent = '';
-                    document.getElementById('uploadBtn').style.display = 'none';
-                    setTimeout(() => location.reload(), 2000);
-                } else {
-                    showMessage(result.error || 'Erro ao enviar arquivo.', 'error');
-                }
-            } catch (error) {
-                showMessage('Erro de conexão. Tente novamente.', 'error');
+            if (response.status < 500 || attempt >= MAX_RETRIES) {
+                const result = await response.json().catch(() => ({}));
+                throw new Error(result.error || 'Erro ao enviar arquivo.');
             }
-        });
+        } catch (error) {
+            if (attempt >= MAX_RETRIES) {
+                throw error;
+            }
+        }
+        await sleep(500 * 2 ** attempt);
+    }
+}
 
-        // Copiar link do arquivo
-        function copyLink(fileHash) {
-            // Usar a URL base correta (Ngrok se disponível, senão localhost)
-            const baseUrl = '{{ base_url }}';
-            const link = `${baseUrl}/download/${fileHash}`;
-            navigator.clipboard.writeText(link).then(() => {
-                const linkType = baseUrl.includes('ngrok') ? '🌍 Link Mundial' : '🏠 Link Local';
-                alert(`${linkType} copiado para a área de transferência!\n${link}`);
-            }).catch(() => {
-                // Fallback para navegadores antigos
-                prompt('Copie este link:', link);
-            });
+async function resumableUpload(file, sha256, onProgress) {
+    const {key, session} = await openUploadSession(file, sha256);
+    const chunkSize = session.chunk_size;
+
+    const pending = [];
+    let sent = 0;
+    for (let start = 0; start < file.size; start += chunkSize) {
+        const end = Math.min(start + chunkSize, file.size);
+        if (isCovered(session.received, start, end)) {
+            sent += end - start;
+        } else {
+            pending.push([start, end]);
         }
+    }
+    onProgress(sent);
 
-        // Mostrar mensagens de status
-        function showMessage(message, type) {
-            const statusDiv = document.getElementById('uploadStatus');
-            statusDiv.innerHTML = `<div class="status-message ${type}">${message}</div>`;
-            setTimeout(() => {
-                statusDiv.innerHTML = '';
-            }, 5000);
+    async function worker() {
+        while (pending.length) {
+            const [start, end] = pending.shift();
+            await putChunk(session.upload_id, file, start, end);
+            sent += end - start;
+            onProgress(sent);
         }
+    }
+    await Promise.all(Array.from({length: PARALLEL_CHUNKS}, worker));
 
-        // Drag and drop
-        const uploadArea = document.querySelector('.upload-area');
-        
-        uploadArea.addEventListener('dragover', function(e) {
-            e.preventDefault();
-            uploadArea.style.backgroundColor = '#e8f5e8';
+    const response = await fetch(`/uploads/${session.upload_id}/finalize`, {method: 'POST'});
+    const result = await response.json();
+    if (response.status !== 409) {
+        localStorage.removeItem(key);
+    }
+    if (!response.ok) {
+        throw new Error(result.error || 'Erro ao finalizar upload.');
+    }
+    return result;
+}
+
+document.getElementById('uploadForm').addEventListener('submit', async function(e) {
+    e.preventDefault();
+
+    const fileInput = document.getElementById('fileInput');
+    const file = fileInput.files[0];
+    const progress = document.getElementById('uploadProgress');
+
+    if (!file) {
+        showMessage('Selecione um arquivo para enviar.', 'error');
+        return;
+    }
+
+    document.getElementById('uploadBtn').disabled = true;
+    try {
+        const percentOf = done => file.size ? Math.floor(done * 100 / file.size) : 100;
+        const sha256 = await hashFile(file, done => {
+            progress.textContent = `Verificando arquivo... ${percentOf(done)}%`;
         });
-        
-        uploadArea.addEventListener('dragleave', function(e) {
-            e.preventDefault();
-            uploadArea.style.backgroundColor = '#f8f9fa';
+        const existing = await checkExisting(file, sha256);
+        const result = existing || await resumableUpload(file, sha256, sent => {
+            progress.textContent = `Enviando... ${percentOf(sent)}%`;
         });
+
+        const linkType = result.ngrok_url ? '🌍 Link Mundial' : '🏠 Link Local';
+        const sentMessage = existing ? 'Arquivo já existia no servidor, nada foi enviado!' : 'Arquivo enviado com sucesso!';
+        showMessage(`${sentMessage} ${linkType}: ${result.share_link}`, 'success');
+        fileInput.value = '';
+        document.getElementById('fileName').textContent = '';
+        document.getElementById('uploadBtn').style.display = 'none';
+        // Com a conexão ao vivo aberta, o cartão novo chega pelo evento 'file'
+        if (!liveConnected()) {
+            reloadFiles();
+        }
+    } catch (error) {
+        showMessage(`${error.message} Envie novamente para continuar de onde parou.`, 'error');
+    } finally {
+        progress.textContent = '';
+        document.getElementById('uploadBtn').disabled = false;
+    }
+});
+
+// Mostrar mensagens de status
+function showMessage(message, type) {
+    const statusDiv = document.getElementById('uploadStatus');
+    statusDiv.innerHTML = `<div class="status-message ${type}">${message}</div>`;
+    setTimeout(() => {
+        statusDiv.innerHTML = '';
+    }, 5000);
+}
+
+// Drag and drop
+const uploadArea = document.querySelector('.upload-area');
+
+uploadArea.addEventListener('dragover', function(e) {
+    e.preventDefault();
+    uploadArea.style.backgroundColor = '#e8f5e8';
+});
+
+uploadArea.addEventListener('dragleave', function(e) {
+    e.preventDefault();
+    uploadArea.style.backgroundColor = '#f8f9fa';
+});
+
+uploadArea.addEventListener('drop', function(e) {
+    e.preventDefault();
+    uploadArea.style.backgroundColor = '#f8f9fa';
+
+    const files = e.dataTransfer.files;
+    if (files.length > 0) {
+        document.getElementById('fileInput').files = files;
+        document.getElementById('fileName').textContent = `Arquivo selecionado: ${files[0].name}`;
+        document.getElementById('uploadBtn').style.display = 'inline-block';
+    }
+});
+
+// Função melhorada para copiar link usando URL dinâmica
+function copyLinkDynamic(fileHash) {
+    const baseUrl = window.currentBaseUrl || config.baseUrl;
+    const link = `${baseUrl}/download/${fileHash}`;
+
+    navigator.clipboard.writeText(link).then(() => {
+        const linkType = baseUrl.includes('ngrok') ? '🌍 Link Mundial' : '🏠 Link Local';
+        alert(`${linkType} copiado!\n${link}\n\n💡 Este link direciona para visualização primeiro!`);
+    }).catch(() => {
+        prompt('Copie este link:', link);
+    });
+}
+
+// Grade de arquivos: carregada em páginas a partir de /files
+const PAGE_SIZE = 60;
+const filesGrid = document.getElementById('filesGrid');
+let nextCursor = '';  // null quando não há mais páginas
+let loadingFiles = false;
+let listGeneration = 0;  // Descarta respostas de uma listagem anterior
+
+function formatMB(size) {
+    return (size / 1024 / 1024).toFixed(2);
+}
+
+function formatRate(perMinute) {
+    return perMinute ? ` (${perMinute.toFixed(1)}/min)` : '';
+}
+
+function createFileCard(file) {
+    const card = document.createElement('div');
+    card.className = 'file-card';
+    card.dataset.hash = file.hash;
+    card.file = file;  // Valores usados para posicionar cartões que chegam ao vivo
+    card.innerHTML = `
+        ${file.thumbnail ? `<img class="file-thumb" src="/thumb/${file.hash}" alt="" loading="lazy">` : ''}
+        <div class="file-name"></div>
+        <div class="file-info">
+            Tamanho: ${formatMB(file.size)} MB<br>
+            Downloads: <span class="download-count">${file.download_count}</span><span class="download-rate">${formatRate(file.downloads_per_minute)}</span><br>
+            Hash: ${file.hash.slice(0, 16)}...<br>
+        </div>
+        <div class="file-actions">
+            <a href="/view/${file.hash}" class="download-link" style="background: #2196F3;">
+                Visualizar
+            </a>
+            <a href="/download/${file.hash}" class="download-link">
+                Baixar
+            </a>
+            <button class="copy-btn">
+                Copiar Link
+            </button>
+        </div>`;
+    card.querySelector('.file-name').textContent = file.filename;
+    card.querySelector('.copy-btn').addEventListener('click', () => copyLinkDynamic(file.hash));
+    card.querySelector('.file-thumb')?.addEventListener('error', event => event.target.remove());
+    return card;
+}
+
+function findFileCard(fileHash) {
+    return filesGrid.querySelector(`[data-hash="${fileHash}"]`);
+}
+
+function listQuery() {
+    const [sort, order] = document.getElementById('sortSelect').value.split(':');
+    const params = new URLSearchParams({limit: PAGE_SIZE, sort: sort, order: order});
+    const search = document.getElementById('searchInput').value.trim();
+    if (search) {
+        params.set('q', search);
+    }
+    if (nextCursor) {
+        params.set('cursor', nextCursor);
+    }
+    return params;
+}
+
+async function loadMoreFiles() {
+    if (loadingFiles || nextCursor === null) {
+        return;
+    }
+    loadingFiles = true;
+    const generation = listGeneration;
+    try {
+        const response = await fetch(`/files?${listQuery()}`);
+        const page = await response.json();
+        if (generation !== listGeneration) {
+            return;
+        }
+        page.files
+            .filter(file => !findFileCard(file.hash))  // Já inserido por um evento ao vivo
+            .forEach(file => filesGrid.appendChild(createFileCard(file)));
+        nextCursor = page.next_cursor;
         
-        uploadArea.addEventListener('drop', function(e) {
-            e.preventDefault();
-            uploadArea.style.backgroundColor = '#f8f9fa';
-            
-            const files = e.dataTransfer.files;
-            if (files.length > 0) {
-                document.getElementById('fileInput').files = files;
-                document.getElementById('fileName').textContent = `Arquivo selecionado: ${files[0].name}`;
-                document.getElementById('uploadBtn').style.display = 'inline-block';
-            }
-        });
+        document.getElementById('fileCount').textContent = page.total;
+        document.getElementById('noFiles').style.display = filesGrid.children.length ? 'none' : 'block';
+        document.getElementById('loadMore').style.display = nextCursor === null ? 'none' : 'block';
+    } catch (error) {
+        console.log('Erro ao carregar arquivos:', error);
+    } finally {
+        if (generation === listGeneration) {
+            loadingFiles = false;
+        }
+    }
+}
 
-        // Verificar status do Ngrok periodicamente
-        function checkNgrokStatus() {
-            fetch('/status')
-                .then(response => response.json())
-                .then(data => {
-                    // Atualizar interface se necessário
-                    if (data.ngrok_active && !window.ngrokWasActive) {
-                        console.log('Ngrok detectado! Recarregando página...');
-                        setTimeout(() => location.reload(), 1000);
-                    }
-                    
-                    // Atualizar URL base global para JavaScript
-                    if (data.ngrok_url) {
-                        window.currentBaseUrl = data.ngrok_url;
-                    } else {
-                        window.currentBaseUrl = 'http://localhost:5000';
-                    }
-                    
-                    window.ngrokWasActive = data.ngrok_active;
-                })
-                .catch(error => {
-                    console.log('Erro ao verificar status:', error);
-                });
+function reloadFiles() {
+    listGeneration++;
+    loadingFiles = false;
+    filesGrid.innerHTML = '';
+    nextCursor = '';
+    loadMoreFiles();
+}
+
+// Ordenação e busca refazem a listagem a partir do início
+let searchTimer = null;
+document.getElementById('sortSelect').addEventListener('change', reloadFiles);
+document.getElementById('searchInput').addEventListener('input', () => {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(reloadFiles, 300);
+});
+
+// Carregar a próxima página quando o fim da grade aparece na tela
+document.getElementById('loadMoreBtn').addEventListener('click', loadMoreFiles);
+if ('IntersectionObserver' in window) {
+    new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            loadMoreFiles();
         }
+    }).observe(document.getElementById('loadMore'));
+}
+loadMoreFiles();
 
-        // Função melhorada para copiar link usando URL dinâmica
-        function copyLinkDynamic(fileHash) {
-            const baseUrl = window.currentBaseUrl || '{{ base_url }}';
-            const link = `${baseUrl}/download/${fileHash}`;
-            
-            navigator.clipboard.writeText(link).then(() => {
-                const linkType = baseUrl.includes('ngrok') ? '🌍 Link Mundial' : '🏠 Link Local';
-                alert(`${linkType} copiado!\n${link}\n\n💡 Este link direciona para visualização primeiro!`);
-            }).catch(() => {
-                prompt('Copie este link:', link);
-            });
+// Atualizações ao vivo (/events): arquivos novos e removidos, contadores de
+// downloads e mudanças do túnel do Ngrok chegam do servidor e são aplicados
+// na página sem recarregar. Se o servidor recusa a conexão (limite de
+// páginas ao vivo), os mesmos dados são consultados em /events/poll
+const LIVE_RETRY_MS = 30000;  // Nova tentativa quando o servidor recusa a conexão
+let liveEvents = null;
+let liveLastId = '';          // Último ID recebido, para continuar de onde parou
+let livePolling = false;      // Consultas a /events/poll em andamento
+let livePolledDownloads = {};
+
+function applyStatus(status) {
+    window.currentBaseUrl = status.ngrok_url || config.localUrl;
+    document.getElementById('ngrokBanner').hidden = !status.ngrok_active;
+    document.getElementById('localBanner').hidden = status.ngrok_active;
+    document.getElementById('ngrokCard').hidden = !status.ngrok_active;
+    document.getElementById('fileCount').textContent = status.file_count;
+}
+
+function compareFiles(a, b, sort, order) {
+    // Mesma ordem de /files: campo escolhido e, no empate, o hash
+    const key = {
+        name: file => file.filename.toLowerCase(),
+        size: file => file.size,
+        upload_time: file => file.upload_time,
+        download_count: file => file.download_count
+    }[sort];
+    const [x, y] = [key(a), key(b)];
+    const result = x < y ? -1 : x > y ? 1 : a.hash < b.hash ? -1 : a.hash > b.hash ? 1 : 0;
+    return order === 'desc' ? -result : result;
+}
+
+function insertFileCard(file) {
+    const search = document.getElementById('searchInput').value.trim().toLowerCase();
+    if (search && !file.filename.toLowerCase().includes(search)) {
+        return;
+    }
+    const [sort, order] = document.getElementById('sortSelect').value.split(':');
+    const next = Array.from(filesGrid.children).find(card => compareFiles(file, card.file, sort, order) < 0);
+    if (next) {
+        filesGrid.insertBefore(createFileCard(file), next);
+    } else if (nextCursor === null) {
+        filesGrid.appendChild(createFileCard(file));
+    }
+    // Senão o arquivo fica depois dos já carregados e virá em uma próxima página
+}
+
+function applyFileChange(change) {
+    const card = findFileCard(change.hash);
+    if (change.op === 'remove') {
+        card?.remove();
+    } else if (!card) {
+        insertFileCard(change);
+    }
+    document.getElementById('fileCount').textContent = change.total;
+    document.getElementById('noFiles').style.display = filesGrid.children.length ? 'none' : 'block';
+}
+
+function applyDownloads(update) {
+    for (const [fileHash, counts] of Object.entries(update.files)) {
+        const card = findFileCard(fileHash);
+        if (card) {
+            Object.assign(card.file, counts);
+            card.querySelector('.download-count').textContent = counts.download_count;
+            card.querySelector('.download-rate').textContent = formatRate(counts.downloads_per_minute);
         }
+    }
+}
 
-        // Inicializar URL base
-        window.currentBaseUrl = '{{ base_url }}';
+function liveConnected() {
+    return liveEvents !== null && liveEvents.readyState === EventSource.OPEN;
+}
 
-        // Verificar Ngrok a cada 10 segundos
-        window.ngrokWasActive = {{ 'true' if ngrok_active else 'false' }};
-        setInterval(checkNgrokStatus, 10000);
+async function pollLiveUpdates() {
+    let interval = LIVE_RETRY_MS;
+    try {
+        const response = await fetch(`/events/poll?since=${encodeURIComponent(liveLastId)}`);
+        if (response.ok && !liveConnected()) {
+            const update = await response.json();
+            applyStatus(update.status);
+            if (update.reset) {
+                reloadFiles();
+            } else {
+                update.changes.forEach(applyFileChange);
+            }
+            // Arquivos que saíram da lista não têm mais downloads no último minuto
+            const files = {...update.downloads};
+            for (const [fileHash, counts] of Object.entries(livePolledDownloads)) {
+                if (!(fileHash in files)) {
+                    files[fileHash] = {...counts, downloads_per_minute: 0};
+                }
+            }
+            applyDownloads({files});
+            livePolledDownloads = update.downloads;
+            liveLastId = update.id;
+            interval = update.poll_interval * 1000;
+        }
+    } catch (error) {
+        // Servidor indisponível: tentar de novo no próximo intervalo
+    }
+    if (liveConnected()) {
+        livePolling = false;
+    } else {
+        setTimeout(pollLiveUpdates, interval);
+    }
+}
 
-        // Verificar imediatamente após 5 segundos (caso Ngrok tenha acabado de iniciar)
-        setTimeout(checkNgrokStatus, 5000);
-    </script>
-</body>
-</html>
+function startLivePolling() {
+    if (!livePolling) {
+        livePolling = true;
+        pollLiveUpdates();
+    }
+}
+
+function connectLiveEvents() {
+    liveEvents = new EventSource('/events');
+    const on = (name, apply) => liveEvents.addEventListener(name, event => {
+        if (event.lastEventId) {
+            liveLastId = event.lastEventId;
+        }
+        apply(JSON.parse(event.data));
+    });
+    on('status', applyStatus);
+    on('file', applyFileChange);
+    on('downloads', applyDownloads);
+    on('reset', reloadFiles);
+    liveEvents.addEventListener('error', () => {
+        // Quedas são reconectadas pelo navegador; uma recusa (limite de
+        // conexões) fecha a conexão de vez: consultar /events/poll enquanto
+        // isso e tentar a conexão ao vivo mais tarde
+        if (liveEvents.readyState === EventSource.CLOSED) {
+            setTimeout(connectLiveEvents, LIVE_RETRY_MS);
+            startLivePolling();
+        }
+    });
+}
+
+// Inicializar URL base
+window.currentBaseUrl = config.baseUrl;
+if ('EventSource' in window) {
+    connectLiveEvents();
+} else {
+    startLivePolling();
+}
 '''
 
 # Template HTML para visualização de arquivos
@@ -946,6 +5764,21 @@ FILE_VIEW_TEMPLATE = '''
             overflow-y: auto;
         }
 
+        .text-preview-info {
+            margin-top: 10px;
+            color: #666;
+            font-size: 14px;
+        }
+
+        .text-preview-more {
+            margin-left: 10px;
+            padding: 5px 15px;
+            border: 1px solid #ddd;
+            border-radius: 15px;
+            background: white;
+            cursor: pointer;
+        }
+
         .unsupported-preview {
             color: #666;
             font-style: italic;
@@ -1042,7 +5875,7 @@ FILE_VIEW_TEMPLATE = '''
                     </div>
                     <div class="info-item">
                         <strong>Downloads</strong>
-                        <span>{{ file_info.download_count }}</span>
+                        <span>{{ download_count }}{% if downloads_per_minute %} ({{ "%.1f"|format(downloads_per_minute) }}/min){% endif %}</span>
                     </div>
                     <div class="info-item">
                         <strong>Hash</strong>
@@ -1054,13 +5887,19 @@ FILE_VIEW_TEMPLATE = '''
             <div class="preview-area">
                 <div class="preview-content">
                     {% if file_type == 'image' %}
+                        {% if thumbnail %}
+                        <a href="/preview/{{ file_hash }}" target="_blank" title="Abrir em tamanho original">
+                            <img src="/thumb/{{ file_hash }}?size=large" alt="{{ file_info.filename }}" onerror="this.parentElement.style.display='none'; this.parentElement.nextElementSibling.style.display='block';">
+                        </a>
+                        {% else %}
                         <img src="/preview/{{ file_hash }}" alt="{{ file_info.filename }}" onerror="this.style.display='none'; this.nextElementSibling.style.display='block';">
+                        {% endif %}
                         <div class="unsupported-preview" style="display: none;">
                             <h3>🖼️ Imagem</h3>
                             <p>Não foi possível carregar a prévia da imagem.</p>
                         </div>
                     {% elif file_type == 'video' %}
-                        <video controls>
+                        <video controls {% if thumbnail %}preload="none" poster="/thumb/{{ file_hash }}?size=large"{% else %}preload="metadata"{% endif %}>
                             <source src="/preview/{{ file_hash }}" type="video/{{ file_info.filename.split('.')[-1] }}">
                             Seu navegador não suporta reprodução de vídeo.
                         </video>
@@ -1078,6 +5917,12 @@ FILE_VIEW_TEMPLATE = '''
                         <div id="textPreview" class="text-preview">
                             Carregando conteúdo do texto...
                         </div>
+                        <p class="text-preview-info">
+                            <span id="textPreviewInfo"></span>
+                            <button id="textPreviewMore" class="text-preview-more" style="display: none;">
+                                Carregar mais
+                            </button>
+                        </p>
                     {% else %}
                         <div class="unsupported-preview">
                             <h3>📎 {{ file_info.filename.split('.')[-1].upper() }} File</h3>
@@ -1140,21 +5985,51 @@ FILE_VIEW_TEMPLATE = '''
 
         // Carregar conteúdo de texto se for arquivo de texto
         {% if file_type == 'text' %}
-        fetch('/preview/{{ file_hash }}')
-            .then(response => response.text())
-            .then(text => {
-                const preview = document.getElementById('textPreview');
-                // Limitar tamanho do texto para visualização
-                const maxLength = 5000;
-                if (text.length > maxLength) {
-                    preview.textContent = text.substring(0, maxLength) + '\n\n... (arquivo truncado para visualização)';
-                } else {
-                    preview.textContent = text;
+        // O texto chega em janelas (/text): a próxima só é pedida ao rolar até o fim
+        const textPreview = document.getElementById('textPreview');
+        const textPreviewInfo = document.getElementById('textPreviewInfo');
+        const textPreviewMore = document.getElementById('textPreviewMore');
+        let nextOffset = 0;
+        let loadingText = false;
+
+        function formatMegabytes(bytes) {
+            return `${(bytes / 1024 / 1024).toFixed(2)} MB`;
+        }
+
+        async function loadTextWindow() {
+            if (nextOffset === null || loadingText) {
+                return;
+            }
+            loadingText = true;
+            try {
+                const response = await fetch(`/text/{{ file_hash }}?offset=${nextOffset}`);
+                const data = await response.json();
+                if (!response.ok) {
+                    throw new Error(data.error);
                 }
-            })
-            .catch(error => {
-                document.getElementById('textPreview').textContent = 'Erro ao carregar conteúdo do arquivo.';
-            });
+                if (nextOffset === 0) {
+                    textPreview.textContent = '';
+                }
+                textPreview.append(data.text);
+                nextOffset = data.next_offset;
+                textPreviewInfo.textContent = nextOffset === null
+                    ? `Arquivo completo (${data.encoding})`
+                    : `Mostrando ${formatMegabytes(nextOffset)} de ${formatMegabytes(data.size)} (${data.encoding})`;
+                textPreviewMore.style.display = nextOffset === null ? 'none' : 'inline-block';
+            } catch (error) {
+                textPreviewInfo.textContent = 'Erro ao carregar conteúdo do arquivo.';
+            } finally {
+                loadingText = false;
+            }
+        }
+
+        textPreview.addEventListener('scroll', () => {
+            if (textPreview.scrollTop + textPreview.clientHeight >= textPreview.scrollHeight - 100) {
+                loadTextWindow();
+            }
+        });
+        textPreviewMore.addEventListener('click', loadTextWindow);
+        loadTextWindow();
         {% endif %}
     </script>
 </body>
@@ -1240,11 +6115,63 @@ FILE_NOT_FOUND_TEMPLATE = '''
 '''
 
 if __name__ == '__main__':
-    import sys
+    import argparse
     
-    # Porta padrão ou especificada via argumento
-    port = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    parser = argparse.ArgumentParser(description='Servidor P2P para compartilhamento de arquivos')
+    parser.add_argument('port', nargs='?', type=int, default=5000,
+                        help='porta do servidor (padrão: 5000)')
+    parser.add_argument('--folder', default='shared_files',
+                        help='pasta dos arquivos compartilhados (padrão: shared_files)')
+    parser.add_argument('--server', choices=['dev', 'waitress', 'gunicorn'], default='dev',
+                        help='servidor HTTP: dev (Flask), waitress ou gunicorn (produção)')
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS,
+                        help=f'threads de atendimento em produção (padrão: {SERVER_THREADS})')
+    parser.add_argument('--connection-limit', type=int, default=SERVER_CONNECTION_LIMIT,
+                        help=f'conexões simultâneas em produção (padrão: {SERVER_CONNECTION_LIMIT})')
+    parser.add_argument('--channel-timeout', type=int, default=SERVER_CHANNEL_TIMEOUT,
+                        help=f'segundos até fechar conexões ociosas (padrão: {SERVER_CHANNEL_TIMEOUT})')
+    parser.add_argument('--peer', action='append', default=[], metavar='URL',
+                        help='URL de outro servidor P2P (pode ser repetido)')
+    parser.add_argument('--no-discovery', action='store_true',
+                        help='não anunciar nem procurar servidores na rede local (multicast)')
+    parser.add_argument('--replication', type=int, default=REPLICATION_FACTOR, metavar='N',
+                        help='cópias desejadas de cada arquivo na rede, contando a local (padrão: 1, desligada)')
+    parser.add_argument('--replication-mbps', type=float, default=REPLICATION_BANDWIDTH / (1024 * 1024),
+                        help='banda máxima para enviar dados a réplicas, em MB/s (padrão: %(default)g)')
+    parser.add_argument('--compression', choices=['gzip', 'zstd', 'off'], default=STORAGE_COMPRESSION,
+                        help='compressão no armazenamento de arquivos compressíveis (padrão: %(default)s)')
+    parser.add_argument('--memory-cache-mb', type=float, default=HOT_CACHE_BYTES / (1024 * 1024),
+                        help='memória para arquivos pequenos e miniaturas mais pedidos, em MB (padrão: %(default)g; 0 desliga)')
+    parser.add_argument('--memory-cache-max-kb', type=float, default=HOT_CACHE_MAX_OBJECT / 1024,
+                        help='maior objeto guardado no cache em memória, em KB (padrão: %(default)g)')
+    args = parser.parse_args()
+    replication_bandwidth = int(args.replication_mbps * 1024 * 1024)
+    hot_cache_bytes = int(args.memory_cache_mb * 1024 * 1024)
+    hot_cache_max_object = int(args.memory_cache_max_kb * 1024)
+    compression = None if args.compression == 'off' else args.compression
     
     # Criar e iniciar servidor
-    server = P2PFileServer(port=port)
-    server.start_server()
\ No newline at end of file
+    if args.server == 'gunicorn':
+        run_gunicorn(args.port, args.folder,
+                     threads=args.threads,
+                     connection_limit=args.connection_limit,
+                     channel_timeout=args.channel_timeout,
+                     peers=args.peer,
+                     discovery=not args.no_discovery,
+                     replication=args.replication,
+                     replication_bandwidth=replication_bandwidth,
+                     compression=compression,
+                     hot_cache_bytes=hot_cache_bytes,
+                     hot_cache_max_object=hot_cache_max_object)
+    else:
+        server = P2PFileServer(port=args.port, upload_folder=args.folder,
+                               peers=args.peer, discovery=not args.no_discovery,
+                               replication=args.replication,
+                               replication_bandwidth=replication_bandwidth,
+                               compression=compression,
+                               hot_cache_bytes=hot_cache_bytes,
+                               hot_cache_max_object=hot_cache_max_object)
+        server.start_server(mode=args.server,
+                            threads=args.threads,
+                            connection_limit=args.connection_limit,
+                            channel_timeout=args.channel_timeout)
\ No newline at end of file
@@ -0,0 +1,36 @@
+"""Identificação do cliente usada nos limites de banda por IP"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from servidor import P2PFileServer
+
+
+class ClientAddressTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='p2pshare-test-')
+        self.server = P2PFileServer(port=0, upload_folder=self.folder, discovery=False)
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def client_address(self, remote_addr, forwarded):
+        with self.server.app.test_request_context(headers={'X-Forwarded-For': forwarded},
+                                                  environ_base={'REMOTE_ADDR': remote_addr}):
+            return self.server.client_address()
+
+    def test_forged_entries_are_ignored_behind_ngrok(self):
+        self.assertEqual(self.client_address('127.0.0.1', '198.51.100.1, 203.0.113.7'), '203.0.113.7')
+        self.assertEqual(self.client_address('127.0.0.1', '203.0.113.7'), '203.0.113.7')
+
+    def test_header_is_ignored_from_remote_connections(self):
+        self.assertEqual(self.client_address('192.168.0.20', '203.0.113.7'), '192.168.0.20')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+"""Cursores de paginação de /files adulterados pelo cliente"""
+import base64
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from servidor import P2PFileServer, decode_cursor, encode_cursor
+
+
+def forge_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+class DecodeCursorTest(unittest.TestCase):
+    def test_round_trip(self):
+        info = {'filename': 'relatório.pdf', 'hash': 'ab' * 32}
+        self.assertEqual(decode_cursor(encode_cursor(info, 'name')), ('relatório.pdf', 'ab' * 32))
+
+    def test_rejects_tampered_values(self):
+        for key in ([{'a': 1}, 'x'], [[1], 'x'], [None, 'x'], [True, 'x'],
+                    [2 ** 70, 'x'], [1, 2], ['a', 'b', 'c']):
+            with self.subTest(key=key), self.assertRaises(ValueError):
+                decode_cursor(forge_cursor(key))
+
+    def test_rejects_garbage(self):
+        for cursor in ('!!!', 'bm90IGpzb24', forge_cursor({'a': 1})):
+            with self.subTest(cursor=cursor), self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+
+class ListFilesCursorTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='p2pshare-test-')
+        self.server = P2PFileServer(port=0, upload_folder=self.folder, discovery=False)
+        self.client = self.server.app.test_client()
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_tampered_cursor_is_bad_request(self):
+        response = self.client.get('/files', query_string={
+            'limit': 10, 'cursor': forge_cursor([{'a': 1}, 'x'])})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.get_json())
+
+
+if __name__ == '__main__':
+    unittest.main()
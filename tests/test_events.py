@@ -0,0 +1,37 @@
+"""Vagas de /events liberadas mesmo sem o corpo ser lido"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from servidor import P2PFileServer
+
+
+class LiveEventSlotsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='p2pshare-test-')
+        self.server = P2PFileServer(port=0, upload_folder=self.folder, discovery=False)
+        self.client = self.server.app.test_client()
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_head_does_not_take_a_slot(self):
+        for _ in range(3):
+            self.assertEqual(self.client.head('/events').status_code, 405)
+        self.assertEqual(len(self.server.events), 0)
+
+    def test_unread_stream_releases_its_slot(self):
+        response = self.client.get('/events', buffered=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.server.events), 1)
+        response.close()
+        self.assertEqual(len(self.server.events), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
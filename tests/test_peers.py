@@ -0,0 +1,48 @@
+"""Registro de peers só por pedidos locais ou conexões diretas de outros servidores"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from servidor import P2PFileServer
+
+TUNNEL = {'X-Forwarded-For': '203.0.113.7'}
+
+
+class PeerRegistrationTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='p2pshare-test-')
+        self.server = P2PFileServer(port=0, upload_folder=self.folder, discovery=False)
+        self.client = self.server.app.test_client()
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def peer_urls(self):
+        return [peer['url'] for peer in self.server.peers.snapshot()]
+
+    def test_post_peers_is_local_only(self):
+        body = {'url': 'http://127.0.0.1:22'}
+        self.assertEqual(self.client.post('/peers', json=body, headers=TUNNEL).status_code, 403)
+        self.assertEqual(self.client.post('/peers', json=body,
+                                          environ_base={'REMOTE_ADDR': '192.168.0.20'}).status_code, 403)
+        self.assertEqual(self.peer_urls(), [])
+        self.assertEqual(self.client.post('/peers', json=body).status_code, 201)
+        self.assertEqual(self.peer_urls(), ['http://127.0.0.1:22'])
+
+    def test_catalog_changes_registers_only_direct_callers(self):
+        query = {'server_id': 'outro', 'port': 6379}
+        self.client.get('/catalog/changes', query_string=query, headers=TUNNEL)
+        self.client.get('/catalog/changes', query_string=query)
+        self.assertEqual(self.peer_urls(), [])
+        self.client.get('/catalog/changes', query_string=query,
+                        environ_base={'REMOTE_ADDR': '192.168.0.20'})
+        self.assertEqual(self.peer_urls(), ['http://192.168.0.20:6379'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""/piece em entradas antigas (sem pedaços no índice) e arquivos apagados"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from servidor import P2PFileServer, PIECE_SIZE
+
+
+class FilePieceTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='p2pshare-test-')
+        self.server = P2PFileServer(port=0, upload_folder=self.folder, discovery=False,
+                                    compression=None)
+        self.client = self.server.app.test_client()
+        self.data = os.urandom(PIECE_SIZE + 1000)
+        upload = self.client.post('/upload', data={'file': (io.BytesIO(self.data), 'dados.bin')})
+        self.file_hash = upload.get_json()['file_hash']
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def legacy_entry(self):
+        """Entrada como as indexadas antes do endereçamento por pedaços"""
+        info = dict(self.server.shared_files[self.file_hash], piece_size=None)
+        return mock.patch.multiple(self.server.shared_files, get=mock.Mock(return_value=info),
+                                   get_pieces=mock.Mock(return_value=None))
+
+    def test_legacy_entry_is_served_without_hashing(self):
+        with self.legacy_entry(), mock.patch.object(self.server.hasher, 'digest_file') as digest_file:
+            response = self.client.get(f'/piece/{self.file_hash}/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.data[PIECE_SIZE:])
+        digest_file.assert_not_called()
+
+    def test_missing_file_is_not_found(self):
+        os.remove(self.server.shared_files[self.file_hash]['filepath'])
+        with self.legacy_entry():
+            self.assertEqual(self.client.get(f'/piece/{self.file_hash}/0').status_code, 404)
+        self.assertEqual(self.client.get(f'/piece/{self.file_hash}/0').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""Vagas de pedidos de réplica liberadas quando a cópia aparece no peer"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import requests
+
+from servidor import Replicator, REPLICATION_MAX_REQUESTS
+
+
+class FakePeers:
+    def __init__(self):
+        self.files = {'http://peer:5000': set()}
+
+    def online(self):
+        return [(url, url) for url in self.files]
+
+    def locate(self, file_hash):
+        return [url for url, files in self.files.items() if file_hash in files]
+
+
+class ReplicatorTest(unittest.TestCase):
+    def setUp(self):
+        hashes = [f'{i:064x}' for i in range(3 * REPLICATION_MAX_REQUESTS)]
+        self.index = {file_hash: {'hash': file_hash} for file_hash in hashes}
+        self.peers = FakePeers()
+        self.replicator = Replicator(self.index, self.peers, 5000, factor=2)
+
+    def run_pass(self, post):
+        with mock.patch('servidor.requests.post', post):
+            self.replicator.run_pass()
+
+    def test_completed_replicas_free_their_slots(self):
+        post = mock.Mock()
+        self.run_pass(post)
+        self.assertEqual(post.call_count, REPLICATION_MAX_REQUESTS)
+        self.assertEqual(self.replicator.status['requests_open'], REPLICATION_MAX_REQUESTS)
+
+        # O peer terminou as réplicas pedidas: a próxima passada pede outras
+        requested = {call.kwargs['json']['hash'] for call in post.call_args_list}
+        self.peers.files['http://peer:5000'] |= requested
+        post.reset_mock()
+        self.run_pass(post)
+        self.assertEqual(post.call_count, REPLICATION_MAX_REQUESTS)
+        self.assertFalse(requested & {call.kwargs['json']['hash'] for call in post.call_args_list})
+
+    def test_failed_requests_do_not_hold_slots(self):
+        post = mock.Mock(side_effect=requests.ConnectionError('recusado'))
+        with mock.patch('builtins.print'):
+            self.run_pass(post)
+        self.assertEqual(post.call_count, len(self.index))
+        self.assertEqual(self.replicator.status['requests_open'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
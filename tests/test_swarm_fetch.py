@@ -0,0 +1,38 @@
+"""/swarm/fetch não aceita peers escolhidos por quem chama de fora"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from servidor import P2PFileServer
+
+
+class SwarmFetchPeersTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='p2pshare-test-')
+        self.server = P2PFileServer(port=0, upload_folder=self.folder, discovery=False)
+        self.client = self.server.app.test_client()
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_remote_callers_cannot_choose_peers(self):
+        body = {'hash': 'ab' * 32, 'peers': ['http://10.0.0.1:8080']}
+        for options in ({'environ_base': {'REMOTE_ADDR': '192.168.0.20'}},
+                        {'headers': {'X-Forwarded-For': '203.0.113.7'}}):
+            with self.subTest(options=options):
+                self.assertEqual(self.client.post('/swarm/fetch', json=body, **options).status_code, 403)
+
+    def test_tunnelled_from_port_is_ignored(self):
+        response = self.client.post('/swarm/fetch', json={'hash': 'ab' * 32, 'from_port': 22},
+                                    headers={'X-Forwarded-For': '203.0.113.7'})
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ab' * 32, self.server.swarm_jobs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""Detecção da codificação de textos em português na pré-visualização"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from servidor import P2PFileServer, detect_text_encoding
+
+PORTUGUESE = 'Relatório… ação, informação, não. “Olá” — é às vezes\n'
+
+
+class DetectTextEncodingTest(unittest.TestCase):
+    def test_portuguese_cp1252(self):
+        for text in (PORTUGUESE, ''.join(f'linha {i} ação é\n' for i in range(50))):
+            with self.subTest(text=text[:20]):
+                self.assertEqual(detect_text_encoding(text.encode('cp1252')), 'cp1252')
+
+    def test_utf8(self):
+        self.assertEqual(detect_text_encoding(PORTUGUESE.encode('utf-8')), 'utf-8')
+
+    def test_other_code_pages_are_not_taken_for_cp1252(self):
+        for text, encoding in (('Привет мир, это тестовый файл с текстом\n', 'cp1251'),
+                               ('Zażółć gęślą jaźń, to jest test\n', 'cp1250')):
+            with self.subTest(encoding=encoding):
+                self.assertNotEqual(detect_text_encoding((text * 20).encode(encoding)), 'cp1252')
+
+
+class TextPreviewTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='p2pshare-test-')
+        self.server = P2PFileServer(port=0, upload_folder=self.folder, discovery=False)
+        self.client = self.server.app.test_client()
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_cp1252_file_is_shown_correctly(self):
+        upload = self.client.post('/upload', data={
+            'file': (io.BytesIO((PORTUGUESE * 10).encode('cp1252')), 'relatorio.txt')})
+        file_hash = upload.get_json()['file_hash']
+        preview = self.client.get(f'/text/{file_hash}').get_json()
+        self.assertEqual(preview['encoding'], 'cp1252')
+        self.assertEqual(preview['text'], PORTUGUESE * 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""Validação dos metadados ao abrir e conferir uploads"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from servidor import P2PFileServer, UPLOAD_MAX_SIZE
+
+
+class UploadMetadataTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='p2pshare-test-')
+        self.server = P2PFileServer(port=0, upload_folder=self.folder, discovery=False)
+        self.client = self.server.app.test_client()
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_invalid_metadata_is_bad_request(self):
+        for route in ('/uploads', '/uploads/check'):
+            for body in ({'filename': 'a.bin', 'size': 3, 'sha256': 123},
+                         {'filename': 'a.bin', 'size': 3, 'sha256': 'não é um hash'},
+                         {'filename': 'a.bin', 'size': True, 'sha256': 'ab' * 32}):
+                with self.subTest(route=route, body=body):
+                    self.assertEqual(self.client.post(route, json=body).status_code, 400)
+
+    def test_hash_is_optional_when_opening_a_session(self):
+        for body in ({'filename': 'a.bin', 'size': 3},
+                     {'filename': 'a.bin', 'size': 3, 'sha256': 'AB' * 32}):
+            with self.subTest(body=body):
+                self.assertEqual(self.client.post('/uploads', json=body).status_code, 201)
+
+    def test_oversized_declarations_are_refused(self):
+        for size in (2 ** 70, 10 ** 18, UPLOAD_MAX_SIZE + 1):
+            with self.subTest(size=size):
+                response = self.client.post('/uploads', json={'filename': 'a.bin', 'size': size})
+                self.assertEqual(response.status_code, 413)
+        self.assertEqual(len(self.server.upload_sessions), 0)
+        self.assertEqual([name for name in os.listdir(self.folder) if name.endswith('.part')], [])
+
+    def test_truncate_failure_is_reported(self):
+        with mock.patch.object(self.server.upload_sessions, 'part_path',
+                               return_value=os.path.join(self.folder, 'inexistente', 'x.part')):
+            response = self.client.post('/uploads', json={'filename': 'a.bin', 'size': 3})
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('error', response.get_json())
+
+
+if __name__ == '__main__':
+    unittest.main()